@@ -0,0 +1,91 @@
+// opponent_stream.js — shows the Practice Mode AI reply as it is generated.
+//
+// Called (as a Dash clientside callback) whenever the server puts a new
+// job id into 'opponent-stream-request'. The reply is generated by a
+// background job on the server (jobs.py); this polls /jobs/<id>?offset=N,
+// appends each new piece of text to the empty AI bubble
+// ('opponent-stream-text'), and when the job ends sends {id, text, error}
+// to 'opponent-stream-result' with set_props so the server can commit the
+// reply. Leaving the page (or the practice room) cancels the job.
+
+const POLL_INTERVAL_MS = 250;
+let activeJobId = null;
+
+function cancelJob(jobId) {
+    navigator.sendBeacon(`/jobs/${jobId}/cancel`);
+}
+
+window.addEventListener("pagehide", () => {
+    if (activeJobId) cancelJob(activeJobId);
+});
+
+window.dash_clientside = window.dash_clientside || {};
+window.dash_clientside.opponent = {
+    stream: function (request) {
+        if (!request || !request.id) {
+            return window.dash_clientside.no_update;
+        }
+        const jobId = request.id;
+        if (jobId === activeJobId) {
+            // A duplicate send was answered with the job already streaming.
+            return window.dash_clientside.no_update;
+        }
+        activeJobId = jobId;
+
+        const finish = (text, error) => {
+            if (activeJobId === jobId) activeJobId = null;
+            window.dash_clientside.set_props("opponent-stream-result", {
+                data: { id: jobId, text: text, error: error }
+            });
+        };
+
+        (async () => {
+            let text = "";
+            let offset = 0;
+            try {
+                while (true) {
+                    const bubble = document.getElementById("opponent-stream-text");
+                    if (!bubble) {
+                        // The user left the practice room; nobody is waiting for this reply.
+                        cancelJob(jobId);
+                        if (activeJobId === jobId) activeJobId = null;
+                        return;
+                    }
+
+                    const response = await fetch(`/jobs/${jobId}?offset=${offset}`);
+                    if (!response.ok) {
+                        finish(text, `Reply request failed (HTTP ${response.status})`);
+                        return;
+                    }
+                    const job = await response.json();
+                    if (job.progress) {
+                        text += job.progress;
+                        bubble.textContent = text;
+                        const chatWindow = document.getElementById("chat-window");
+                        if (chatWindow) chatWindow.scrollTop = chatWindow.scrollHeight;
+                    }
+                    offset = job.progress_length;
+
+                    if (job.status === "done") {
+                        finish(job.result ? job.result.text : text, null);
+                        return;
+                    }
+                    if (job.status === "failed") {
+                        finish(text, job.error || "Unknown error");
+                        return;
+                    }
+                    if (job.status === "cancelled") {
+                        finish(text, "The reply was cancelled.");
+                        return;
+                    }
+                    await new Promise((resolve) => setTimeout(resolve, POLL_INTERVAL_MS));
+                }
+            } catch (err) {
+                console.error("Opponent reply polling failed:", err);
+                finish(text, String(err));
+            }
+        })();
+
+        return window.dash_clientside.no_update;
+    }
+};
@@ -0,0 +1,42 @@
+import sys
+import argparse
+
+from dotenv import load_dotenv
+
+# --- One-off migration: debate_history.chat_history -> debate_turns ---
+# Debates saved before the debate_turns table existed keep their whole
+# transcript as one JSON blob. This moves each blob into per-turn rows and
+# clears it, a batch of debates per transaction, so it is safe to stop and
+# re-run at any point (finished debates are skipped, turns are never duplicated).
+#
+#   python backfill_debate_turns.py [--batch-size 200]
+
+load_dotenv()  # DATABASE_URL, same as run.py
+
+from db_init import initialize_database
+from repository import migrate_legacy_transcripts
+
+
+def backfill(batch_size):
+    initialize_database()  # makes sure debate_turns exists
+
+    migrated, skipped = 0, 0
+    try:
+        for migrated, skipped, last_id in migrate_legacy_transcripts(batch_size=batch_size):
+            print(f"Migrated {migrated} debates so far (last id {last_id}, {skipped} skipped)...")
+    except Exception as e:
+        print(f"An error occurred while migrating transcripts: {e}", file=sys.stderr)
+        print("Already-migrated batches are committed; re-run to continue.", file=sys.stderr)
+        sys.exit(1)
+
+    print(f"\nBackfill complete! {migrated} debates moved to debate_turns.")
+    if skipped:
+        print(f"{skipped} debates had unreadable chat_history and were left as they are.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move chat_history blobs into the debate_turns table.")
+    parser.add_argument('--batch-size', type=int, default=200,
+                        help="Debates per transaction (bounds memory use).")
+    args = parser.parse_args()
+    backfill(args.batch_size)
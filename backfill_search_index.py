@@ -0,0 +1,38 @@
+import sys
+import argparse
+
+from dotenv import load_dotenv
+
+# --- One-off migration: fill the debate_search index ---
+# Finished debates saved before the full-text search index existed have no
+# search document, so /history search cannot find them. This indexes them,
+# a batch of debates per transaction, so it is safe to stop and re-run at
+# any point (debates already indexed are skipped).
+#
+#   python backfill_search_index.py [--batch-size 500]
+
+load_dotenv()  # DATABASE_URL, same as run.py
+
+from db_init import initialize_database
+from repository import index_missing_debates
+
+
+def backfill(batch_size):
+    initialize_database()  # makes sure debate_search exists
+
+    try:
+        indexed = index_missing_debates(batch_size=batch_size)
+    except Exception as e:
+        print(f"An error occurred while indexing existing debates: {e}", file=sys.stderr)
+        print("Already-indexed batches are committed; re-run to continue.", file=sys.stderr)
+        sys.exit(1)
+
+    print(f"\nBackfill complete! {indexed} debates added to the search index.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Add debates saved before the search index existed to it.")
+    parser.add_argument('--batch-size', type=int, default=500,
+                        help="Debates per transaction (bounds memory use).")
+    args = parser.parse_args()
+    backfill(args.batch_size)
@@ -0,0 +1,174 @@
+import os
+import sys
+import csv
+import json
+import math
+import time
+import argparse
+
+from dotenv import load_dotenv
+
+# --- Bulk importer (replaces migrate_to_sqlite.py) ---
+# Streams users and user_stats exports (CSV or JSON Lines) into the current
+# db_init.py schema, on SQLite or PostgreSQL, a fixed-size chunk at a time,
+# so memory use does not grow with the file. Each file is loaded in a single
+# transaction. Existing users are kept; imported stats replace existing ones.
+#
+#   python bulk_import.py                                   # the bundled CSVs
+#   python bulk_import.py --users school_users.jsonl --stats school_stats.csv
+#   python bulk_import.py --sqlite /path/to/app_data.db     # force a SQLite file
+#
+# DATABASE_URL (from .env, as in run.py) selects PostgreSQL.
+
+load_dotenv()  # DATABASE_URL, same as run.py
+
+from db_init import initialize_database
+from repository import (db_connection, STAT_SKILLS, import_users_chunk,
+                        import_user_stats_chunk, fill_missing_user_stats)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+USERS_CSV = os.path.join(BASE_DIR, 'users.csv')
+STATS_CSV = os.path.join(BASE_DIR, 'user_stats.csv')
+DEFAULT_CHUNK_SIZE = 5000
+
+
+def read_records(path):
+    """Yields one dict per record from a .csv or .jsonl/.ndjson file."""
+    if path.endswith(('.jsonl', '.ndjson', '.json')):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+    else:
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            yield from csv.DictReader(f)
+
+
+def chunked(records, chunk_size):
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# --- Per-chunk cleaning ---
+# Same rules as the old pandas cleanup: unknown columns are ignored, and
+# missing or non-numeric counters/averages become 0 (counters as integers).
+def _text(value):
+    if value is None:
+        return ''
+    return str(value).strip()
+
+
+def _to_int(value):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return 0
+    return int(number) if math.isfinite(number) else 0
+
+
+def _to_float(value):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return 0.0
+    return number if math.isfinite(number) else 0.0
+
+
+def clean_users(records):
+    """Returns (rows, rejected). Rows without a username or password are rejected."""
+    rows, rejected = [], 0
+    for record in records:
+        username, password = _text(record.get('username')), _text(record.get('password'))
+        if not username or not password:
+            rejected += 1
+            continue
+        rows.append((_text(record.get('name')) or username, username, password))
+    return rows, rejected
+
+
+def clean_user_stats(records):
+    """Returns (rows, rejected) in repository.IMPORT_STATS_COLUMNS order."""
+    rows, rejected = [], 0
+    for record in records:
+        # Accept the camelCase CSV headers and the lowercase Postgres ones.
+        record = {str(key).lower(): value for key, value in record.items()}
+        username = _text(record.get('username'))
+        if not username:
+            rejected += 1
+            continue
+        rows.append((
+            username,
+            _to_int(record.get('debates_won')),
+            _to_int(record.get('debates_lost')),
+            _to_int(record.get('debates_drawn')),
+            *[_to_float(record.get(f"avg_{skill.lower()}")) for skill in STAT_SKILLS],
+        ))
+    return rows, rejected
+
+
+def import_file(path, label, clean, load_chunk, chunk_size):
+    """Streams one file into the database in a single transaction."""
+    if not path or not os.path.exists(path):
+        print(f"{label}: {path} not found, skipping.")
+        return
+
+    print(f"{label}: importing {path} in chunks of {chunk_size}...")
+    started = time.perf_counter()
+    read = written = rejected = 0
+    with db_connection() as con:
+        try:
+            cur = con.cursor()
+            for chunk in chunked(read_records(path), chunk_size):
+                rows, bad = clean(chunk)
+                read += len(chunk)
+                rejected += bad
+                if rows:
+                    written += load_chunk(con, cur, rows)
+                elapsed = time.perf_counter() - started
+                print(f"  {read} rows read ({read / elapsed:,.0f} rows/sec)")
+            con.commit()
+        except Exception as e:
+            con.rollback()
+            print(f"Error importing {path}: {e}. Nothing from this file was saved.", file=sys.stderr)
+            return
+
+    elapsed = time.perf_counter() - started
+    rate = read / elapsed if elapsed else 0
+    print(f"{label}: {read} rows in {elapsed:.2f}s ({rate:,.0f} rows/sec); "
+          f"{written} written, {rejected} rejected, {read - written - rejected} skipped "
+          f"(already present, or stats for unknown users).")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-import users and user stats from CSV/JSONL exports.")
+    parser.add_argument('--users', default=USERS_CSV, help="users export (name, username, password)")
+    parser.add_argument('--stats', default=STATS_CSV, help="user_stats export")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--sqlite', help="import into this SQLite file even if DATABASE_URL is set")
+    args = parser.parse_args()
+
+    if args.sqlite:
+        os.environ.pop('DATABASE_URL', None)
+        os.environ['SQLITE_DB_PATH'] = os.path.abspath(args.sqlite)
+
+    initialize_database()
+    import_file(args.users, 'users', clean_users, import_users_chunk, args.chunk_size)
+    import_file(args.stats, 'user_stats', clean_user_stats, import_user_stats_chunk, args.chunk_size)
+    try:
+        created = fill_missing_user_stats()
+        if created:
+            print(f"Created empty stats rows for {created} users.")
+    except Exception as e:
+        print(f"Error creating missing stats rows: {e}", file=sys.stderr)
+    print("\nImport complete!")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,13 +3,11 @@ print("\n\n*** V13.0: USER-PROVIDED API KEYS ***\n\n")
 import json
 import pandas as pd
 import os
-import sqlite3 # For database fallback
 import re # For parsing JSON
-import psycopg2 # <-- ADDED for Render PostgreSQL
-from psycopg2.extras import DictCursor # <-- ADDED for Render PostgreSQL
 from datetime import datetime
 import re
 import pytz # <-- IMPORT FOR TIMEZONE FIX
+import uuid
 
 # --- NEW IMPORTS FOR AZURE STT ---
 import base64
@@ -19,33 +17,61 @@ import wave # <-- ADDED for WAV parsing
 import threading # <-- ADDED for continuous recognition
 # --- END NEW IMPORTS ---
 
-from dash import html, dcc, Input, Output, State, callback_context, no_update
+from dash import html, dcc, Input, Output, State, ALL, callback_context, no_update, ClientsideFunction
 import dash_daq as daq
 
 # Import the main 'app' variable from app.py
 from app import app # This line is essential
 
-# --- Database Helper Function (MODIFIED FOR RENDER) ---
-def get_db_connection():
-    """
-    Establishes a connection to the PostgreSQL database on Render
-    or a local SQLite DB for development (if DATABASE_URL is not set).
-    """
-    DATABASE_URL = os.environ.get('DATABASE_URL')
-
-    if DATABASE_URL:
-        # --- PRODUCTION (Render) ---
-        con = psycopg2.connect(DATABASE_URL)
-        con.cursor_factory = DictCursor # Allows accessing columns by name
-    else:
-        # --- LOCAL (Development) ---
-        print("WARNING: DATABASE_URL not set. Falling back to local app_data.db")
-        BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-        DB_FILE = os.path.join(BASE_DIR, 'app_data.db')
-        con = sqlite3.connect(DB_FILE)
-        con.row_factory = sqlite3.Row
-    
-    return con
+# --- Database Access ---
+# All SQL lives in repository.py (pooled connections come from db_pool.py).
+# Callbacks never build queries or open connections themselves.
+import repository
+from db_pool import pool_stats
+from server_stats import register_stats_source
+
+register_stats_source('db_pool', pool_stats)
+register_stats_source('queries', repository.query_stats)
+
+# Gemini calls use a per-user cached client (see llm_client.py).
+import llm_client
+import llm_scheduler
+register_stats_source('gemini_clients', llm_client.client_cache_stats)
+register_stats_source('llm_provider', llm_client.provider_stats)
+register_stats_source('llm_scheduler', llm_client.scheduler_stats)
+register_stats_source('llm_calls', llm_client.call_stats)
+register_stats_source('gemini_chat_sessions', llm_client.chat_session_stats)
+register_stats_source('prompt_cache', llm_client.prefix_cache_stats)
+
+# Finished debates and stats are written in the background (write-behind).
+import persistence
+register_stats_source('persistence', persistence.queue_stats)
+persistence.get_queue()  # start the writer now so leftover journals are replayed
+
+# LLM calls run as background jobs, polled by the browser (see jobs.py).
+import jobs
+register_stats_source('jobs', jobs.job_stats)
+
+# Long debates send a rolling summary plus the newest turns (see compaction.py).
+import compaction
+
+# Gemini and Azure Speech calls fail fast while the service is failing (see circuit_breaker.py).
+import circuit_breaker
+register_stats_source('circuit_breakers', circuit_breaker.breakers.stats)
+
+# Recognition of a pushed clip normally finishes well within the clip's own
+# length, so the wait is bounded by that (plus a margin) instead of 180s.
+STT_WAIT_MARGIN = float(os.environ.get('AZURE_SPEECH_WAIT_MARGIN', '20'))   # seconds
+STT_MAX_WAIT = float(os.environ.get('AZURE_SPEECH_MAX_WAIT', '180'))        # seconds
+
+# Cancellation codes that mean Azure itself is failing (not the key or the audio).
+STT_SERVICE_ERRORS = (
+    speechsdk.CancellationErrorCode.ConnectionFailure,
+    speechsdk.CancellationErrorCode.ServiceTimeout,
+    speechsdk.CancellationErrorCode.ServiceError,
+    speechsdk.CancellationErrorCode.ServiceUnavailable,
+    speechsdk.CancellationErrorCode.RuntimeError,
+)
 
 # --- Hardcoded User Profile (for AI context during practice) ---
 user_profile_for_ai = {
@@ -56,18 +82,18 @@ user_profile_for_ai = {
 }
 
 # --- MASTER PROMPTS ---
+# Each prompt is split into fixed instructions, sent first as the system
+# instruction (and cached per API key, see prompt_cache.py), and a short
+# per-debate part that follows them in the request.
 DEBATE_OPPONENT_PROMPT = """
 You are a highly skilled, assertive, and competitive debater AI.
 Your *only* role is to engage in a formal debate with the human user and try to win.
-**DEBATE RULES:**
-1.  TOPIC: {topic}
-2.  YOUR STANCE: You are arguing {opponent_stance}. You must defend this position at all costs.
-3.  OPPONENT'S STANCE: The user is arguing {user_stance}.
+The first message gives the DEBATE RULES: the topic, your stance and the user's stance.
 **YOUR INSTRUCTIONS (CRITICAL):**
--   You are the {opponent_stance} side. You must *only* make arguments that support your stance.
+-   You argue only your assigned side. You must *only* make arguments that support your stance.
 -   Your goal is to *win* the debate by being more persuasive and logical than the user.
 -   Directly rebut the user's previous points. Find flaws in their logic, evidence, or reasoning.
--   Present your own counter-arguments, evidence, and examples to strengthen your {opponent_stance} position.
+-   Present your own counter-arguments, evidence, and examples to strengthen your position.
 -   Maintain a formal, respectful, and intelligent persona.
 **!! IMPORTANT: WHAT *NOT* TO DO !!**
 -   **DO NOT** act as a judge, coach, or assistant.
@@ -78,15 +104,19 @@ Your *only* role is to engage in a formal debate with the human user and try to
 -   **DO NOT ENGAGE WITH META-COMMENTS. If the user's input is irrelevant, a test, or a non-argument (e.g., "this is a test," "hi"), you MUST ignore its content and state that you are waiting for a substantive argument related to the topic.**
 You will receive the chat history. Your job is to provide the *next* logical rebuttal from your assigned stance.
 """
+DEBATE_SETUP_PROMPT = """
+**DEBATE RULES:**
+1.  TOPIC: {topic}
+2.  YOUR STANCE: You are arguing {opponent_stance}. You must defend this position at all costs.
+3.  OPPONENT'S STANCE: The user is arguing {user_stance}.
+"""
+# Added to the debate rules once the oldest turns are summarized.
+EARLIER_TURNS_NOTE = """
+**EARLIER IN THIS DEBATE (summary of turns no longer shown in the chat history):**
+{summary}
+"""
 DEBATE_JUDGE_PROMPT = """
-You are an impartial, expert debate judge. Your sole task is to analyze the following debate transcript and provide a detailed evaluation in a specific JSON format.
-**DEBATE DETAILS:**
--   Topic: {topic}
--   User's Stance: {user_stance}
--   AI's Stance: {ai_stance}
-**TRANSCRIPT:**
-{transcript}
----
+You are an impartial, expert debate judge. Your sole task is to analyze the debate transcript you are given and provide a detailed evaluation in a specific JSON format.
 **YOUR TASK:**
 Evaluate both the 'User' and the 'AI' on the following five criteria.
 
@@ -138,24 +168,24 @@ You MUST be strict and fair. Scores range from 0 (non-existent) to 10 (excellent
 **OUTPUT FORMAT (CRITICAL):**
 Your response **MUST** be a valid JSON object. Do not include any text before or after the JSON, and do not use markdown like ```json.
 The JSON structure must be *exactly* as follows:
-{{or non-existent arguments.**
-  "scores": {{
-    "User": {{
+{or non-existent arguments.**
+  "scores": {
+    "User": {
       "logicalConsistency": <score_0_to_10>,
       "evidenceAndExamples": <score_0_to_10>,
       "clarityAndConcision": <score_0_to_10>,
       "rebuttalEffectiveness": <score_0_to_10>,
       "overallPersuasiveness": <score_0_to_10>
-    }},
-    "AI": {{
+    },
+    "AI": {
       "logicalConsistency": <score_0_to_10>,
       "evidenceAndExamples": <score_0_to_10>,
       "clarityAndConcision": <score_0_to_10>,
       "rebuttalEffectiveness": <score_0_to_10>,
       "overallPersuasiveness": <score_0_to_10>
-    }}
-  }},
-  "reasoning": {{
+    }
+  },
+  "reasoning": {
     "strongestArgumentUser": "<Briefly describe the 'User's' best point. If 0, state 'No argument presented.'>",
     "strongestArgumentAI": "<Briefly describe the 'AI's' best point. If 0, state 'No argument presented.'>",
     "weakestArgumentUser": "<Briefly describe the 'User's' weakest point. If 0, state 'No argument presented.'>",
@@ -164,8 +194,8 @@ The JSON structure must be *exactly* as follows:
     "overallWinner": "<'User', 'AI', or 'Draw'>",
     "constructiveFeedbackUser": "<One or two specific, actionable suggestions for the 'User' to improve. If 0, feedback can be 'No valid argument was presented.'>",
     "constructiveFeedbackAI": "<One or two specific, actionable suggestions for the 'AI' to improve. If 0, feedback can be 'No valid argument was presented.'>"
-  }}
-}}
+  }
+}
 **INSTRUCTIONS FOR JSON FIELDS:**
 -   All scores: Must be a single number (integer or float) between 0 and 10.
 -   reasoning fields: Provide concise, objective analysis.
@@ -173,49 +203,118 @@ The JSON structure must be *exactly* as follows:
 -   **constructiveFeedbackUser**: Provide 1-2 concise, actionable pieces of advice for the 'User'.
 -   **constructiveFeedbackAI**: Provide 1-2 concise, actionable pieces of advice for the 'AI'.
 """
+DEBATE_JUDGE_CASE_PROMPT = """
+**DEBATE DETAILS:**
+-   Topic: {topic}
+-   User's Stance: {user_stance}
+-   AI's Stance: {ai_stance}
+**TRANSCRIPT:**
+{transcript}
+---
+Evaluate this debate as instructed. Your *only* output must be the JSON object.
+"""
+
+# Identical debates are judged once (see judgment_cache.py). Editing either
+# judge prompt above changes the version and retires the cached judgments.
+import judgment_cache
+judgments = judgment_cache.JudgmentCache(
+    judgment_cache.prompt_version(DEBATE_JUDGE_PROMPT, DEBATE_JUDGE_CASE_PROMPT),
+    judgment_cache.JUDGMENT_CACHE_SIZE, enabled=judgment_cache.JUDGMENT_CACHE_ENABLED
+)
+register_stats_source('judgment_cache', judgments.stats)
+
+# Optionally several judges per debate, combined (see judge_ensemble.py).
+from judge_ensemble import ensemble as judge_ensemble
+register_stats_source('judge_ensemble', judge_ensemble.stats)
+
+
+def judge_setup():
+    """The judge model, or the ensemble's judges."""
+    return judge_ensemble.label() if judge_ensemble.enabled else llm_client.JUDGE_MODEL
+
+
+def judge_version():
+    """Identifies the judge prompts and setup a judgment was made with (see rejudge.py)."""
+    return f"{judgments.version}:{judge_setup()}"
+
+
+# The judge's output schema, validating parser and field repair (see judgment_schema.py).
+import judgment_schema
+register_stats_source('judgment_parsing', judgment_schema.parse_stats)
 
 # --- *** NEW: HELPER FUNCTION TO SAVE DEBATES *** ---
+# A debate gets its debate_history row when it starts and each turn is saved
+# as it happens (debate_turns), so a crash mid-debate loses nothing.
+def start_debate_in_db(username, debate_state):
+    """
+    Creates the history row for a debate that just started.
+    Returns its id, or None if it could not be saved (the debate still runs
+    and is saved whole by save_debate_to_db at the end).
+    """
+    try:
+        return repository.insert_debate(
+            username,
+            debate_state.get('mode', 'unknown'),
+            debate_state.get('topic', 'N/A'),
+            json.dumps(debate_state),
+            None,
+            datetime.now(pytz.utc)
+        )
+    except Exception as e:
+        print(f"ERROR: Could not create debate history row: {e}")
+        return None
+
+def save_turn_to_db(debate_state, chat_history):
+    """
+    Saves the newest chat_history entry as its own debate_turns row.
+    """
+    debate_id = debate_state.get('debate_id')
+    if not debate_id or not chat_history:
+        return
+    try:
+        repository.record_turn(debate_id, len(chat_history) - 1, chat_history[-1])
+    except Exception as e:
+        # save_debate_to_db re-sends every turn, so this one is not lost.
+        print(f"ERROR: Could not save debate turn: {e}")
+
+def discard_turns_from_db(debate_state, turn_index):
+    """
+    Deletes the saved turns from 'turn_index' on (a turn that was undone).
+    """
+    debate_id = debate_state.get('debate_id')
+    if not debate_id:
+        return
+    try:
+        repository.discard_turns(debate_id, turn_index)
+    except Exception as e:
+        print(f"ERROR: Could not discard debate turns: {e}")
+
 def save_debate_to_db(username, debate_state, chat_history, final_results):
     """
-    Saves the completed debate transcript and results to the database.
+    Queues the completed debate for saving (see persistence.py). The writer
+    thread finishes the row created by start_debate_in_db, or inserts one
+    if there is none.
     """
-    print(f"--- Saving debate history for user: {username} ---")
+    print(f"--- Queueing debate history for user: {username} ---")
     
     try:
         state_json = json.dumps(debate_state)
-        history_json = json.dumps(chat_history)
         results_json = json.dumps(final_results)
+        json.dumps(chat_history)  # must survive the journal round-trip
     except Exception as e:
         print(f"CRITICAL ERROR: Could not serialize debate data to JSON: {e}")
         return 
 
-    con = get_db_connection()
-    ph = '?' if isinstance(con, sqlite3.Connection) else '%s'
-    
-    sql_insert = f"""
-    INSERT INTO debate_history 
-    (username, debate_mode, debate_topic, debate_state, chat_history, final_results, timestamp)
-    VALUES ({ph}, {ph}, {ph}, {ph}, {ph}, {ph}, {ph})
-    """
-    
-    try:
-        cur = con.cursor()
-        cur.execute(sql_insert, (
-            username,
-            debate_state.get('mode', 'unknown'),
-            debate_state.get('topic', 'N/A'),
-            state_json,
-            history_json,
-            results_json,
-            datetime.now(pytz.utc) # <-- FIX 1: USE UTC TIMEZONE
-        ))
-        con.commit()
-        print("--- Debate history saved successfully. ---")
-    except Exception as e:
-        con.rollback()
-        print(f"CRITICAL ERROR: Could not save debate to database: {e}")
-    finally:
-        con.close()
+    persistence.submit('debate', {
+        'debate_id': debate_state.get('debate_id'),
+        'username': username,
+        'debate_mode': debate_state.get('mode', 'unknown'),
+        'debate_topic': debate_state.get('topic', 'N/A'),
+        'state_json': state_json,
+        'results_json': results_json,
+        'timestamp': str(datetime.now(pytz.utc)), # <-- FIX 1: USE UTC TIMEZONE
+        'chat_history': chat_history,
+    })
 
 # --- USER AUTHENTICATION & MANAGEMENT ---
 def is_password_strong(password):
@@ -267,46 +366,21 @@ def register_user(n_clicks, name, username, password, password_confirm): # <-- '
         return message, "message message-error"
 
     # --- Database logic ---
-    con = get_db_connection()
-    ph = '?' if isinstance(con, sqlite3.Connection) else '%s'
-    
     try:
-        cur = con.cursor() 
-        
         # !! SECURITY WARNING !!
         # You should HASH your password before storing it.
-        
-        # --- SQL query updated to remove 'email' ---
-        sql_insert_user = f"INSERT INTO users (name, username, password) VALUES ({ph}, {ph}, {ph})"
-        cur.execute(sql_insert_user, (name, username, password)) # <-- 'email' removed from tuple
-        
-        # --- This user_stats query is fine as it only uses username ---
-        sql_insert_stats = f"""
-            INSERT INTO user_stats (
-                username, debates_won, debates_lost, debates_drawn,
-                avg_logicalconsistency, avg_evidenceandexamples,
-                avg_clarityandconcision, avg_rebuttaleffectiveness,
-                avg_overallpersuasiveness
-            ) VALUES ({ph}, 0, 0, 0, 0.0, 0.0, 0.0, 0.0, 0.0)
-            """
-        cur.execute(sql_insert_stats, (username,))
-        
-        con.commit() 
+        repository.create_user(name, username, password) # <-- also creates the user_stats row
         message = f"Registration successful for {username}! You can now log in."
         classname = "message message-success"
         
-    except (sqlite3.IntegrityError, psycopg2.IntegrityError) as e:
-        con.rollback() 
+    except repository.INTEGRITY_ERRORS as e:
         # --- Updated error message ---
         message = "Username already exists."
         classname = "message message-error"
     except Exception as e:
-        con.rollback()
         print(f"Registration error: {e}")
         message = "An error occurred during registration. Please try again."
         classname = "message message-error"
-    finally:
-        con.close()
         
     return message, classname
 
@@ -328,22 +402,14 @@ def login_user(n_clicks, username, password, session_data):
     if not username or not password:
         return no_update, no_update, "Please enter username and password.", "message message-error"
         
-    con = get_db_connection()
-    ph = '?' if isinstance(con, sqlite3.Connection) else '%s'
-
     try:
-        cur = con.cursor()
-        
-        sql_select_user = f"SELECT password FROM users WHERE username = {ph}"
-        cur.execute(sql_select_user, (username,))
-        
-        user_record = cur.fetchone()
+        stored_password = repository.get_user_password(username)
         
         # !! SECURITY WARNING !!
         # You should be checking a HASHED password here, not plain text.
-        # e.g., if user_record and check_password_hash(user_record['password'], password):
+        # e.g., if stored_password and check_password_hash(stored_password, password):
         
-        if user_record and user_record['password'] == str(password):
+        if stored_password is not None and stored_password == str(password):
             session_data = session_data or {}
             session_data['active_user'] = username
             # Go to home, no message, and default message class
@@ -354,8 +420,6 @@ def login_user(n_clicks, username, password, session_data):
     except Exception as e:
         print(f"Login error: {e}")
         return no_update, no_update, "An error occurred during login.", "message message-error"
-    finally:
-        con.close()
 
 
 @app.callback(
@@ -617,67 +681,90 @@ def transcribe_audio_from_base64(base64_audio_data, azure_key, azure_region):
             return None
 
         # --- *** MODIFIED: Use keys from session *** ---
-        speech_config = speechsdk.SpeechConfig(subscription=azure_key, region=azure_region)
-        speech_config.speech_recognition_language = "en-IN" 
-        speech_config.enable_dictation()
-
-        stream_format = speechsdk.audio.AudioStreamFormat(
-            samples_per_second=sample_rate,
-            bits_per_sample=bits_per_sample,
-            channels=channels
-        )
-        stream = speechsdk.audio.PushAudioInputStream(stream_format=stream_format)
-        stream.write(raw_audio_data) 
-        stream.close() 
-        
-        audio_config = speechsdk.audio.AudioConfig(stream=stream)
-        speech_recognizer = speechsdk.SpeechRecognizer(speech_config=speech_config, audio_config=audio_config)
-        
-        all_results = []
-        done = threading.Event()
-
-        def recognized_cb(evt):
-            if evt.result.reason == speechsdk.ResultReason.RecognizedSpeech:
-                print(f"--- AZURE: Recognized fragment: {evt.result.text} ---")
-                all_results.append(evt.result.text)
-            elif evt.result.reason == speechsdk.ResultReason.NoMatch:
-                print("--- AZURE: NoMatch fragment ---")
-
-        def session_stopped_cb(evt):
-            print("--- AZURE: Session Stopped ---")
-            done.set()
-
-        def canceled_cb(evt):
-            print(f"--- AZURE: CANCELED: {evt.reason} ---")
-            if evt.reason == speechsdk.CancellationReason.Error:
-                print(f"--- AZURE CANCELLATION DETAILS: {evt.error_details} ---")
-            done.set()
-
-        speech_recognizer.recognized.connect(recognized_cb)
-        speech_recognizer.session_stopped.connect(session_stopped_cb)
-        speech_recognizer.canceled.connect(canceled_cb)
-
-        print("--- PYTHON: Starting CONTINUOUS recognition... ---")
-        speech_recognizer.start_continuous_recognition()
-        done.wait(timeout=180.0) 
-        speech_recognizer.stop_continuous_recognition()
-        print("--- PYTHON: Continuous recognition finished. ---")
-
-        full_transcript = " ".join(all_results)
-        
+        # Raises CircuitOpenError (shown to the user) while Azure is failing.
+        key_id = llm_client.key_fingerprint(f"{azure_region}:{azure_key}")
+        with circuit_breaker.guard('azure_speech', key_id) as breaker_call:
+            full_transcript = recognize_speech(azure_key, azure_region, raw_audio_data,
+                                               sample_rate, bits_per_sample, channels, breaker_call)
+
         if full_transcript:
             print(f"--- PYTHON SUCCESS (Continuous): {full_transcript} ---")
             return full_transcript
         else:
             print("--- PYTHON ERROR: No speech recognized (Continuous). ---")
             return None
-            
+
+    except circuit_breaker.CircuitOpenError:
+        raise
     except Exception as e:
         print(f"!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!")
         print(f"!!! A CRITICAL ERROR OCCURRED: {e} !!!")
         print("!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!")
         return None
 
+
+def recognize_speech(azure_key, azure_region, raw_audio_data, sample_rate, bits_per_sample, channels,
+                     breaker_call):
+    """
+    Runs continuous recognition over the clip and returns the joined text.
+    Service-side cancellations and timeouts are reported to breaker_call.
+    """
+    speech_config = speechsdk.SpeechConfig(subscription=azure_key, region=azure_region)
+    speech_config.speech_recognition_language = "en-IN" 
+    speech_config.enable_dictation()
+
+    stream_format = speechsdk.audio.AudioStreamFormat(
+        samples_per_second=sample_rate,
+        bits_per_sample=bits_per_sample,
+        channels=channels
+    )
+    stream = speechsdk.audio.PushAudioInputStream(stream_format=stream_format)
+    stream.write(raw_audio_data) 
+    stream.close() 
+    
+    audio_config = speechsdk.audio.AudioConfig(stream=stream)
+    speech_recognizer = speechsdk.SpeechRecognizer(speech_config=speech_config, audio_config=audio_config)
+    
+    all_results = []
+    done = threading.Event()
+
+    def recognized_cb(evt):
+        if evt.result.reason == speechsdk.ResultReason.RecognizedSpeech:
+            print(f"--- AZURE: Recognized fragment: {evt.result.text} ---")
+            all_results.append(evt.result.text)
+        elif evt.result.reason == speechsdk.ResultReason.NoMatch:
+            print("--- AZURE: NoMatch fragment ---")
+
+    def session_stopped_cb(evt):
+        print("--- AZURE: Session Stopped ---")
+        done.set()
+
+    def canceled_cb(evt):
+        print(f"--- AZURE: CANCELED: {evt.reason} ---")
+        if evt.reason == speechsdk.CancellationReason.Error:
+            print(f"--- AZURE CANCELLATION DETAILS: {evt.error_details} ---")
+            if evt.cancellation_details.code in STT_SERVICE_ERRORS:
+                breaker_call.failed(f"{evt.cancellation_details.code}: {evt.error_details}")
+        done.set()
+
+    speech_recognizer.recognized.connect(recognized_cb)
+    speech_recognizer.session_stopped.connect(session_stopped_cb)
+    speech_recognizer.canceled.connect(canceled_cb)
+
+    frame_bytes = max(1, bits_per_sample // 8 * channels)
+    clip_seconds = len(raw_audio_data) / frame_bytes / max(1, sample_rate)
+    wait_seconds = min(STT_MAX_WAIT, clip_seconds + STT_WAIT_MARGIN)
+
+    print("--- PYTHON: Starting CONTINUOUS recognition... ---")
+    speech_recognizer.start_continuous_recognition()
+    if not done.wait(timeout=wait_seconds):
+        print(f"--- AZURE: no end of session after {wait_seconds:.0f}s, giving up ---")
+        breaker_call.failed(f"recognition timed out after {wait_seconds:.0f}s")
+    speech_recognizer.stop_continuous_recognition()
+    print("--- PYTHON: Continuous recognition finished. ---")
+
+    return " ".join(all_results)
+
 # --- *** MODIFIED: STT Callback now triggers popup on error *** ---
 @app.callback(
     [Output('user-input-textarea', 'value', allow_duplicate=True),
@@ -701,7 +788,12 @@ def handle_audio_transcript(base64_audio_data, current_text, session_data):
         # Return 4 values: (textarea, loading, popup_displayed, popup_message)
         return no_update, None, True, error_msg 
 
-    transcript = transcribe_audio_from_base64(base64_audio_data, azure_key, azure_region)
+    try:
+        transcript = transcribe_audio_from_base64(base64_audio_data, azure_key, azure_region)
+    except circuit_breaker.CircuitOpenError as e:
+        print(f"STT Error: {e}")
+        # Azure is failing: (textarea, loading, popup_displayed, popup_message)
+        return no_update, None, True, str(e)
     
     print(f"--- PYTHON CALLBACK RECEIVED: {transcript} ---")
     
@@ -802,11 +894,17 @@ def start_practice_debate(n_clicks, topic, stance, turns, session_data):
         'user_stance': stance,
         'opponent_stance': 'Against' if stance == 'For' else 'For',
         'total_turns': int(turns),
-        'current_turn': 0
+        'current_turn': 0,
+        'turn_seq': 0,   # submissions so far; never goes back (see turn_dedup_key)
+        'context': compaction.new_context(),
+        'chat_id': uuid.uuid4().hex   # key of the opponent's live chat session (llm_client.py)
     }
+    debate_state['debate_id'] = start_debate_in_db(session_data.get('active_user'), debate_state)
     session_data['debate_state'] = debate_state
     session_data['chat_history'] = [] 
     session_data['final_results'] = None
+    session_data['judgment_job_id'] = None
+    session_data['opponent_stream_id'] = None
     initial_message = html.Div(f"Debate started on: '{topic}'. You are arguing '{stance}'. Waiting for your first argument.",
                                style={'fontStyle': 'italic', 'color': 'grey', 'textAlign': 'center'})
     
@@ -818,14 +916,44 @@ def start_practice_debate(n_clicks, topic, stance, turns, session_data):
             results_button_style, send_button_disabled, textarea_disabled,
             no_update, no_update) # <-- Hide popup on success
 
-# --- *** MODIFIED: Practice turn now triggers popup on error *** ---
+# --- *** MODIFIED: Practice turn runs the AI reply as a background job *** ---
+# Sending an argument no longer waits for Gemini, and no request thread is
+# held while the reply is generated. handle_practice_turn shows the user's
+# message plus an empty AI bubble, queues an 'opponent_reply' job (see
+# jobs.py) and hands its id to assets/opponent_stream.js, which polls
+# /jobs/<id> and appends the reply text to the bubble as it is generated.
+# When the job ends, the JS writes the final text to 'opponent-stream-result'
+# and commit_opponent_reply stores it in chat_history. Leaving the page
+# cancels the job. After the last turn the judgment is queued the same way
+# and the results page fills in the scores when it lands.
+OPPONENT_STREAM_CLASS = 'opponent-stream'
+JUDGMENT_MAX_ATTEMPTS = int(os.environ.get('JUDGMENT_MAX_ATTEMPTS', '3'))
+
+
+# --- Duplicate submissions ---
+# A double-clicked Send, or a callback POST the browser retries, runs the
+# turn callback twice with the same session-storage. Every submission is
+# numbered with debate_state['turn_seq'] (taken before it is incremented, so
+# both copies see the same number), and the jobs it queues are keyed by
+# debate and number: the second copy gets the first copy's job (jobs.py
+# dedup_key) instead of a second Gemini call, and returns the same outputs.
+# turn_seq is never decremented -- a turn undone after a failed reply is
+# sent again under a new number. The debate is identified by its chat_id,
+# which every session gets when it starts (Practice and Judge Mode alike);
+# the database debate_id is not used, as it can be None (the row could not
+# be created) or reused (after a reset).
+def turn_dedup_key(kind, debate_state):
+    """Key of this submission of the current turn, or None for debates without a chat_id/turn_seq."""
+    if debate_state.get('chat_id') is None or 'turn_seq' not in debate_state:
+        return None
+    return f"{kind}:{debate_state['chat_id']}:{debate_state['turn_seq']}"
+
+
 @app.callback(
     [Output('chat-window', 'children', allow_duplicate=True),
      Output('session-storage', 'data', allow_duplicate=True),
      Output('loading-output', 'children'),
-     Output('url', 'pathname', allow_duplicate=True),
-     
-     Output('view-results-button', 'style', allow_duplicate=True),
+     Output('opponent-stream-request', 'data'),
      Output('send-argument-button', 'disabled', allow_duplicate=True),
      Output('user-input-textarea', 'disabled', allow_duplicate=True),
      Output('timer-store', 'data', allow_duplicate=True),
@@ -840,37 +968,34 @@ def start_practice_debate(n_clicks, topic, stance, turns, session_data):
     prevent_initial_call=True
 )
 def handle_practice_turn(n_clicks, user_input, session_data, current_chat, timer_data):
-    import google.generativeai as genai 
-
     current_chat = current_chat if current_chat is not None else []
     
-    results_button_style = {'display': 'none', 'marginTop': '10px'}
-    send_button_disabled = False
-    textarea_disabled = False
-    
     # --- Get key from session ---
     session_data = session_data or {}
     google_key = session_data.get('google_key')
     
     
     try:
-        genai.configure(api_key=google_key)
+        # This user's own cached client (no process-wide genai.configure).
+        llm_client.get_client(google_key)
     except Exception as e:
         error_msg = f"ERROR: Invalid Google API Key provided. Please check Settings."
         print(f"Google Key Error: {e}")
-        # Return 10 values
-        return (no_update, no_update, None, no_update, 
-                no_update, no_update, no_update, None, 
+        # Return 9 values
+        return (no_update, no_update, None, no_update,
+                no_update, no_update, None,
                 True, error_msg)
     
-    if not user_input or 'debate_state' not in session_data:
-        # Return 10 values
-        return (no_update, no_update, None, no_update, 
-                no_update, no_update, no_update, None, 
+    if not user_input or not session_data.get('debate_state') or session_data.get('opponent_stream_id'):
+        # Nothing to send, or the AI is still answering the previous argument
+        return (no_update, no_update, None, no_update,
+                no_update, no_update, None,
                 no_update, no_update)
 
     debate_state = session_data['debate_state']
     chat_history = session_data.get('chat_history', []) 
+    dedup_key = turn_dedup_key('opponent_reply', debate_state)
+    debate_state['turn_seq'] = debate_state.get('turn_seq', 0) + 1
 
     # 1. Add user message
     user_message = f"User ({debate_state['user_stance']}): {user_input}"
@@ -878,137 +1003,262 @@ def handle_practice_turn(n_clicks, user_input, session_data, current_chat, timer
     
     timer_string = timer_data or "" 
     chat_history.append({'role': 'user', 'parts': [user_input], 'time': timer_string})
+    save_turn_to_db(debate_state, chat_history)
 
     # 2. Increment turn
     debate_state['current_turn'] += 1
     session_data['debate_state'] = debate_state
 
-    # 3. Check for end of debate
-    if debate_state['current_turn'] >= debate_state['total_turns']:
-        
-        opponent_system_prompt = DEBATE_OPPONENT_PROMPT.format(
-            topic=debate_state['topic'],
-            user_stance=debate_state['user_stance'], 
-            opponent_stance=debate_state['opponent_stance']
-        )
-        dynamic_chat_model = genai.GenerativeModel(
-            'gemini-2.0-flash',
-            system_instruction=opponent_system_prompt
-        )
-        
-        # --- START OF FIX (ValueError: time) ---
-        dirty_previous_history = chat_history[:-1] 
-        clean_previous_history = [
-            {'role': msg['role'], 'parts': msg['parts']} 
-            for msg in dirty_previous_history
-        ]
-        chat_session = dynamic_chat_model.start_chat(history=clean_previous_history)
-        # --- END OF FIX ---
-        
-        try:
-            response = chat_session.send_message(user_input) 
-            ai_response_text = response.text
-        except Exception as e:
-            ai_response_text = f"An error occurred while generating the AI's final response: {e}"
-            print(f"API Error (Final Turn): {e}")
-            # Check if it's an API key error
-            if "API key" in str(e):
-                error_msg = "ERROR: Google API Key is invalid or expired. Please check Settings."
-                return (no_update, no_update, None, no_update, 
-                        no_update, no_update, no_update, None, 
-                        True, error_msg)
-
-        # 4. Add Final AI Response
-        ai_message = f"AI ({debate_state['opponent_stance']}): {ai_response_text}"
-        current_chat.append(html.P(ai_message, style={'textAlign': 'left'}))
-        chat_history.append({'role': 'model', 'parts': [ai_response_text]}) 
-        
-        print("--- Calling get_judgment with COMPLETE history ---")
-        try:
-            judgment = get_judgment(debate_state, chat_history, google_key)
-        except Exception as e:
-            print(f"--- handle_turn CAUGHT AN ERROR: {e} ---")
-            judgment = {'error': f'Judge API/Parsing failed: {e}', 'raw_text': 'N/A'}
+    # 3. Empty AI bubble that opponent_stream.js fills in
+    current_chat.append(html.P([f"AI ({debate_state['opponent_stance']}): ",
+                                html.Span(id='opponent-stream-text')],
+                               className=OPPONENT_STREAM_CLASS, style={'textAlign': 'left'}))
+
+    # 4. Queue the reply; the browser polls for it. Earlier turns are sent
+    # as the rolling summary, only the newest ones verbatim.
+    context = compaction.collect(debate_state.get('context') or compaction.new_context())
+    debate_state['context'] = context
+    job_id = jobs.submit('opponent_reply', {
+        'topic': debate_state['topic'],
+        'user_stance': debate_state['user_stance'],
+        'opponent_stance': debate_state['opponent_stance'],
+        'summary': context['summary'],
+        'history': compaction.recent_turns(context, chat_history[:-1]),
+        'message': user_input,
+        'chat_id': debate_state.get('chat_id'),
+        'username': session_data.get('active_user'),
+    }, secret=google_key, dedup_key=dedup_key)
+    session_data['opponent_stream_id'] = job_id
+    session_data['chat_history'] = chat_history
+
+    # Inputs stay disabled until commit_opponent_reply stores the reply.
+    # Return 9 values
+    return (current_chat, session_data, None, {'id': job_id},
+            True, True, None,
+            no_update, no_update)
 
-        # 5. Save final results
-        session_data['final_results'] = judgment
-        session_data['debate_state_before_completion'] = debate_state
-        session_data['debate_state'] = None 
-        session_data['chat_history'] = chat_history
 
+def run_opponent_reply(job):
+    """'opponent_reply' job: generates the reply, publishing it chunk by chunk."""
+    payload = job.payload
+    setup_prompt = DEBATE_SETUP_PROMPT.format(
+        topic=payload['topic'],
+        user_stance=payload['user_stance'],
+        opponent_stance=payload['opponent_stance']
+    )
+    if payload.get('summary'):
+        setup_prompt += EARLIER_TURNS_NOTE.format(summary=payload['summary'])
+    text = ''
+    with llm_scheduler.acting_for(payload.get('username'), 'practice'):
+        for chunk in llm_client.stream_opponent_reply(job.secret, DEBATE_OPPONENT_PROMPT, setup_prompt,
+                                                      payload['history'], payload['message'],
+                                                      chat_id=payload.get('chat_id')):
+            text += chunk
+            if job.append_progress(chunk):
+                print(f"Opponent reply {job.id} cancelled (the user left the page).")
+                break
+    return {'text': text}
+
+
+class JudgmentFailed(Exception):
+    """Raised by run_judgment so the job is retried."""
+
+
+def run_judgment(job):
+    """
+    'judgment' job: judges a finished debate and saves it (and, for practice
+    debates, the user's stats), so the result is kept even if the user has
+    already left the page. A failed judgment is saved as it is (so the
+    debate shows up finished in History) and retried; the retry overwrites
+    final_results in the same debate_history row. Returns the judgment.
+    """
+    payload = job.payload
+    username = payload['username']
+    debate_state = payload['debate_state']
+    chat_history = payload['chat_history']
+    try:
+        with llm_scheduler.acting_for(username, debate_state.get('mode')):
+            judgment = get_judgment(debate_state, chat_history, job.secret)
+    except Exception as e:
+        print(f"--- judgment job CAUGHT AN ERROR: {e} ---")
+        judgment = {'error': f'Judge API/Parsing failed: {e}', 'raw_text': 'N/A'}
+
+    # A bad key will not fix itself, so that is not retried.
+    retry = 'error' in judgment and not job.last_attempt and "API key" not in judgment['error']
+
+    # Without a debate_id every save inserts a new row, so only the last one is saved.
+    if not retry or debate_state.get('debate_id'):
         try:
-            save_debate_to_db(
-                session_data['active_user'], 
-                session_data['debate_state_before_completion'], 
-                chat_history, 
-                judgment
-            )
+            save_debate_to_db(username, debate_state, chat_history, judgment)
         except Exception as e:
-            print(f"CRITICAL ERROR: Failed to save practice debate to DB: {e}")
+            print(f"CRITICAL ERROR: Failed to save {debate_state.get('mode')} debate to DB: {e}")
+    if retry:
+        raise JudgmentFailed(judgment['error'])
 
-        # 6. Safely try to update stats
+    if payload.get('update_stats'):
         try:
             print("--- Calling update_user_stats ---")
-            update_user_stats(session_data['active_user'], judgment)
+            update_user_stats(username, judgment, debate_state.get('debate_id'))
         except Exception as e:
             print(f"CRITICAL ERROR in post-debate processing (stats/save): {e}")
-        
-        # 7. Show results button
-        results_button_style = {'display': 'block', 'marginTop': '10px'} 
-        send_button_disabled = True
-        textarea_disabled = True
-        
-        # Return 10 values
-        return (current_chat, session_data, None, no_update, 
-                results_button_style, send_button_disabled, textarea_disabled, None,
-                no_update, no_update)
+    return judgment
 
-    # --- NORMAL TURN LOGIC (AI Responds) ---
-    
-    # 4. Get AI response
-    opponent_system_prompt = DEBATE_OPPONENT_PROMPT.format(
-        topic=debate_state['topic'],
-        user_stance=debate_state['user_stance'], 
-        opponent_stance=debate_state['opponent_stance']
-    )
-    dynamic_chat_model = genai.GenerativeModel(
-        'gemini-2.0-flash', 
-        system_instruction=opponent_system_prompt
-    )
-    
-    # --- START OF FIX (ValueError: time) ---
-    dirty_previous_history = chat_history[:-1] 
-    clean_previous_history = [
-        {'role': msg['role'], 'parts': msg['parts']} 
-        for msg in dirty_previous_history
-    ]
-    chat_session = dynamic_chat_model.start_chat(history=clean_previous_history)
-    # --- END OF FIX ---
-    
-    try:
-        response = chat_session.send_message(user_input) 
-        ai_response_text = response.text
-    except Exception as e:
-        ai_response_text = f"An error occurred while generating the AI response: {e}"
-        print(f"API Error: {e}")
+
+jobs.register_handler('opponent_reply', run_opponent_reply)
+jobs.register_handler('judgment', run_judgment)
+
+
+def submit_judgment(session_data, chat_history, update_stats):
+    """
+    Queues the judgment of the finished debate (retried up to
+    JUDGMENT_MAX_ATTEMPTS times) and moves session_data to 'judging'. The
+    results dashboards pick the judgment up with collect_judgment().
+    """
+    debate_state = session_data['debate_state']
+    print("--- Queueing judgment with COMPLETE history ---")
+    session_data['judgment_job_id'] = jobs.submit('judgment', {
+        'username': session_data.get('active_user'),
+        'debate_state': debate_state,
+        'chat_history': chat_history,
+        'update_stats': update_stats,
+    }, secret=session_data.get('google_key'), max_attempts=JUDGMENT_MAX_ATTEMPTS,
+       dedup_key=turn_dedup_key('judgment', debate_state))
+    session_data['final_results'] = None
+    session_data['debate_state_before_completion'] = debate_state
+    session_data['debate_state'] = None
+    session_data['chat_history'] = chat_history
+    return session_data
+
+
+def collect_judgment(session_data):
+    """
+    Moves the result of a finished judgment job into
+    session_data['final_results']. Returns the job while it is still queued
+    or running, otherwise None.
+    """
+    job_id = session_data.get('judgment_job_id')
+    if not job_id:
+        return None
+    job = jobs.get_job(job_id)
+    if job is not None and job['status'] in (jobs.QUEUED, jobs.RUNNING):
+        return job
+
+    if job is None:
+        judgment = {'error': 'The judgment was lost (the job no longer exists).', 'raw_text': 'N/A'}
+    elif job['status'] == jobs.DONE:
+        judgment = job['result']
+    else:
+        judgment = {'error': f"Judge API/Parsing failed: {job['error'] or job['status']}", 'raw_text': 'N/A'}
+    session_data['final_results'] = judgment
+    session_data['judgment_job_id'] = None
+    return None
+
+
+app.clientside_callback(
+    ClientsideFunction(namespace='opponent', function_name='stream'),
+    Output('opponent-stream-result', 'data'),
+    Input('opponent-stream-request', 'data'),
+    prevent_initial_call=True
+)
+
+
+@app.callback(
+    [Output('chat-window', 'children', allow_duplicate=True),
+     Output('session-storage', 'data', allow_duplicate=True),
+     Output('loading-output', 'children', allow_duplicate=True),
+     Output('view-results-button', 'style', allow_duplicate=True),
+     Output('send-argument-button', 'disabled', allow_duplicate=True),
+     Output('user-input-textarea', 'disabled', allow_duplicate=True),
+     # --- NEW POPUP OUTPUTS ---
+     Output('api-key-error-popup', 'displayed', allow_duplicate=True),
+     Output('api-key-error-popup', 'message', allow_duplicate=True),
+     Output('user-input-textarea', 'value', allow_duplicate=True)],
+    Input('opponent-stream-result', 'data'),
+    [State('session-storage', 'data'),
+     State('chat-window', 'children')],
+    prevent_initial_call=True
+)
+def commit_opponent_reply(stream_result, session_data, current_chat):
+    results_button_style = {'display': 'none', 'marginTop': '10px'}
+    send_button_disabled = False
+    textarea_disabled = False
+
+    session_data = session_data or {}
+    # Only the reply we asked for, and only once.
+    if not stream_result or stream_result.get('id') != session_data.get('opponent_stream_id'):
+        return (no_update, no_update, None, no_update, no_update, no_update,
+                no_update, no_update, no_update)
+    session_data['opponent_stream_id'] = None
+
+    debate_state = session_data['debate_state']
+    chat_history = session_data.get('chat_history', [])
+    is_final_turn = debate_state['current_turn'] >= debate_state['total_turns']
+    context = compaction.collect(debate_state.get('context') or compaction.new_context())
+
+    # Drop the streaming bubble; the committed message replaces it.
+    current_chat = [child for child in (current_chat or [])
+                    if not (isinstance(child, dict) and
+                            child.get('props', {}).get('className') == OPPONENT_STREAM_CLASS)]
+
+    ai_response_text = stream_result.get('text') or ''
+    error = stream_result.get('error')
+    if error:
+        print(f"API Error{' (Final Turn)' if is_final_turn else ''}: {error}")
         # Check if it's an API key error
-        if "API key" in str(e):
+        if "API key" in error:
             error_msg = "ERROR: Google API Key is invalid or expired. Please check Settings."
-            return (no_update, no_update, None, no_update, 
-                    no_update, no_update, no_update, None, 
-                    True, error_msg)
-
+            return (current_chat, session_data, None, no_update, False, False,
+                    True, error_msg, no_update)
+        # The error is not added to the transcript as if it were the AI's
+        # argument: the user's turn is undone and their argument put back in
+        # the box, so pressing Send tries again.
+        argument = no_update
+        if chat_history and chat_history[-1]['role'] == 'user':
+            argument = chat_history.pop()['parts'][0]
+            debate_state['current_turn'] -= 1
+            discard_turns_from_db(debate_state, len(chat_history))
+            current_chat = current_chat[:-1]
+        session_data['chat_history'] = chat_history
+        if isinstance(error, str) and circuit_breaker.UNAVAILABLE in error:
+            error_msg = f"{error} Your argument was not sent."
+        elif isinstance(error, str) and ("busy" in error or "429" in error or "503" in error):
+            error_msg = ("The AI opponent is busy right now (rate limit). Your argument was not sent; "
+                         "press Send to try again in a moment.")
+        else:
+            error_msg = f"The AI opponent could not reply ({error}). Your argument was not sent; press Send to try again."
+        return (current_chat, session_data, None, no_update, False, False,
+                True, error_msg, argument)
 
     # 5. Add AI response
     ai_message = f"AI ({debate_state['opponent_stance']}): {ai_response_text}"
     current_chat.append(html.P(ai_message, style={'textAlign': 'left'}))
     chat_history.append({'role': 'model', 'parts': [ai_response_text]})
-    session_data['chat_history'] = chat_history 
-    
-    # Return 10 values
-    return (current_chat, session_data, None, no_update, 
-            results_button_style, send_button_disabled, textarea_disabled, None,
-            no_update, no_update)
+    save_turn_to_db(debate_state, chat_history)
+    session_data['chat_history'] = chat_history
+
+    if not is_final_turn:
+        # Summarize older turns in the background while the user writes the next argument
+        debate_state['context'] = compaction.schedule(context, debate_state, chat_history,
+                                                      session_data.get('google_key'),
+                                                      user=session_data.get('active_user'))
+        # Return 9 values
+        return (current_chat, session_data, None, results_button_style,
+                send_button_disabled, textarea_disabled,
+                no_update, no_update, no_update)
+
+    # --- FINAL TURN: queue the judgment (saved and scored by the job) ---
+    debate_state['context'] = context
+    session_data = submit_judgment(session_data, chat_history, update_stats=True)
+
+    # 6. Show results button right away; the results page waits for the scores
+    results_button_style = {'display': 'block', 'marginTop': '10px'} 
+    send_button_disabled = True
+    textarea_disabled = True
+
+    # Return 9 values
+    return (current_chat, session_data, None, results_button_style,
+            send_button_disabled, textarea_disabled,
+            no_update, no_update, no_update)
 
 
 # --- *** NEW: JUDGE MODE ("Hot-Seat") CALLBACKS *** ---
@@ -1081,12 +1331,17 @@ def start_judged_debate(n_clicks, topic, turns, p_a_name, p_a_stance, p_b_name,
         'player_B_name': p_b_name,
         'total_turns': int(turns) * 2,   # Total turns for *both* players
         'current_turn_count': 0,
-        'current_player_role': 'user'    # 'user' = Player A, 'model' = Player B
+        'turn_seq': 0,   # submissions so far; never goes back (see turn_dedup_key)
+        'current_player_role': 'user',   # 'user' = Player A, 'model' = Player B
+        'context': compaction.new_context(),
+        'chat_id': uuid.uuid4().hex   # identifies this session (see turn_dedup_key)
     }
+    debate_state['debate_id'] = start_debate_in_db(session_data.get('active_user'), debate_state)
     
     session_data['debate_state'] = debate_state
     session_data['chat_history'] = [] 
     session_data['final_results'] = None
+    session_data['judgment_job_id'] = None
     
     initial_message = html.Div(f"Debate started on: '{topic}'.",
                                style={'fontStyle': 'italic', 'color': 'grey', 'textAlign': 'center'})
@@ -1122,15 +1377,13 @@ def start_judged_debate(n_clicks, topic, turns, p_a_name, p_a_stance, p_b_name,
     prevent_initial_call=True
 )
 def handle_judged_turn(n_clicks, user_input, session_data, current_chat, timer_data):
-    import google.generativeai as genai
-
     current_chat = current_chat if current_chat is not None else []
     
     send_button_disabled = False
     textarea_disabled = False
     end_button_style = {'display': 'none', 'marginTop': '10px'}
 
-    if not user_input or not session_data or 'debate_state' not in session_data:
+    if not user_input or not session_data or not session_data.get('debate_state'):
         # Return 10 values
         return (no_update, no_update, no_update, None, None, 
                 no_update, no_update, no_update,
@@ -1138,6 +1391,7 @@ def handle_judged_turn(n_clicks, user_input, session_data, current_chat, timer_d
 
     debate_state = session_data['debate_state']
     chat_history = session_data.get('chat_history', []) 
+    debate_state['turn_seq'] = debate_state.get('turn_seq', 0) + 1
 
     # 1. Get current player info
     current_role = debate_state['current_player_role']
@@ -1162,13 +1416,14 @@ def handle_judged_turn(n_clicks, user_input, session_data, current_chat, timer_d
         'time': timer_string,
         'player_name': player_name 
     })
+    save_turn_to_db(debate_state, chat_history)
 
     # 3. Increment turn
     debate_state['current_turn_count'] += 1
     
     # 4. Check for end of debate
     if debate_state['current_turn_count'] >= debate_state['total_turns']:
-        print("--- Judged debate complete. Calling get_judgment ---")
+        print("--- Judged debate complete. Queueing the judgment ---")
         
         # --- MODIFIED ERROR HANDLING ---
         google_key = session_data.get('google_key')
@@ -1179,40 +1434,20 @@ def handle_judged_turn(n_clicks, user_input, session_data, current_chat, timer_d
                     True, True, no_update, 
                     True, error_msg)
 
-        try:
-            # Check for invalid key before proceeding
-            genai.configure(api_key=google_key) 
-            judgment = get_judgment(debate_state, chat_history, google_key)
-        except Exception as e:
-            print(f"--- handle_judged_turn CAUGHT AN ERROR: {e} ---")
-            # Check if it's an API key error
-            if "API key" in str(e):
-                error_msg = "ERROR: Google API Key is invalid or expired. Please check Settings."
-                return (no_update, no_update, no_update, None, None, 
-                        True, True, no_update, 
-                        True, error_msg)
-            judgment = {'error': f'Judge API/Parsing failed: {e}', 'raw_text': 'N/A'}
-
-        session_data['final_results'] = judgment
-        session_data['debate_state_before_completion'] = debate_state 
-        session_data['debate_state'] = None 
-        session_data['chat_history'] = chat_history
-
-        try:
-            save_debate_to_db(
-                session_data['active_user'], 
-                session_data['debate_state_before_completion'], 
-                chat_history, 
-                judgment
-            )
-        except Exception as e:
-            print(f"CRITICAL ERROR: Failed to save judged debate to DB: {e}")
+        # Judged and saved in the background; the results page waits for the scores.
+        session_data['debate_state'] = debate_state
+        session_data = submit_judgment(session_data, chat_history, update_stats=False)
 
         send_button_disabled = True
         textarea_disabled = True
         end_button_style = {'display': 'block', 'marginTop': '10px'}
         turn_display = f"Debate Finished! Click 'End Debate' to see scores."
 
+        # Return 10 values
+        return (current_chat, session_data, turn_display, None, None, 
+                send_button_disabled, textarea_disabled, end_button_style,
+                no_update, no_update)
+
     else:
         # Not the end, switch turns
         if current_role == 'user':
@@ -1241,22 +1476,25 @@ def handle_judged_turn(n_clicks, user_input, session_data, current_chat, timer_d
 # --- JUDGMENT & SCORING CALLBACKS (Shared) ---
 
 def get_judgment(debate_state, chat_history, google_key):
-    import google.generativeai as genai
-    
     if not google_key:
         return {"error": "Judge AI key not configured in session."}
         
     try:
-        genai.configure(api_key=google_key)
+        llm_client.get_client(google_key)
     except Exception as e:
          return {"error": f"Invalid Google API Key: {e}"}
     
-    print("--- V11.2: get_judgment HAS BEEN ENTERED ---")
     transcript = ""
     judge_prompt = "" 
     
     try:
-        for entry in chat_history:
+        # Turns already folded into the rolling summary are judged from it.
+        context = debate_state.get('context') or {}
+        if context.get('summary'):
+            transcript += (f"[Summary of the first {context['summarized_upto']} turns]\n"
+                           f"{context['summary']}\n\n[The remaining turns, verbatim]\n\n")
+
+        for entry in compaction.recent_turns(context, chat_history):
             role = "User" if entry['role'] == 'user' else "AI"
             
             if entry['role'] == 'user':
@@ -1265,33 +1503,35 @@ def get_judgment(debate_state, chat_history, google_key):
                 stance = debate_state['opponent_stance']
                 
             transcript += f"{role} ({stance}): {entry['parts'][0]}\n\n"
-        
-        print("--- V11.2: get_judgment HAS BUILT GENERIC TRANSCRIPT ---")
 
-        judge_prompt = DEBATE_JUDGE_PROMPT.format(
+        judge_prompt = DEBATE_JUDGE_CASE_PROMPT.format(
             topic=debate_state['topic'],
             user_stance=debate_state['user_stance'],
             ai_stance=debate_state['opponent_stance'],
             transcript=transcript
         )
+        cache_key = judgments.key(debate_state['topic'], debate_state['user_stance'],
+                                  debate_state['opponent_stance'], transcript, judge_setup())
     except Exception as e:
-        print(f"--- V11.2: ERROR DURING STRING FORMATTING: {e} ---")
         return {"error": f"Judge prompt formatting failed: {e}", "raw_text": "N/A"}
 
+    if judge_ensemble.enabled:
+        return judgments.get_or_compute(cache_key, lambda: judge_ensemble.judge(
+            lambda model, temperature: call_judge(google_key, judge_prompt, model, temperature)
+        ))
+    return judgments.get_or_compute(cache_key, lambda: call_judge(google_key, judge_prompt))
+
+
+def call_judge(google_key, judge_prompt, model=None, temperature=None):
+    """Runs the judge on a formatted case prompt and validates its JSON (or returns an error dict)."""
+    model = model or llm_client.JUDGE_MODEL
     raw_text = "" 
-    print("--- V11.2: get_judgment IS CALLING THE API ---") 
     try:
-        forced_config = genai.types.GenerationConfig(
-            response_mime_type="application/json" 
-        )
-        local_json_model = genai.GenerativeModel(
-            'gemini-2.0-flash',
-            generation_config=forced_config 
-        )
-        
         try:
-            response = local_json_model.generate_content(judge_prompt)
-            raw_text = response.text 
+            # Constrained to judgment_schema.Judgment; the fixed rubric goes first and is cached per key.
+            raw_text = llm_client.generate_judgment_text(google_key, DEBATE_JUDGE_PROMPT, judge_prompt,
+                                                         model=model, temperature=temperature,
+                                                         response_schema=judgment_schema.Judgment)
             
         except Exception as api_error:
             print(f"Google API call failed or response was invalid: {api_error}")
@@ -1301,21 +1541,20 @@ def get_judgment(debate_state, chat_history, google_key):
                 raw_text = "Could not get raw response."
             return {"error": f"Judge API/Parsing failed: {api_error}", "raw_text": raw_text}
 
-        json_match = re.search(r'\{.*\}', raw_text, re.DOTALL)
-        
-        if not json_match:
-            print(f"JSON parsing failed: No JSON object found in raw text.")
-            print(f"Raw AI Output: {raw_text}")
-            return {"error": "Failed to parse judgment: No JSON object found.", "raw_text": raw_text}
+        # Only fields that are missing or invalid are asked for again.
+        def repair(fields, repair_schema):
+            repair_prompt = judgment_schema.REPAIR_PROMPT.format(
+                judge_prompt=judge_prompt, raw_text=raw_text, fields=fields
+            )
+            return llm_client.generate_judgment_text(google_key, DEBATE_JUDGE_PROMPT, repair_prompt,
+                                                     model=model, temperature=temperature,
+                                                     response_schema=repair_schema, call_type='judge_repair')
 
-        json_text = json_match.group(0) 
-        
         try:
-            judgment = json.loads(json_text)
-            return judgment # Success!
-        except json.JSONDecodeError as e:
-            print(f"JSON parsing failed even after extraction: {e}")
-            print(f"Extracted Text: {json_text}")
+            return judgment_schema.decode(raw_text, model, repair) # Success!
+        except judgment_schema.JudgmentParseError as e:
+            print(f"JSON parsing failed: {e}")
+            print(f"Raw AI Output: {raw_text}")
             return {"error": f"Failed to parse judgment: {e}", "raw_text": raw_text}
 
     except Exception as e:
@@ -1323,106 +1562,102 @@ def get_judgment(debate_state, chat_history, google_key):
         return {"error": f"Unhandled judge error: {e}", "raw_text": raw_text}
 
 
-# This is only called for PRACTICE mode
-def update_user_stats(username, judgment):
+# This is only called for PRACTICE mode (from run_judgment)
+def update_user_stats(username, judgment, debate_id=None):
     print("--- Calling NEW 'safe' update_user_stats function ---")
     
     if not judgment or 'scores' not in judgment or 'reasoning' not in judgment:
         print(f"Skipping stats update for {username} due to malformed judgment.")
         return
 
-    con = get_db_connection()
-    ph = '?' if isinstance(con, sqlite3.Connection) else '%s'
-    
+    winner = judgment['reasoning'].get('overallWinner', 'Draw')
+    if winner == 'User':
+        outcome = 'won'
+    elif winner == 'AI':
+        outcome = 'lost'
+    else:
+        outcome = 'drawn'
+
+    # The 'skill' (camelCase) is the key in the judgment JSON.
+    # Scores that are missing or not numbers are sent as None, which
+    # leaves that running average unchanged.
+    judgment_scores = judgment['scores'].get('User', {})
+    user_scores = {}
+    for skill in repository.STAT_SKILLS:
+        try:
+            user_scores[skill] = float(judgment_scores.get(skill))
+        except (ValueError, TypeError):
+            user_scores[skill] = None
+
+    # The counters and all five averages are updated in ONE atomic UPDATE
+    # statement, so concurrent debates cannot lose an update. This runs in
+    # the judgment job, so it is written directly (the results page's gauges
+    # then include this debate as soon as the judgment lands); if the
+    # database is unavailable it goes through the persistence queue instead.
     try:
-        sql_read_stats = f"SELECT * FROM user_stats WHERE username = {ph}"
-        stats_df = pd.read_sql_query(
-            sql_read_stats,
-            con,
-            params=(username,)
-        )
-        
-        if stats_df.empty:
-            print(f"User {username} not found in stats table.")
-            return
-
-        user_stats = stats_df.iloc[0].to_dict()
-        winner = judgment['reasoning'].get('overallWinner', 'Draw')
-        
-        if winner == 'User':
-            user_stats['debates_won'] += 1
-        elif winner == 'AI':
-            user_stats['debates_lost'] += 1
-        else:
-            user_stats['debates_drawn'] += 1
-
-        user_scores = judgment['scores'].get('User', {})
-        total_debates = user_stats['debates_won'] + user_stats['debates_lost'] + user_stats['debates_drawn']
-
-        # --- *** START OF FIX *** ---
-        # The 'skill' (camelCase) is for the JSON dict 'user_scores'
-        # The 'stat_col_db' (lowercase) is for the DB dict 'user_stats'
-        for skill in ['logicalConsistency', 'evidenceAndExamples', 'clarityAndConcision',
-                      'rebuttalEffectiveness', 'overallPersuasiveness']:
-            
-            # DB key is lowercase, e.g., "avg_logicalconsistency"
-            stat_col_db = f'avg_{skill.lower()}' 
-
-            # Read current avg from DB dict using lowercase key
-            current_avg = user_stats[stat_col_db] 
-            
-            # Get new score from JSON dict using camelCase key
-            new_score = user_scores.get(skill, current_avg) 
-            
-            try:
-                new_score = float(new_score)
-            except (ValueError, TypeError):
-                new_score = current_avg 
-            
-            if total_debates > 0:
-                new_avg = ((current_avg * (total_debates - 1)) + new_score) / total_debates
-                # Write new avg to DB dict using lowercase key
-                user_stats[stat_col_db] = new_avg
-        
-        cur = con.cursor()
-        
-        sql_update_stats = f"""
-            UPDATE user_stats SET
-                debates_won = {ph}, debates_lost = {ph}, debates_drawn = {ph},
-                avg_logicalconsistency = {ph}, avg_evidenceandexamples = {ph},
-                avg_clarityandconcision = {ph}, avg_rebuttaleffectiveness = {ph},
-                avg_overallpersuasiveness = {ph}
-            WHERE username = {ph}
-            """
-        
-        cur.execute(
-            sql_update_stats,
-            (
-                user_stats['debates_won'], user_stats['debates_lost'], user_stats['debates_drawn'],
-                user_stats['avg_logicalconsistency'], user_stats['avg_evidenceandexamples'],
-                user_stats['avg_clarityandconcision'], user_stats['avg_rebuttaleffectiveness'],
-                user_stats['avg_overallpersuasiveness'],
-                username
-            )
-        )
-        # --- *** END OF FIX *** ---
-        con.commit()
-        print(f"Stats updated for {username} in the database.")
+        repository.apply_debate_result(username, outcome, user_scores, debate_id)
+        print(f"Stats updated for {username}.")
     except Exception as e:
-        con.rollback()
-        print(f"Error updating stats for {username}: {e}")
-    finally:
-        con.close()
+        print(f"Could not update stats for {username} now ({e}); queueing the update.")
+        persistence.submit('stats', {'username': username, 'outcome': outcome, 'scores': user_scores,
+                                     'debate_id': debate_id})
 
 # --- *** DASHBOARD CALLBACK 1 (PRACTICE) *** ---
+# The results pages open as soon as the debate ends. While the judgment job
+# is still running they show the transcript and poll ('*-dashboard-poll');
+# once it lands they render again with the scores table and gauges.
+def judgment_pending_message():
+    return html.Div([
+        html.H4("Post-Debate Breakdown"),
+        html.P("The judge is scoring the debate. The scores will appear here as soon as they are ready.",
+               style={'textAlign': 'center', 'fontStyle': 'italic'})
+    ])
+
+def transcript_review(chat_divs):
+    return [
+        html.Hr(),
+        html.H4("Full Debate Transcript Review"),
+        html.Details(
+            className='transcript-details-review', 
+            open=False, 
+            children=[
+                html.Summary("Click to review the full conversation"),
+                html.Div(chat_divs,
+                         style={
+                             'backgroundColor': 'white', 
+                             'border': '1px solid #ccc',
+                             'borderRadius': '8px',
+                             'padding': '15px',
+                             'maxHeight': '400px',
+                             'overflowY': 'auto',
+                             'marginTop': '10px'
+                         }
+                )
+            ]
+        )
+    ]
+
 @app.callback(
-    Output('practice-dashboard-content', 'children'),
-    [Input('url', 'pathname')],
-    [State('session-storage', 'data')]
+    [Output('practice-dashboard-content', 'children'),
+     Output('session-storage', 'data', allow_duplicate=True),
+     Output('practice-dashboard-poll', 'disabled')],
+    [Input('url', 'pathname'),
+     Input('practice-dashboard-poll', 'n_intervals')],
+    [State('session-storage', 'data')],
+    prevent_initial_call='initial_duplicate'
 )
-def render_practice_dashboard(pathname, session_data):
+def render_practice_dashboard(pathname, n_intervals, session_data):
     if pathname != '/practice-results' or not session_data or 'active_user' not in session_data:
-        return no_update
+        # Return 3 values
+        return no_update, no_update, no_update
+
+    had_job = bool(session_data.get('judgment_job_id'))
+    pending_job = collect_judgment(session_data)
+    if pending_job is not None and callback_context.triggered_id == 'practice-dashboard-poll':
+        # Still judging; the page already shows the transcript
+        return no_update, no_update, no_update
+    session_out = session_data if had_job and pending_job is None else no_update
+    poll_disabled = pending_job is None
 
     username = session_data['active_user']
     final_results = session_data.get('final_results')
@@ -1436,26 +1671,16 @@ def render_practice_dashboard(pathname, session_data):
                 return default
         return dct
 
-    con = get_db_connection()
-    ph = '?' if isinstance(con, sqlite3.Connection) else '%s'
-    
     try:
-        cur = con.cursor()
-        sql_select_stats = f"SELECT * FROM user_stats WHERE username = {ph}"
-        cur.execute(sql_select_stats, (username,))
-        user_stats_row = cur.fetchone()
-        if user_stats_row is None:
+        user_stats = repository.get_user_stats(username)
+        if user_stats is None:
             user_stats = { 'debates_won': 0, 'debates_lost': 0, 'debates_drawn': 0,
                            'avg_logicalconsistency': 0, 'avg_evidenceandexamples': 0,
                            'avg_clarityandconcision': 0, 'avg_rebuttaleffectiveness': 0,
                            'avg_overallpersuasiveness': 0 }
-        else:
-            user_stats = user_stats_row
     except Exception as e:
         print(f"Error reading dashboard stats: {e}")
-        return html.P("Error loading user statistics.")
-    finally:
-        con.close()
+        return html.P("Error loading user statistics."), session_out, poll_disabled
 
     gauge_colors = { "gradient": True, "colorStops": [
             {"offset": 0, "color": "#533483"},
@@ -1481,8 +1706,38 @@ def render_practice_dashboard(pathname, session_data):
         html.Hr(),
     ]
 
+    # --- Practice Mode Logic ---
+    chat_history = session_data.get('chat_history', [])
+    user_stance = saved_state.get('user_stance', 'User')
+    ai_stance = saved_state.get('opponent_stance', 'AI')
+    user_display = f"YOU ({user_stance})"
+    ai_display = f"AI ({ai_stance})"
+
+    # --- START: CHAT TRANSCRIPT RENDERING LOGIC ---
+    chat_divs = []
+    for entry in chat_history:
+        role = entry.get('role', 'system')
+        text = entry['parts'][0]
+        time_string = entry.get('time')
+        time_display = f" ({time_string})" if time_string else ""
+        
+        if role == 'user':
+            message_content = f"{user_display}{time_display}: {text}"
+            style = {'textAlign': 'right', 'color': '#111827', 'padding': '5px 0'} 
+        elif role == 'model':
+            message_content = f"{ai_display}{time_display}: {text}"
+            style = {'textAlign': 'left', 'color': '#374151', 'padding': '5px 0'} 
+        else:
+            message_content = f"System: {text}"
+            style = {'textAlign': 'center', 'fontStyle': 'italic', 'color': '#6b7280', 'padding': '5px 0'}
+
+        chat_divs.append(html.P(message_content, style=style))
+    # --- END: CHAT TRANSCRIPT RENDERING LOGIC ---
+
     # --- POST-DEBATE BREAKDOWN ---
-    if final_results:
+    if pending_job is not None:
+        layout.append(judgment_pending_message())
+    elif final_results:
         if "error" in final_results:
             layout.append(html.Div([
                 html.H4("Post-Debate Breakdown", style={'color': 'red'}),
@@ -1490,14 +1745,9 @@ def render_practice_dashboard(pathname, session_data):
                 html.Code(f"Raw AI Output: {final_results.get('raw_text', 'N/A')}", style={'whiteSpace': 'pre-wrap'})
             ]))
         else:
-            chat_history = session_data.get('chat_history', [])
             scores = safe_get(final_results, ['scores'], {})
             reasoning = safe_get(final_results, ['reasoning'], {})
 
-            # --- Practice Mode Logic ---
-            user_stance = saved_state.get('user_stance', 'User')
-            ai_stance = saved_state.get('opponent_stance', 'AI')
-            
             winner = reasoning.get('overallWinner', 'N/A')
             winner_status = 'Won' if winner == 'User' else 'Lost' if winner == 'AI' else 'Drew' if winner == 'Draw' else 'N/A'
             outcome_title = f"Outcome: You {winner_status}"
@@ -1505,34 +1755,10 @@ def render_practice_dashboard(pathname, session_data):
             user_header = "Your Score"
             ai_header = "AI's Score"
             
-            user_display = f"YOU ({user_stance})"
-            ai_display = f"AI ({ai_stance})"
-            
             feedback_text = reasoning.get('constructiveFeedbackUser', 'N/A')
             feedback_title = "Feedback for You:"
-            
-            # --- START: CHAT TRANSCRIPT RENDERING LOGIC ---
-            chat_divs = []
-            for entry in chat_history:
-                role = entry.get('role', 'system')
-                text = entry['parts'][0]
-                time_string = entry.get('time')
-                time_display = f" ({time_string})" if time_string else ""
-                
-                if role == 'user':
-                    message_content = f"{user_display}{time_display}: {text}"
-                    style = {'textAlign': 'right', 'color': '#111827', 'padding': '5px 0'} 
-                elif role == 'model':
-                    message_content = f"{ai_display}{time_display}: {text}"
-                    style = {'textAlign': 'left', 'color': '#374151', 'padding': '5px 0'} 
-                else:
-                    message_content = f"System: {text}"
-                    style = {'textAlign': 'center', 'fontStyle': 'italic', 'color': '#6b7280', 'padding': '5px 0'}
-
-                chat_divs.append(html.P(message_content, style=style))
-            # --- END: CHAT TRANSCRIPT RENDERING LOGIC ---
-
-            # --- EXTENDED LAYOUT WITH BREAKDOWN AND TRANSCRIPT ---
+
+            # --- EXTENDED LAYOUT WITH BREAKDOWN ---
             layout.extend([
                 html.H4("Post-Debate Breakdown"), 
                 html.H3(outcome_title, style={'textAlign': 'center', 'marginTop': '10px'}),
@@ -1558,31 +1784,13 @@ def render_practice_dashboard(pathname, session_data):
                         style={'fontWeight': 'bold', 'marginTop': '10px'}
                     )
                 ]),
-                
-                html.Hr(),
-                html.H4("Full Debate Transcript Review"),
-                html.Details(
-                    className='transcript-details-review', 
-                    open=False, 
-                    children=[
-                        html.Summary("Click to review the full conversation"),
-                        html.Div(chat_divs,
-                                 style={
-                                     'backgroundColor': 'white', 
-                                     'border': '1px solid #ccc',
-                                     'borderRadius': '8px',
-                                     'padding': '15px',
-                                     'maxHeight': '400px',
-                                     'overflowY': 'auto',
-                                     'marginTop': '10px'
-                                 }
-                        )
-                    ]
-                )
             ])
     else:
         layout.append(html.P("Complete a debate to see the results here.", style={'textAlign': 'center', 'fontStyle': 'italic'}))
 
+    if chat_divs and (pending_job is not None or final_results):
+        layout.extend(transcript_review(chat_divs))
+
     layout.append(html.Hr(style={'marginTop': '30px'}))
     layout.append(
         html.Div([
@@ -1591,18 +1799,32 @@ def render_practice_dashboard(pathname, session_data):
         ], style={'textAlign': 'center', 'marginTop': '20px'}) 
     )
     
-    return layout
+    # Return 3 values
+    return layout, session_out, poll_disabled
 
 
 # --- *** MODIFIED: DASHBOARD CALLBACK 2 (JUDGE) *** ---
 @app.callback(
-    Output('judge-dashboard-content', 'children'),
-    Input('url', 'pathname'),
-    State('session-storage', 'data')
+    [Output('judge-dashboard-content', 'children'),
+     Output('session-storage', 'data', allow_duplicate=True),
+     Output('judge-dashboard-poll', 'disabled')],
+    [Input('url', 'pathname'),
+     Input('judge-dashboard-poll', 'n_intervals')],
+    State('session-storage', 'data'),
+    prevent_initial_call='initial_duplicate'
 )
-def render_judge_dashboard(pathname, session_data):
+def render_judge_dashboard(pathname, n_intervals, session_data):
     if pathname != '/judge-results' or not session_data or 'active_user' not in session_data:
-        return no_update
+        # Return 3 values
+        return no_update, no_update, no_update
+
+    had_job = bool(session_data.get('judgment_job_id'))
+    pending_job = collect_judgment(session_data)
+    if pending_job is not None and callback_context.triggered_id == 'judge-dashboard-poll':
+        # Still judging; the page already shows the transcript
+        return no_update, no_update, no_update
+    session_out = session_data if had_job and pending_job is None else no_update
+    poll_disabled = pending_job is None
 
     final_results = session_data.get('final_results')
     saved_state = session_data.get('debate_state_before_completion', {})
@@ -1617,8 +1839,40 @@ def render_judge_dashboard(pathname, session_data):
                 return default
         return dct
 
+    # --- Judge Mode Logic ---
+    chat_history = session_data.get('chat_history', [])
+    player_A_name = saved_state.get('player_A_name', 'Player A')
+    player_B_name = saved_state.get('player_B_name', 'Player B')
+    user_stance = saved_state.get('user_stance', 'For')
+    ai_stance = saved_state.get('opponent_stance', 'Against')
+    user_display = f"{player_A_name} ({user_stance})"
+    ai_display = f"{player_B_name} ({ai_stance})"
+
+    # --- START: CHAT TRANSCRIPT RENDERING LOGIC ---
+    chat_divs = []
+    for entry in chat_history:
+        role = entry.get('role', 'system')
+        text = entry['parts'][0]
+        time_string = entry.get('time')
+        time_display = f" ({time_string})" if time_string else ""
+        
+        if role == 'user': # Player A
+            message_content = f"{user_display}{time_display}: {text}"
+            style = {'textAlign': 'right', 'color': '#111827', 'padding': '5px 0'} 
+        elif role == 'model': # Player B
+            message_content = f"{ai_display}{time_display}: {text}"
+            style = {'textAlign': 'left', 'color': '#374151', 'padding': '5px 0'} 
+        else:
+            message_content = f"System: {text}"
+            style = {'textAlign': 'center', 'fontStyle': 'italic', 'color': '#6b7280', 'padding': '5px 0'}
+
+        chat_divs.append(html.P(message_content, style=style))
+    # --- END: CHAT TRANSCRIPT RENDERING LOGIC ---
+
     # --- POST-DEBATE BREAKDOWN ---
-    if final_results:
+    if pending_job is not None:
+        layout.append(judgment_pending_message())
+    elif final_results:
         if "error" in final_results:
             layout.append(html.Div([
                 html.H4("Post-Debate Breakdown", style={'color': 'red'}),
@@ -1626,16 +1880,9 @@ def render_judge_dashboard(pathname, session_data):
                 html.Code(f"Raw AI Output: {final_results.get('raw_text', 'N/A')}", style={'whiteSpace': 'pre-wrap'})
             ]))
         else:
-            chat_history = session_data.get('chat_history', [])
             scores = safe_get(final_results, ['scores'], {})
             reasoning = safe_get(final_results, ['reasoning'], {})
 
-            # --- Judge Mode Logic ---
-            player_A_name = saved_state.get('player_A_name', 'Player A')
-            player_B_name = saved_state.get('player_B_name', 'Player B')
-            user_stance = saved_state.get('user_stance', 'For')
-            ai_stance = saved_state.get('opponent_stance', 'Against')
-            
             winner = reasoning.get('overallWinner', 'Draw')
             winner_name = player_A_name if winner == 'User' else player_B_name if winner == 'AI' else 'Draw'
             outcome_title = f"Outcome: {winner_name} Wins!" if winner != 'Draw' else "Outcome: Draw"
@@ -1643,36 +1890,12 @@ def render_judge_dashboard(pathname, session_data):
             user_header = f"{player_A_name}'s Score"
             ai_header = f"{player_B_name}'s Score"
             
-            user_display = f"{player_A_name} ({user_stance})"
-            ai_display = f"{player_B_name} ({ai_stance})"
-            
             feedback_A_text = reasoning.get('constructiveFeedbackUser', 'N/A')
             feedback_A_title = f"Feedback for {player_A_name}:"
             feedback_B_text = reasoning.get('constructiveFeedbackAI', 'N/A')
             feedback_B_title = f"Feedback for {player_B_name}:"
-            
-            # --- START: CHAT TRANSCRIPT RENDERING LOGIC ---
-            chat_divs = []
-            for entry in chat_history:
-                role = entry.get('role', 'system')
-                text = entry['parts'][0]
-                time_string = entry.get('time')
-                time_display = f" ({time_string})" if time_string else ""
-                
-                if role == 'user': # Player A
-                    message_content = f"{user_display}{time_display}: {text}"
-                    style = {'textAlign': 'right', 'color': '#111827', 'padding': '5px 0'} 
-                elif role == 'model': # Player B
-                    message_content = f"{ai_display}{time_display}: {text}"
-                    style = {'textAlign': 'left', 'color': '#374151', 'padding': '5px 0'} 
-                else:
-                    message_content = f"System: {text}"
-                    style = {'textAlign': 'center', 'fontStyle': 'italic', 'color': '#6b7280', 'padding': '5px 0'}
-
-                chat_divs.append(html.P(message_content, style=style))
-            # --- END: CHAT TRANSCRIPT RENDERING LOGIC ---
-
-            # --- EXTENDED LAYOUT WITH BREAKDOWN AND TRANSCRIPT ---
+
+            # --- EXTENDED LAYOUT WITH BREAKDOWN ---
             layout.extend([
                 html.H4("Post-Debate Breakdown"), 
                 html.H3(outcome_title, style={'textAlign': 'center', 'marginTop': '10px'}),
@@ -1703,31 +1926,13 @@ def render_judge_dashboard(pathname, session_data):
                         style={'fontWeight': 'bold', 'marginTop': '10px'}
                     )
                 ]),
-                
-                html.Hr(),
-                html.H4("Full Debate Transcript Review"),
-                html.Details(
-                    className='transcript-details-review', 
-                    open=False, 
-                    children=[
-                        html.Summary("Click to review the full conversation"),
-                        html.Div(chat_divs,
-                                 style={
-                                     'backgroundColor': 'white', 
-                                     'border': '1px solid #ccc',
-                                     'borderRadius': '8px',
-                                     'padding': '15px',
-                                     'maxHeight': '400px',
-                                     'overflowY': 'auto',
-                                     'marginTop': '10px'
-                                 }
-                        )
-                    ]
-                )
             ])
     else:
         layout.append(html.P("Complete a debate to see the results here.", style={'textAlign': 'center', 'fontStyle': 'italic'}))
 
+    if chat_divs and (pending_job is not None or final_results):
+        layout.extend(transcript_review(chat_divs))
+
     layout.append(html.Hr(style={'marginTop': '30px'}))
     
     layout.append(
@@ -1737,102 +1942,104 @@ def render_judge_dashboard(pathname, session_data):
         ], style={'textAlign': 'center', 'marginTop': '20px'}) 
     )
     
-    return layout
+    # Return 3 values
+    return layout, session_out, poll_disabled
 
 # --- *** NEW: HISTORY PAGE CALLBACKS *** ---
 
 # Callback 1: Load the list of past debates into the dropdown
+# One page at a time (keyset pagination): the first page when /history is
+# opened, then the next page each time 'Load older debates' is clicked.
+HISTORY_PAGE_SIZE = 50
+
+def format_history_timestamps(timestamps):
+    """
+    Converts one page of DB timestamps to IST display strings in a single
+    vectorised pandas call (instead of one pd.to_datetime per row).
+    Naive timestamps (from SQLite) are treated as UTC.
+    """
+    if not timestamps:
+        return []
+    ts = pd.to_datetime(pd.Series(timestamps), utc=True, format='mixed')
+    return ts.dt.tz_convert('Asia/Kolkata').dt.strftime('%Y-%m-%d %I:%M %p').tolist()
+
 @app.callback(
-    Output('history-dropdown', 'options'),
-    Input('url', 'pathname'),
-    State('session-storage', 'data')
+    [Output('history-dropdown', 'options'),
+     Output('history-cursor-store', 'data'),
+     Output('history-load-more-button', 'style')],
+    [Input('url', 'pathname'),
+     Input('history-load-more-button', 'n_clicks')],
+    [State('session-storage', 'data'),
+     State('history-dropdown', 'options'),
+     State('history-cursor-store', 'data')]
 )
-def load_history_dropdown(pathname, session_data):
+def load_history_dropdown(pathname, load_more_clicks, session_data, current_options, cursor):
+    hidden = {'display': 'none'}
     if pathname != '/history' or not session_data:
-        return []
+        return [], None, hidden
 
     username = session_data.get('active_user')
     if not username:
-        return []
+        return [], None, hidden
 
-    options = []
-    con = get_db_connection()
-    ph = '?' if isinstance(con, sqlite3.Connection) else '%s'
-    sql_select = f"SELECT id, debate_topic, debate_mode, timestamp FROM debate_history WHERE username = {ph} ORDER BY timestamp DESC"
-    
+    ctx = callback_context
+    loading_more = bool(ctx.triggered) and ctx.triggered[0]['prop_id'].startswith('history-load-more-button')
+    if loading_more and not cursor:
+        return no_update, no_update, no_update
+
+    options = list(current_options or []) if loading_more else []
+    next_cursor = None
     try:
-        cur = con.cursor()
-        cur.execute(sql_select, (username,))
-        history = cur.fetchall()
+        history, next_cursor = repository.list_debates_page(
+            username, HISTORY_PAGE_SIZE, cursor if loading_more else None
+        )
+        labels_ts = format_history_timestamps([item['timestamp'] for item in history])
         
-        for item in history:
-            
-            # --- START OF TIMEZONE FIX ---
-            ts_obj = pd.to_datetime(item['timestamp'])
-            
-            if ts_obj.tzinfo is None:
-                # It's a naive timestamp (from SQLite), localize it to UTC
-                ts_obj = ts_obj.tz_localize('UTC')
-            
-            # Now it's timezone-aware, so convert to IST
-            ts = ts_obj.tz_convert('Asia/Kolkata').strftime('%Y-%m-%d %I:%M %p')
-            # --- END OF TIMEZONE FIX ---
-            
+        for item, ts in zip(history, labels_ts):
             mode = "Practice Mode" if item['debate_mode'] == 'practice' else "Judge Mode"
             topic = item['debate_topic']
             
             label = f"{ts} - {mode} - {topic}"
+            if item['unfinished']:
+                label += " (unfinished)"
             value = item['id']
             options.append({'label': label, 'value': value})
             
     except Exception as e:
         print(f"Error loading debate history: {e}")
-    finally:
-        con.close()
         
     if not options:
-        return [{'label': 'No debates found in your history.', 'value': '', 'disabled': True}]
+        return [{'label': 'No debates found in your history.', 'value': '', 'disabled': True}], None, hidden
         
-    return options
+    more_style = {'marginTop': '10px'} if next_cursor else hidden
+    return options, next_cursor, more_style
 
 # Callback 2: Load a selected debate from history into session and redirect
-@app.callback(
-    [Output('session-storage', 'data', allow_duplicate=True),
-     Output('url', 'pathname', allow_duplicate=True),
-     Output('history-content-container', 'children')],
-    Input('history-dropdown', 'value'),
-    State('session-storage', 'data'),
-    prevent_initial_call=True
-)
-def load_selected_history_to_session(selected_debate_id, session_data):
-    if not selected_debate_id:
-        return no_update, no_update, no_update
-
+def load_debate_into_session(selected_debate_id, session_data):
+    """
+    Shared by the dropdown and the search results.
+    Returns (session_data, redirect_url, message) for the callbacks' outputs.
+    """
     if not session_data:
         return no_update, '/login', "Session expired. Please log in." # Should not happen
 
     username = session_data.get('active_user')
     
-    con = get_db_connection()
-    ph = '?' if isinstance(con, sqlite3.Connection) else '%s'
-    sql_select = f"SELECT * FROM debate_history WHERE id = {ph} AND username = {ph}"
-
     try:
-        cur = con.cursor()
-        cur.execute(sql_select, (selected_debate_id, username))
-        debate_record = cur.fetchone()
+        debate_record = repository.get_debate(selected_debate_id, username)
         
         if debate_record:
-            # Load the JSON strings from the DB
+            # Load the JSON strings from the DB; the transcript comes from debate_turns
             debate_state = json.loads(debate_record['debate_state'])
-            chat_history = json.loads(debate_record['chat_history'])
-            final_results = json.loads(debate_record['final_results'])
+            chat_history = repository.get_transcript(debate_record['id'])
+            final_results = json.loads(debate_record['final_results']) if debate_record['final_results'] else None
             debate_mode = debate_record['debate_mode']
             
             # --- CRITICAL: Overwrite the session with this old data ---
             session_data['debate_state_before_completion'] = debate_state
             session_data['chat_history'] = chat_history
             session_data['final_results'] = final_results
+            session_data['judgment_job_id'] = None
             session_data['debate_state'] = None # Ensure no live debate is active
             
             # Determine where to redirect
@@ -1849,5 +2056,76 @@ def load_selected_history_to_session(selected_debate_id, session_data):
     except Exception as e:
         print(f"Error loading selected debate: {e}")
         return no_update, no_update, html.P(f"An error occurred: {e}", style={'color': 'red'})
-    finally:
-        con.close()
\ No newline at end of file
+
+@app.callback(
+    [Output('session-storage', 'data', allow_duplicate=True),
+     Output('url', 'pathname', allow_duplicate=True),
+     Output('history-content-container', 'children')],
+    Input('history-dropdown', 'value'),
+    State('session-storage', 'data'),
+    prevent_initial_call=True
+)
+def load_selected_history_to_session(selected_debate_id, session_data):
+    if not selected_debate_id:
+        return no_update, no_update, no_update
+    return load_debate_into_session(selected_debate_id, session_data)
+
+# Callback 3: Full-text search over past debates
+def render_snippet(snippet):
+    """Turns the marker-delimited snippet from the search index into html.Mark highlights."""
+    children = []
+    for i, chunk in enumerate((snippet or '').split(repository.SNIPPET_START)):
+        if i == 0:
+            children.append(chunk)
+            continue
+        highlighted, _, rest = chunk.partition(repository.SNIPPET_END)
+        children.append(html.Mark(highlighted))
+        children.append(rest)
+    return [child for child in children if child != '']
+
+@app.callback(
+    Output('history-search-results', 'children'),
+    Input('history-search-input', 'value'),
+    State('session-storage', 'data'),
+    prevent_initial_call=True
+)
+def search_history(search_text, session_data):
+    username = (session_data or {}).get('active_user')
+    if not username or not search_text or not search_text.strip():
+        return []
+
+    try:
+        matches = repository.search_debates(username, search_text)
+    except Exception as e:
+        print(f"Error searching debate history: {e}")
+        return html.P("Search is unavailable right now.", style={'color': 'red'})
+
+    if not matches:
+        return html.P("No debates match your search.", style={'fontStyle': 'italic'})
+
+    timestamps = format_history_timestamps([item['timestamp'] for item in matches])
+    results = []
+    for item, ts in zip(matches, timestamps):
+        mode = "Practice Mode" if item['debate_mode'] == 'practice' else "Judge Mode"
+        results.append(html.Div([
+            html.Div(f"{ts} - {mode} - {item['debate_topic']}", className='history-search-title'),
+            html.Div(render_snippet(item['snippet']), className='history-search-snippet'),
+        ], id={'type': 'history-search-result', 'index': item['id']}, n_clicks=0,
+           className='history-search-result'))
+    return results
+
+@app.callback(
+    [Output('session-storage', 'data', allow_duplicate=True),
+     Output('url', 'pathname', allow_duplicate=True),
+     Output('history-content-container', 'children', allow_duplicate=True)],
+    Input({'type': 'history-search-result', 'index': ALL}, 'n_clicks'),
+    State('session-storage', 'data'),
+    prevent_initial_call=True
+)
+def open_search_result(n_clicks_list, session_data):
+    ctx = callback_context
+    # Fires when results are (re)rendered too; only act on a real click.
+    if not ctx.triggered or not ctx.triggered[0]['value']:
+        return no_update, no_update, no_update
+    debate_id = ctx.triggered_id['index']
+    return load_debate_into_session(debate_id, session_data)
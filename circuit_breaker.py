@@ -0,0 +1,236 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+# --- Circuit breakers (Gemini, Azure Speech) ---
+# When a provider is down or very slow, every request used to wait out its
+# full timeout, tying up a worker thread each, until the app stopped
+# answering. A breaker per provider and per API key now counts consecutive
+# failures -- errors that mean the service is unwell (5xx, timeouts,
+# dropped connections), and calls slower than the provider's latency SLO.
+# After CIRCUIT_FAILURE_THRESHOLD of them the breaker opens and new calls
+# fail at once with CircuitOpenError, whose message is shown to the user.
+# After CIRCUIT_OPEN_SECONDS it lets a single probe call through
+# (half-open): success closes it, failure opens it again.
+#
+# The provider-wide breaker only opens when the failures came from at least
+# CIRCUIT_PROVIDER_MIN_KEYS different keys, so one dead key cannot block
+# everyone else. Errors caused by the request (bad key, bad request) and
+# rate limits (handled by llm_scheduler.py) do not count either way.
+#
+# State is per process and shown under 'circuit_breakers' in /server-stats.
+
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get('CIRCUIT_FAILURE_THRESHOLD', '5'))
+CIRCUIT_OPEN_SECONDS = float(os.environ.get('CIRCUIT_OPEN_SECONDS', '30'))
+CIRCUIT_PROVIDER_MIN_KEYS = int(os.environ.get('CIRCUIT_PROVIDER_MIN_KEYS', '2'))
+LATENCY_SLO = {  # seconds; a slower call counts as a failure
+    'gemini': float(os.environ.get('GEMINI_LATENCY_SLO', '45')),
+    'azure_speech': float(os.environ.get('AZURE_SPEECH_LATENCY_SLO', '60')),
+}
+PROVIDER_NAMES = {'gemini': 'The AI service (Gemini)', 'azure_speech': 'Speech recognition (Azure)'}
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Outcomes of a call, as seen by the breaker.
+SUCCESS = 'success'
+FAILURE = 'failure'
+NEUTRAL = 'neutral'
+
+UNAVAILABLE = "temporarily unavailable"  # in every CircuitOpenError message
+
+
+class CircuitOpenError(Exception):
+    """The provider (or this key) is failing; the call was not attempted."""
+
+
+class CircuitBreaker:
+    """Closed -> open after repeated failures -> half-open probe -> closed or open again."""
+
+    def __init__(self, provider, threshold, open_seconds, slo, min_keys=1):
+        self.provider = provider
+        self.threshold = threshold
+        self.open_seconds = open_seconds
+        self.slo = slo
+        self.min_keys = min_keys
+        self.state = CLOSED
+        self.failures = 0          # consecutive
+        self.failing_keys = set()  # keys in the current failure streak
+        self.opened_at = 0.0
+        self.probing = False
+        self.last_error = None
+        self.calls = 0
+        self.total_failures = 0
+        self.slow_calls = 0
+        self.rejected = 0
+        self.trips = 0
+        self._lock = threading.Lock()
+
+    def retry_in(self, now):
+        return max(0.0, self.opened_at + self.open_seconds - now)
+
+    def _error(self, now):
+        name = PROVIDER_NAMES.get(self.provider, self.provider)
+        return CircuitOpenError(f"{name} is {UNAVAILABLE} after repeated failures; "
+                                f"please try again in {max(1, round(self.retry_in(now)))}s.")
+
+    def check(self):
+        """Raises CircuitOpenError while open (without taking the half-open probe)."""
+        with self._lock:
+            now = time.monotonic()
+            if self.state == OPEN and self.retry_in(now) > 0:
+                self.rejected += 1
+                raise self._error(now)
+
+    def admit(self):
+        """
+        Lets a call through (returning True if it is the half-open probe) or
+        raises CircuitOpenError. Every admitted call must be recorded.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self.state == OPEN:
+                if self.retry_in(now) > 0:
+                    self.rejected += 1
+                    raise self._error(now)
+                self.state = HALF_OPEN
+                self.probing = False
+                print(f"Circuit breaker {self.provider}: half-open, sending a probe call.")
+            if self.state == HALF_OPEN:
+                if self.probing:
+                    self.rejected += 1
+                    raise self._error(now)
+                self.probing = True
+                self.calls += 1
+                return True
+            self.calls += 1
+            return False
+
+    def record(self, outcome, elapsed, key_id=None, error=None, probe=False):
+        with self._lock:
+            if probe:
+                self.probing = False
+            if outcome == SUCCESS and elapsed > self.slo:
+                outcome = FAILURE
+                error = f"took {elapsed:.1f}s (SLO {self.slo:g}s)"
+                self.slow_calls += 1
+            if outcome == NEUTRAL:
+                return
+            if outcome == SUCCESS:
+                if probe:
+                    print(f"Circuit breaker {self.provider}: probe succeeded, closed.")
+                self.state = CLOSED
+                self.failures = 0
+                self.failing_keys.clear()
+                return
+            self.failures += 1
+            self.total_failures += 1
+            self.failing_keys.add(key_id)
+            self.last_error = str(error)[:200] if error is not None else None
+            if probe or (self.state == CLOSED and self.failures >= self.threshold
+                         and len(self.failing_keys) >= self.min_keys):
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self.trips += 1
+                print(f"Circuit breaker {self.provider}: opened for {self.open_seconds:g}s after "
+                      f"{self.failures} failures (last: {self.last_error}).")
+
+    def stats(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self.failures,
+                'retry_in_s': round(self.retry_in(time.monotonic()), 1) if self.state == OPEN else None,
+                'calls': self.calls,
+                'failures': self.total_failures,
+                'slow_calls': self.slow_calls,
+                'rejected': self.rejected,
+                'trips': self.trips,
+                'last_error': self.last_error,
+            }
+
+
+class Breakers:
+    """One breaker per provider and one per (provider, key)."""
+
+    def __init__(self):
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def get(self, provider, key_id=None):
+        with self._lock:
+            breaker = self._breakers.get((provider, key_id))
+            if breaker is None:
+                breaker = self._breakers[(provider, key_id)] = CircuitBreaker(
+                    provider, CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_OPEN_SECONDS, LATENCY_SLO.get(provider, 60.0),
+                    min_keys=CIRCUIT_PROVIDER_MIN_KEYS if key_id is None else 1
+                )
+            return breaker
+
+    def check(self, provider, key_id):
+        """Fails fast if the provider or the key is open (e.g. before queueing a call)."""
+        self.get(provider).check()
+        self.get(provider, key_id).check()
+
+    def stats(self):
+        with self._lock:
+            breakers = dict(self._breakers)
+        out = {}
+        for (provider, key_id), breaker in sorted(breakers.items(), key=lambda item: (item[0][0], item[0][1] or '')):
+            entry = out.setdefault(provider, {'keys': {}})
+            if key_id is None:
+                entry.update(breaker.stats())
+            else:
+                entry['keys'][key_id[:12]] = breaker.stats()
+        return out
+
+
+breakers = Breakers()
+
+
+class Call:
+    """An admitted call; the guarded code may mark it failed without raising."""
+
+    def __init__(self):
+        self.outcome = SUCCESS
+        self.error = None
+
+    def failed(self, error):
+        self.outcome = FAILURE
+        self.error = error
+
+    def neutral(self):
+        self.outcome = NEUTRAL
+
+
+@contextmanager
+def guard(provider, key_id, classify=lambda e: FAILURE):
+    """
+    Runs the block through the provider's and the key's breakers. Raises
+    CircuitOpenError without running it if either is open. An exception in
+    the block is recorded as classify(e) (SUCCESS, FAILURE or NEUTRAL).
+    """
+    admitted = []  # (breaker, is probe)
+    try:
+        for breaker in (breakers.get(provider), breakers.get(provider, key_id)):
+            admitted.append((breaker, breaker.admit()))
+    except CircuitOpenError:
+        for breaker, probe in admitted:
+            breaker.record(NEUTRAL, 0.0, probe=probe)  # give the probe back
+        raise
+
+    call = Call()
+    started = time.monotonic()
+    outcome, error = NEUTRAL, None  # if the block is abandoned (e.g. a generator closed early)
+    try:
+        yield call
+        outcome, error = call.outcome, call.error
+    except Exception as e:
+        outcome, error = classify(e), e
+        raise
+    finally:
+        elapsed = time.monotonic() - started
+        for breaker, probe in admitted:
+            breaker.record(outcome, elapsed, key_id, error, probe=probe)
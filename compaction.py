@@ -0,0 +1,119 @@
+import os
+
+import jobs
+import llm_client
+import llm_scheduler
+
+# --- Rolling context compaction ---
+# Sending the whole transcript on every turn makes each prompt longer than
+# the last, so input tokens grow with the square of the turn count. Instead
+# a debate keeps a "context" in its debate_state:
+#
+#   {'summary': <summary of turns [0, summarized_upto)>,
+#    'summarized_upto': <index of the first turn still sent verbatim>,
+#    'job_id': <pending 'compact_context' job, or None>}
+#
+# Only the turns from summarized_upto on are sent verbatim; everything
+# before them is represented by the summary. Between turns, once more than
+# KEEP_TURNS + COMPACT_BATCH turns are unsummarized, a background job folds
+# the oldest ones into the summary (see jobs.py), so the prompt stays about
+# the same size however long the debate runs. Until that job lands the
+# previous summary is used, so a turn never waits for it.
+
+KEEP_TURNS = int(os.environ.get('CONTEXT_KEEP_TURNS', '6'))          # newest turns always sent verbatim
+COMPACT_BATCH = int(os.environ.get('CONTEXT_COMPACT_BATCH', '4'))    # fold at least this many turns at a time
+
+SUMMARY_PROMPT = """
+You are keeping running notes on a formal debate so it can continue without the full transcript.
+Topic: {topic}
+User's stance: {user_stance}. AI's stance: {ai_stance}.
+
+NOTES SO FAR (may be empty):
+{summary}
+
+NEW TURNS:
+{turns}
+
+Rewrite the notes to cover everything above. For each side, list its arguments, evidence and
+examples, the rebuttals it made and which points the other side left unanswered. Be factual and
+neutral, do not judge who is winning, and keep the notes under 400 words.
+"""
+
+
+def new_context():
+    return {'summary': '', 'summarized_upto': 0, 'job_id': None}
+
+
+def format_turns(turns, debate_state):
+    """Transcript text in the judge's format: 'User (For): ...' / 'AI (Against): ...'."""
+    lines = []
+    for entry in turns:
+        if entry['role'] == 'user':
+            label, stance = "User", debate_state['user_stance']
+        else:
+            label, stance = "AI", debate_state['opponent_stance']
+        lines.append(f"{label} ({stance}): {entry['parts'][0]}")
+    return "\n\n".join(lines)
+
+
+def collect(context):
+    """Applies the result of a finished compaction job to the context (in place)."""
+    job_id = context.get('job_id')
+    if not job_id:
+        return context
+    job = jobs.get_job(job_id)
+    if job is not None and job['status'] in (jobs.QUEUED, jobs.RUNNING):
+        return context
+    context['job_id'] = None
+    if job is not None and job['status'] == jobs.DONE:
+        context['summary'] = job['result']['summary']
+        context['summarized_upto'] = job['result']['summarized_upto']
+    elif job is not None:
+        # Nothing is lost: the turns stay verbatim and the next turn tries again.
+        print(f"Compaction job {job_id} {job['status']}: {job['error']}")
+    return context
+
+
+def schedule(context, debate_state, chat_history, api_key, user=None):
+    """Queues a compaction job if enough turns are unsummarized and none is pending."""
+    if context.get('job_id'):
+        return context
+    # Cut before a user turn, so the verbatim part always starts with one.
+    upto = len(chat_history) - KEEP_TURNS
+    upto -= upto % 2
+    if upto - context['summarized_upto'] < COMPACT_BATCH:
+        return context
+    context['job_id'] = jobs.submit('compact_context', {
+        'topic': debate_state['topic'],
+        'user_stance': debate_state['user_stance'],
+        'ai_stance': debate_state['opponent_stance'],
+        'summary': context['summary'],
+        'turns': format_turns(chat_history[context['summarized_upto']:upto], debate_state),
+        'summarized_upto': upto,
+        'username': user,
+        'mode': debate_state.get('mode'),
+    }, secret=api_key)
+    return context
+
+
+def recent_turns(context, chat_history):
+    """The turns that are still sent verbatim."""
+    return chat_history[(context or {}).get('summarized_upto', 0):]
+
+
+def run_compaction(job):
+    """'compact_context' job: folds a batch of turns into the running summary."""
+    payload = job.payload
+    prompt = SUMMARY_PROMPT.format(
+        topic=payload['topic'],
+        user_stance=payload['user_stance'],
+        ai_stance=payload['ai_stance'],
+        summary=payload['summary'] or "(none yet)",
+        turns=payload['turns']
+    )
+    with llm_scheduler.acting_for(payload.get('username'), payload.get('mode')):
+        summary = llm_client.generate_summary(job.secret, prompt)
+    return {'summary': summary.strip(), 'summarized_upto': payload['summarized_upto']}
+
+
+jobs.register_handler('compact_context', run_compaction)
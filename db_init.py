@@ -1,30 +1,8 @@
-import os
 import sys
-import sqlite3
-import psycopg2
-from psycopg2.extras import DictCursor
 
-def get_db_connection():
-    """
-    Establishes a connection to the PostgreSQL database on Render
-    or a local SQLite DB for development (if DATABASE_URL is not set).
-    """
-    DATABASE_URL = os.environ.get('DATABASE_URL')
-
-    if DATABASE_URL:
-        # --- PRODUCTION (Render) ---
-        print("Connecting to PostgreSQL (Render)...")
-        con = psycopg2.connect(DATABASE_URL)
-        con.cursor_factory = DictCursor 
-    else:
-        # --- LOCAL (Development) ---
-        print("WARNING: DATABASE_URL not set. Connecting to local app_data.db...")
-        BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-        DB_FILE = os.path.join(BASE_DIR, 'app_data.db')
-        con = sqlite3.connect(DB_FILE)
-        con.row_factory = sqlite3.Row
-    
-    return con
+# Connections come from the shared data-access layer (db_pool.py /
+# repository.py), the same one callbacks.py uses.
+from repository import db_connection, is_postgres
 
 
 def initialize_database():
@@ -34,18 +12,11 @@ def initialize_database():
     This script is safe to run multiple times.
     """
     
-    try:
-        con = get_db_connection()
-        cur = con.cursor()
-    except Exception as e:
-        print(f"FATAL: Could not connect to the database: {e}", file=sys.stderr)
-        sys.exit(1) 
-
-    print("Connection successful. Creating tables if they do not exist...")
-
-    if isinstance(con, psycopg2.extensions.connection):
+    if is_postgres():
+        print("Connecting to PostgreSQL (Render)...")
         db_type = "postgres"
     else:
+        print("WARNING: DATABASE_URL not set. Connecting to local app_data.db...")
         db_type = "sqlite"
 
     
@@ -53,6 +24,8 @@ def initialize_database():
         users_pk = "id SERIAL PRIMARY KEY"
         stats_pk = "id SERIAL PRIMARY KEY"
         history_pk = "id SERIAL PRIMARY KEY" # <-- NEW
+        turns_pk = "id SERIAL PRIMARY KEY"
+        calls_pk = "id SERIAL PRIMARY KEY"
         float_type = "FLOAT"
         timestamp_type = "TIMESTAMP WITH TIME ZONE" # <-- NEW
         fkey_stats = "FOREIGN KEY (username) REFERENCES users (username) ON DELETE CASCADE"
@@ -61,6 +34,8 @@ def initialize_database():
         users_pk = "id INTEGER PRIMARY KEY AUTOINCREMENT"
         stats_pk = "id INTEGER PRIMARY KEY AUTOINCREMENT"
         history_pk = "id INTEGER PRIMARY KEY AUTOINCREMENT" # <-- NEW
+        turns_pk = "id INTEGER PRIMARY KEY AUTOINCREMENT"
+        calls_pk = "id INTEGER PRIMARY KEY AUTOINCREMENT"
         float_type = "REAL"
         timestamp_type = "DATETIME" # <-- NEW
         fkey_stats = "FOREIGN KEY (username) REFERENCES users (username)"
@@ -104,23 +79,161 @@ def initialize_database():
         chat_history TEXT,
         final_results TEXT,
         timestamp {timestamp_type} DEFAULT CURRENT_TIMESTAMP,
+        stats_applied INTEGER DEFAULT 0,
         {fkey_history}
     );
     """
     # --- *** END NEW TABLE *** ---
 
+    # --- Debate turns ---
+    # One row per turn, written as the debate happens. The UNIQUE index also
+    # serves 'WHERE debate_id = ? ORDER BY turn_index'. debate_history.chat_history
+    # is only kept for rows saved before this table existed
+    # (run backfill_debate_turns.py to migrate them).
+    sql_create_turns_table = f"""
+    CREATE TABLE IF NOT EXISTS debate_turns (
+        {turns_pk},
+        debate_id INTEGER NOT NULL REFERENCES debate_history (id) ON DELETE CASCADE,
+        turn_index INTEGER NOT NULL,
+        role TEXT NOT NULL,
+        player_name TEXT,
+        text TEXT,
+        speaking_time TEXT,
+        UNIQUE (debate_id, turn_index)
+    );
+    """
+
+    # --- Judgment cache ---
+    # Judgments keyed by a hash of everything the judge was shown (see
+    # judgment_cache.py). Rows from older judge prompts are deleted by the app.
+    sql_create_judgment_cache_table = f"""
+    CREATE TABLE IF NOT EXISTS judgment_cache (
+        cache_key TEXT PRIMARY KEY,
+        prompt_version TEXT NOT NULL,
+        judgment TEXT NOT NULL,
+        created_at {timestamp_type} DEFAULT CURRENT_TIMESTAMP
+    );
+    """
+
+    # --- Re-judged results ---
+    # New judgments of finished debates, one per judge version (prompt hash
+    # and judge model), written by rejudge.py. The rows double as its
+    # checkpoint: a re-run skips every debate that already has one.
+    sql_create_rejudged_table = f"""
+    CREATE TABLE IF NOT EXISTS rejudged_results (
+        debate_id INTEGER NOT NULL REFERENCES debate_history (id) ON DELETE CASCADE,
+        judge_version TEXT NOT NULL,
+        final_results TEXT NOT NULL,
+        judged_at {timestamp_type},
+        PRIMARY KEY (debate_id, judge_version)
+    );
+    """
+
+    # --- LLM call log ---
+    # One row per opponent, judge, repair and summary call (see
+    # llm_accounting.py): who and what it was for, tokens, time to first
+    # token, total latency, retries and outcome. called_at is epoch seconds.
+    sql_create_llm_calls_table = f"""
+    CREATE TABLE IF NOT EXISTS llm_calls (
+        {calls_pk},
+        called_at {float_type} NOT NULL,
+        username TEXT,
+        debate_mode TEXT,
+        call_type TEXT NOT NULL,
+        model TEXT,
+        prompt_tokens INTEGER,
+        completion_tokens INTEGER,
+        ttft_ms {float_type},
+        latency_ms {float_type} NOT NULL,
+        retries INTEGER NOT NULL DEFAULT 0,
+        outcome TEXT NOT NULL
+    );
+    """
+
+    sql_create_llm_calls_index = """
+    CREATE INDEX IF NOT EXISTS idx_llm_calls_called_at ON llm_calls (called_at);
+    """
+
+    # Serves the /history listing: WHERE username = ? ORDER BY timestamp DESC,
+    # paginated by (timestamp, id). Same syntax on both databases.
+    sql_create_history_index = """
+    CREATE INDEX IF NOT EXISTS idx_debate_history_user_ts
+    ON debate_history (username, timestamp DESC, id DESC);
+    """
+
+    # --- Full-text search index for the /history search box ---
+    # One document per debate (topic + transcript text), written by
+    # save_debate_to_db. SQLite uses FTS5; Postgres a weighted tsvector
+    # (topic ranks above transcript) kept up to date by a generated column.
+    # Debates saved before the index existed are added by running
+    # backfill_search_index.py once.
+    if db_type == "postgres":
+        search_statements = [
+            ('debate_search', """
+            CREATE TABLE IF NOT EXISTS debate_search (
+                debate_id INTEGER PRIMARY KEY REFERENCES debate_history (id) ON DELETE CASCADE,
+                username TEXT,
+                debate_topic TEXT,
+                transcript TEXT,
+                search_vector tsvector GENERATED ALWAYS AS (
+                    setweight(to_tsvector('english', COALESCE(debate_topic, '')), 'A') ||
+                    setweight(to_tsvector('english', COALESCE(transcript, '')), 'B')
+                ) STORED
+            );
+            """),
+            ('idx_debate_search_vector', """
+            CREATE INDEX IF NOT EXISTS idx_debate_search_vector
+            ON debate_search USING GIN (search_vector);
+            """),
+            ('idx_debate_search_username', """
+            CREATE INDEX IF NOT EXISTS idx_debate_search_username
+            ON debate_search (username);
+            """),
+        ]
+    else: # sqlite
+        search_statements = [
+            ('debate_search', """
+            CREATE VIRTUAL TABLE IF NOT EXISTS debate_search USING fts5(
+                debate_topic,
+                transcript,
+                username UNINDEXED,
+                tokenize = 'porter unicode61'
+            );
+            """),
+        ]
+
+    try:
+        with db_connection() as con:
+            cur = con.cursor()
+            print("Connection successful. Creating tables if they do not exist...")
+            _create_tables(con, cur, db_type, [
+                ('users', sql_create_users_table),
+                ('user_stats', sql_create_stats_table),
+                ('debate_history', sql_create_history_table), # <-- NEW
+                ('debate_turns', sql_create_turns_table),
+                ('idx_debate_history_user_ts', sql_create_history_index),
+                ('judgment_cache', sql_create_judgment_cache_table),
+                ('rejudged_results', sql_create_rejudged_table),
+                ('llm_calls', sql_create_llm_calls_table),
+                ('idx_llm_calls_called_at', sql_create_llm_calls_index),
+            ] + search_statements)
+            # Columns added after the table first shipped; new tables already have them.
+            _add_missing_columns(con, cur, db_type, [
+                ('debate_history', 'stats_applied', 'INTEGER DEFAULT 0'),
+            ])
+    except Exception as e:
+        print(f"FATAL: Could not connect to the database: {e}", file=sys.stderr)
+        sys.exit(1) 
+    print("Database connection released.")
+
+
+def _create_tables(con, cur, db_type, statements):
     try:
         print(f"Using {db_type} syntax.")
         
-        print("Creating/Checking 'users' table...")
-        cur.execute(sql_create_users_table)
-        
-        print("Creating/Checking 'user_stats' table...")
-        cur.execute(sql_create_stats_table)
-        
-        # --- NEW ---
-        print("Creating/Checking 'debate_history' table...")
-        cur.execute(sql_create_history_table)
+        for table_name, sql in statements:
+            print(f"Creating/Checking '{table_name}'...")
+            cur.execute(sql)
         
         con.commit()
         print("\nAll tables created successfully (or already existed).")
@@ -128,9 +241,21 @@ def initialize_database():
     except Exception as e:
         print(f"An error occurred while creating tables: {e}", file=sys.stderr)
         con.rollback()
-    finally:
-        con.close()
-        print("Database connection closed.")
+
+def _add_missing_columns(con, cur, db_type, columns):
+    try:
+        for table_name, column, definition in columns:
+            if db_type == "postgres":
+                cur.execute(f"ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS {column} {definition}")
+                continue
+            cur.execute(f"PRAGMA table_info({table_name})")
+            if column not in {row[1] for row in cur.fetchall()}:
+                print(f"Adding '{table_name}.{column}'...")
+                cur.execute(f"ALTER TABLE {table_name} ADD COLUMN {column} {definition}")
+        con.commit()
+    except Exception as e:
+        print(f"An error occurred while adding columns: {e}", file=sys.stderr)
+        con.rollback()
 
 # This makes the script executable by running 'python db_init.py'
 if __name__ == "__main__":
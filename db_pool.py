@@ -0,0 +1,303 @@
+import os
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.extensions
+from psycopg2.extras import DictCursor
+
+# --- Connection Pooling ---
+# Every callback used to open (and close) its own connection, so each page view
+# paid a full TCP + TLS + auth handshake to Postgres. This module keeps a
+# process-wide, bounded pool for Postgres and one reusable connection per
+# thread for the local SQLite fallback. Everything goes through db_connection().
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Pool sizing. Size this against gunicorn: (workers x threads) should not
+# exceed what the Postgres plan allows, and each worker gets its own pool.
+POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '10'))
+POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '10'))            # seconds to wait for a free connection
+POOL_PING_AFTER_IDLE = float(os.environ.get('DB_POOL_PING_AFTER', '30'))  # health-check connections idle longer than this
+
+
+class PoolTimeoutError(Exception):
+    """Raised when no pooled connection became free within POOL_TIMEOUT."""
+
+
+def get_database_url():
+    """Read DATABASE_URL lazily so load_dotenv() in run.py has already run."""
+    return os.environ.get('DATABASE_URL')
+
+
+def get_sqlite_path():
+    return os.environ.get('SQLITE_DB_PATH') or os.path.join(BASE_DIR, 'app_data.db')
+
+
+def is_postgres():
+    return bool(get_database_url())
+
+
+class PooledConnection(psycopg2.extensions.connection):
+    """psycopg2 connection that remembers which server-side statements it has PREPAREd."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared_statements = set()
+
+
+class PostgresPool:
+    """
+    A small blocking connection pool.
+    psycopg2's own pools raise immediately when exhausted; this one waits
+    (up to POOL_TIMEOUT) so a burst of requests queues instead of failing.
+    Broken connections are discarded and replaced on the next checkout.
+    """
+
+    def __init__(self, dsn, max_size, timeout, ping_after_idle):
+        self.dsn = dsn
+        self.max_size = max_size
+        self.timeout = timeout
+        self.ping_after_idle = ping_after_idle
+
+        self._cond = threading.Condition()
+        self._idle = []   # stack of (connection, last_used_monotonic)
+        self._size = 0    # connections currently open (idle + in use)
+
+        # --- Counters (read via stats()) ---
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self.checkout_latency_total = 0.0
+        self.checkout_latency_max = 0.0
+        self.timeouts = 0
+        self.connects = 0
+        self.recycled = 0
+        self.failed_pings = 0
+
+    def _connect(self):
+        con = psycopg2.connect(self.dsn, connection_factory=PooledConnection)
+        con.cursor_factory = DictCursor  # Allows accessing columns by name
+        with self._cond:
+            self.connects += 1
+        return con
+
+    def _is_healthy(self, con, last_used):
+        if con.closed:
+            return False
+        if time.monotonic() - last_used < self.ping_after_idle:
+            return True
+        try:
+            cur = con.cursor()
+            cur.execute("SELECT 1")
+            cur.fetchone()
+            con.rollback()
+            return True
+        except Exception:
+            with self._cond:
+                self.failed_pings += 1
+            return False
+
+    def _close_quietly(self, con):
+        try:
+            con.close()
+        except Exception:
+            pass
+
+    def getconn(self):
+        started = time.perf_counter()
+        deadline = time.monotonic() + self.timeout
+        waited = False
+        con = None
+        last_used = None
+
+        with self._cond:
+            while True:
+                if self._idle:
+                    con, last_used = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1  # reserve a slot; connect outside the lock
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise PoolTimeoutError(
+                        f"No database connection available within {self.timeout}s "
+                        f"(pool size {self.max_size})."
+                    )
+                waited = True
+                self._cond.wait(remaining)
+        wait_time = time.perf_counter() - started
+
+        try:
+            if con is not None and not self._is_healthy(con, last_used):
+                self._close_quietly(con)
+                with self._cond:
+                    self.recycled += 1
+                con = None
+            if con is None:
+                con = self._connect()
+        except Exception:
+            # Give the reserved slot back so waiters are not starved.
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+        latency = time.perf_counter() - started
+        with self._cond:
+            self.checkouts += 1
+            if waited:
+                self.waits += 1
+                self.wait_time_total += wait_time
+                self.wait_time_max = max(self.wait_time_max, wait_time)
+            self.checkout_latency_total += latency
+            self.checkout_latency_max = max(self.checkout_latency_max, latency)
+        return con
+
+    def putconn(self, con, discard=False):
+        if not discard and not con.closed:
+            try:
+                status = con.info.transaction_status
+                if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                    discard = True
+                elif status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    con.rollback()  # never hand out a connection mid-transaction
+            except Exception:
+                discard = True
+
+        if discard or con.closed:
+            self._close_quietly(con)
+            with self._cond:
+                self._size -= 1
+                self.recycled += 1
+                self._cond.notify()
+        else:
+            with self._cond:
+                self._idle.append((con, time.monotonic()))
+                self._cond.notify()
+
+    def closeall(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+        for con, _ in idle:
+            self._close_quietly(con)
+
+    def stats(self):
+        with self._cond:
+            idle = len(self._idle)
+            return {
+                'backend': 'postgres',
+                'max_size': self.max_size,
+                'size': self._size,
+                'in_use': self._size - idle,
+                'idle': idle,
+                'checkouts': self.checkouts,
+                'waits': self.waits,
+                'timeouts': self.timeouts,
+                'wait_time_avg_ms': round(1000 * self.wait_time_total / self.waits, 2) if self.waits else 0.0,
+                'wait_time_max_ms': round(1000 * self.wait_time_max, 2),
+                'checkout_latency_avg_ms': round(1000 * self.checkout_latency_total / self.checkouts, 2) if self.checkouts else 0.0,
+                'checkout_latency_max_ms': round(1000 * self.checkout_latency_max, 2),
+                'connects': self.connects,
+                'recycled': self.recycled,
+                'failed_pings': self.failed_pings,
+            }
+
+
+# --- Process-wide state ---
+_pg_pool = None
+_pg_pool_pid = None
+_pg_pool_lock = threading.Lock()
+
+_sqlite_local = threading.local()
+_sqlite_counters = {'checkouts': 0, 'connects': 0, 'recycled': 0}
+_sqlite_counters_lock = threading.Lock()
+
+
+def _get_pg_pool():
+    global _pg_pool, _pg_pool_pid
+    # A pool must never be shared across a fork (e.g. 'gunicorn --preload').
+    if _pg_pool is None or _pg_pool_pid != os.getpid():
+        with _pg_pool_lock:
+            if _pg_pool is None or _pg_pool_pid != os.getpid():
+                _pg_pool = PostgresPool(get_database_url(), POOL_MAX_SIZE, POOL_TIMEOUT, POOL_PING_AFTER_IDLE)
+                _pg_pool_pid = os.getpid()
+    return _pg_pool
+
+
+def _get_sqlite_connection():
+    con = getattr(_sqlite_local, 'con', None)
+    if con is None:
+        con = sqlite3.connect(get_sqlite_path(), timeout=30)
+        con.row_factory = sqlite3.Row
+        _sqlite_local.con = con
+        with _sqlite_counters_lock:
+            _sqlite_counters['connects'] += 1
+    with _sqlite_counters_lock:
+        _sqlite_counters['checkouts'] += 1
+    return con
+
+
+def _drop_sqlite_connection():
+    con = getattr(_sqlite_local, 'con', None)
+    _sqlite_local.con = None
+    if con is not None:
+        try:
+            con.close()
+        except Exception:
+            pass
+        with _sqlite_counters_lock:
+            _sqlite_counters['recycled'] += 1
+
+
+@contextmanager
+def db_connection():
+    """
+    Borrow a database connection for the duration of a 'with' block.
+    PostgreSQL (Render) connections come from the process-wide pool;
+    the local SQLite fallback reuses one connection per thread.
+    Callers still commit/rollback themselves; anything left uncommitted
+    is rolled back when the block exits.
+    """
+    if is_postgres():
+        pool = _get_pg_pool()
+        con = pool.getconn()
+        discard = False
+        try:
+            yield con
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            discard = True  # recycle-on-error: the connection may be dead
+            raise
+        finally:
+            pool.putconn(con, discard=discard)
+    else:
+        con = _get_sqlite_connection()
+        try:
+            yield con
+        except sqlite3.DatabaseError:
+            _drop_sqlite_connection()
+            raise
+        finally:
+            if getattr(_sqlite_local, 'con', None) is con and con.in_transaction:
+                con.rollback()
+
+
+def pool_stats():
+    """Counters used to size the pool against gunicorn worker/thread counts."""
+    if is_postgres():
+        return _get_pg_pool().stats()
+    with _sqlite_counters_lock:
+        return dict(_sqlite_counters, backend='sqlite')
+
+
+def close_all():
+    """Close pooled connections (e.g. on worker shutdown)."""
+    if _pg_pool is not None and _pg_pool_pid == os.getpid():
+        _pg_pool.closeall()
+    _drop_sqlite_connection()
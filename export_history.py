@@ -0,0 +1,242 @@
+import os
+import sys
+import gzip
+import json
+import time
+import argparse
+from datetime import datetime, timedelta
+
+import pytz
+from dotenv import load_dotenv
+
+# --- Archival export of debate_history ---
+# Streams finished debates (with their turns) out of the database into
+# partitioned files for offline analysis and cold storage:
+#
+#   <out>/mode=<debate_mode>/month=<YYYY-MM>/part-<first id>-<last id>.parquet
+#   <out>/mode=<debate_mode>/month=<YYYY-MM>/part-<first id>-<last id>.jsonl.gz
+#
+# Memory stays constant: rows come from a server-side cursor and are written
+# out per partition in small row groups. Each run continues from the id
+# stored in <out>/_watermark.json, so repeated runs are incremental.
+# Debates newer than --min-age-days are left alone (they may still be in
+# progress). With --delete, every debate up to the watermark, plus the range
+# this run exported, is removed from the database once the files are safely
+# on disk. A --since-id run past the watermark leaves the watermark alone, so
+# the debates it skipped are never deleted.
+#
+#   python export_history.py --out archive/ --format parquet
+#   python export_history.py --out archive/ --format jsonl --delete
+#
+# Parquet needs pyarrow (pip install pyarrow); gzipped JSONL has no extra
+# dependencies.
+
+load_dotenv()  # DATABASE_URL, same as run.py
+
+from repository import export_upper_bound, stream_debates, delete_debates_upto
+
+WATERMARK_FILE = '_watermark.json'
+ROW_GROUP_SIZE = 1000
+
+
+def read_watermark(out_dir):
+    path = os.path.join(out_dir, WATERMARK_FILE)
+    if not os.path.exists(path):
+        return 0
+    with open(path, encoding='utf-8') as f:
+        return int(json.load(f)['last_id'])
+
+
+def write_watermark(out_dir, last_id):
+    """Atomically records the last exported id."""
+    path = os.path.join(out_dir, WATERMARK_FILE)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'last_id': last_id, 'exported_at': datetime.now(pytz.utc).isoformat()}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def to_utc_datetime(value):
+    """SQLite hands back text, Postgres a datetime; naive values are UTC."""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = pytz.utc.localize(value)
+    return value.astimezone(pytz.utc)
+
+
+def partition_of(record):
+    timestamp = record['timestamp']
+    month = timestamp.strftime('%Y-%m') if timestamp else 'unknown'
+    return (f"mode={record['debate_mode'] or 'unknown'}", f"month={month}")
+
+
+def _fsync_path(path):
+    with open(path, 'rb') as f:
+        os.fsync(f.fileno())
+
+
+class JsonlPartitionWriter:
+    """One gzipped JSON Lines file per partition; JSON columns are written as objects."""
+
+    extension = 'jsonl.gz'
+
+    def __init__(self, out_dir, file_name):
+        self.out_dir = out_dir
+        self.file_name = file_name
+        self._files = {}
+
+    def write(self, partition, record):
+        if partition not in self._files:
+            directory = os.path.join(self.out_dir, *partition)
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f"{self.file_name}.{self.extension}")
+            self._files[partition] = (path, gzip.open(path, 'wt', encoding='utf-8'))
+        record = dict(record,
+                      timestamp=record['timestamp'].isoformat() if record['timestamp'] else None,
+                      debate_state=_loads(record['debate_state']),
+                      final_results=_loads(record['final_results']))
+        self._files[partition][1].write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def close(self):
+        for path, f in self._files.values():
+            f.close()
+            _fsync_path(path)
+        return [path for path, _ in self._files.values()]
+
+
+class ParquetPartitionWriter:
+    """One Parquet file per partition, written ROW_GROUP_SIZE rows at a time."""
+
+    extension = 'parquet'
+
+    def __init__(self, out_dir, file_name):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            sys.exit("Parquet export needs pyarrow: pip install pyarrow (or use --format jsonl).")
+        self.pa, self.pq = pa, pq
+        self.out_dir = out_dir
+        self.file_name = file_name
+        self.schema = pa.schema([
+            ('id', pa.int64()),
+            ('username', pa.string()),
+            ('debate_mode', pa.string()),
+            ('debate_topic', pa.string()),
+            ('timestamp', pa.timestamp('us', tz='UTC')),
+            ('debate_state', pa.string()),    # JSON text, as stored
+            ('final_results', pa.string()),   # JSON text, as stored
+            ('turns', pa.list_(pa.struct([
+                ('turn_index', pa.int32()),
+                ('role', pa.string()),
+                ('player_name', pa.string()),
+                ('text', pa.string()),
+                ('speaking_time', pa.string()),
+            ]))),
+        ])
+        self._writers = {}   # partition -> (path, ParquetWriter)
+        self._buffers = {}   # partition -> [records]
+
+    def write(self, partition, record):
+        buffer = self._buffers.setdefault(partition, [])
+        buffer.append(record)
+        if len(buffer) >= ROW_GROUP_SIZE:
+            self._flush(partition)
+
+    def _flush(self, partition):
+        buffer = self._buffers.get(partition)
+        if not buffer:
+            return
+        if partition not in self._writers:
+            directory = os.path.join(self.out_dir, *partition)
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f"{self.file_name}.{self.extension}")
+            self._writers[partition] = (path, self.pq.ParquetWriter(path, self.schema, compression='zstd'))
+        table = self.pa.Table.from_pylist(buffer, schema=self.schema)
+        self._writers[partition][1].write_table(table)
+        self._buffers[partition] = []
+
+    def close(self):
+        for partition in list(self._buffers):
+            self._flush(partition)
+        for path, writer in self._writers.values():
+            writer.close()
+            _fsync_path(path)
+        return [path for path, _ in self._writers.values()]
+
+
+def _loads(value):
+    try:
+        return json.loads(value) if value else None
+    except (TypeError, ValueError):
+        return value
+
+
+def export(out_dir, file_format, min_age_days, since_id=None, delete=False, fetch_size=500):
+    os.makedirs(out_dir, exist_ok=True)
+    watermark = read_watermark(out_dir)
+    after_id = watermark if since_id is None else since_id
+    cutoff = datetime.now(pytz.utc) - timedelta(days=min_age_days)
+    upto_id = export_upper_bound(after_id, cutoff)
+
+    exported = 0
+    if upto_id > after_id:
+        print(f"Exporting debates {after_id + 1}..{upto_id} as {file_format} into {out_dir} ...")
+        writer_class = ParquetPartitionWriter if file_format == 'parquet' else JsonlPartitionWriter
+        writer = writer_class(out_dir, f"part-{after_id + 1}-{upto_id}")
+        started = time.perf_counter()
+        for record in stream_debates(after_id, upto_id, fetch_size=fetch_size):
+            record['timestamp'] = to_utc_datetime(record['timestamp'])
+            writer.write(partition_of(record), record)
+            exported += 1
+            if exported % 10000 == 0:
+                print(f"  {exported} debates ({exported / (time.perf_counter() - started):,.0f} rows/sec)")
+        files = writer.close()
+        elapsed = time.perf_counter() - started
+        print(f"Exported {exported} debates into {len(files)} files in {elapsed:.2f}s "
+              f"({exported / elapsed if elapsed else 0:,.0f} rows/sec).")
+        # Only move the watermark once every file is closed and synced, and
+        # only if everything below it is now archived.
+        if after_id <= watermark < upto_id:
+            watermark = upto_id
+            write_watermark(out_dir, watermark)
+    else:
+        print(f"Nothing new to export after id {after_id}.")
+
+    if delete:
+        deleted = 0
+        for deleted in delete_debates_upto(watermark):
+            print(f"  deleted {deleted} archived debates...")
+        print(f"Deleted {deleted} archived debates (id <= {watermark}) from the database.")
+        if upto_id > max(after_id, watermark):
+            # A --since-id run past the watermark: only what it exported.
+            range_start = max(after_id, watermark)
+            deleted = 0
+            for deleted in delete_debates_upto(upto_id, after_id=range_start):
+                print(f"  deleted {deleted} exported debates...")
+            print(f"Deleted {deleted} exported debates ({range_start} < id <= {upto_id}) from the database.")
+    return exported
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stream debate_history into partitioned Parquet or gzipped JSONL.")
+    parser.add_argument('--out', required=True, help="output directory (also holds the watermark)")
+    parser.add_argument('--format', choices=['parquet', 'jsonl'], default='parquet')
+    parser.add_argument('--since-id', type=int, help="export debates after this id instead of the stored watermark")
+    parser.add_argument('--min-age-days', type=float, default=1.0,
+                        help="skip debates newer than this (they may still be in progress)")
+    parser.add_argument('--delete', action='store_true',
+                        help="delete archived debates (id <= watermark, plus this run's range) from the database afterwards")
+    parser.add_argument('--fetch-size', type=int, default=500, help="rows per server-side cursor fetch")
+    args = parser.parse_args()
+
+    try:
+        export(args.out, args.format, args.min_age_days, args.since_id, args.delete, args.fetch_size)
+    except Exception as e:
+        print(f"An error occurred during export: {e}", file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,14 @@
+# gunicorn reads this file automatically from the working directory,
+# so the Render start command stays 'gunicorn run:server'.
+
+# Leave the write-behind queue (persistence.py) time to drain.
+graceful_timeout = 30
+
+
+def worker_exit(server, worker):
+    # Runs inside the worker after it stops serving requests:
+    # write (or journal) queued debate saves, then close pooled connections.
+    from persistence import shutdown_queue
+    from db_pool import close_all
+    shutdown_queue()
+    close_all()
@@ -11,6 +11,17 @@ history_layout = html.Div(className='layout-wrapper', children=[
             html.H2("Your Debate History"),
             html.P("Select a debate from your history to review the results and transcript."),
             
+            # Full-text search over topics and transcripts.
+            # Results (with highlighted snippets) are filled in by a callback.
+            dcc.Input(
+                id='history-search-input',
+                type='search',
+                placeholder='Search your debates (topic or anything that was said)...',
+                debounce=True,
+                className='input-field'
+            ),
+            html.Div(id='history-search-results'),
+            
             # This dropdown will be filled by a callback
             dcc.Dropdown(
                 id='history-dropdown',
@@ -18,6 +29,17 @@ history_layout = html.Div(className='layout-wrapper', children=[
                 clearable=False
             ),
             
+            # History is loaded one page at a time. This store holds the
+            # keyset cursor for the next page; the button appends it.
+            dcc.Store(id='history-cursor-store'),
+            html.Button(
+                'Load older debates',
+                id='history-load-more-button',
+                n_clicks=0,
+                className='btn btn-secondary',
+                style={'display': 'none'}
+            ),
+            
             html.Hr(),
             
             # This container's content is generated by a callback
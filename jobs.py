@@ -0,0 +1,561 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+
+from flask import jsonify, request, abort
+from cryptography.fernet import Fernet, InvalidToken
+
+from app import server
+from db_pool import BASE_DIR
+
+# --- Background jobs ---
+# Long-running LLM work (opponent replies, judgments) runs here instead of
+# inside a Dash callback or a streaming response, so a slow Gemini round
+# trip never pins a gunicorn request thread. A callback submits a job and
+# returns at once; the browser polls GET /jobs/<id> (or a dcc.Interval
+# callback calls get_job()) until it is done.
+#
+# The queue is a table in its own local SQLite file, shared by every gunicorn
+# worker on the machine, so no broker is needed: any worker can run a job and
+# any worker can answer a poll for it. Queued jobs survive a restart, and
+# jobs left 'running' by a dead process are queued again.
+# Each process runs JOB_WORKERS threads that claim queued jobs.
+#
+# A handler is fn(job) -> result. job.payload is the JSON payload given to
+# submit(); job.secret holds a value (an API key) that is never written to
+# jobs.db in the clear (see "Secrets" below); job.append_progress(text)
+# publishes partial output and returns True once cancellation was requested.
+#
+# A job submitted with max_attempts > 1 is retried when its handler raises:
+# it goes back in the queue after JOB_RETRY_DELAY * 2**(attempt - 1)
+# seconds, and only fails once the last attempt raises. job.attempt and
+# job.last_attempt tell the handler where it is.
+#
+# A job submitted with a dedup_key is only queued once per key: submitting
+# the same key again (a double-clicked Send, a retried callback POST)
+# returns the id of the job already queued, running or finished, so the
+# duplicate waits on -- and gets the result of -- the first one. The key
+# lives as long as the job row (JOB_RETENTION after it finishes).
+#
+# Secrets: by default a job's secret is kept in memory by the process that
+# submitted it, and only that process claims the job (secret_pid); if it
+# exits first, the job fails and the user sends again. With JOB_SECRET_KEY
+# set (a Fernet key, the same for every worker) the secret is stored
+# encrypted instead, so any worker can run the job, also after a restart.
+# Either way it is dropped when the job finishes, fails, is cancelled or
+# purged.
+
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '4'))
+JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', '0.5'))     # seconds between queue checks when idle
+JOB_RETENTION = float(os.environ.get('JOB_RETENTION_SECONDS', '3600'))   # finished jobs are deleted after this
+JOB_RETRY_DELAY = float(os.environ.get('JOB_RETRY_DELAY', '2'))           # seconds before the first retry
+JOBS_DB_PATH = os.environ.get('JOBS_DB_PATH') or os.path.join(BASE_DIR, 'jobs.db')
+JOB_SECRET_KEY = os.environ.get('JOB_SECRET_KEY')  # Fernet.generate_key(); unset = secrets stay in memory
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = 'queued', 'running', 'done', 'failed', 'cancelled'
+FINISHED_STATUSES = (DONE, FAILED, CANCELLED)
+
+ENCRYPTED_PREFIX = 'enc:'  # secret column values written with JOB_SECRET_KEY
+SECRET_LOST_ERROR = "The server restarted before this job could run; please try again."
+
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload TEXT,
+    secret TEXT,
+    secret_pid INTEGER,
+    status TEXT NOT NULL,
+    progress TEXT NOT NULL DEFAULT '',
+    result TEXT,
+    error TEXT,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    owner_pid INTEGER,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 1,
+    enqueued_at REAL NOT NULL,
+    run_after REAL NOT NULL DEFAULT 0,
+    started_at REAL,
+    finished_at REAL,
+    dedup_key TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, enqueued_at);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_dedup_key ON jobs (dedup_key);
+"""
+
+_handlers = {}
+
+
+def register_handler(kind, fn):
+    _handlers[kind] = fn
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+class SecretBox:
+    """Job secrets: encrypted with JOB_SECRET_KEY, or held in this process's memory."""
+
+    def __init__(self, key):
+        self._fernet = Fernet(key) if key else None
+        self._memory = {}  # job id -> secret
+        self._lock = threading.Lock()
+
+    def seal(self, job_id, secret):
+        """Returns (secret column value, secret_pid) to store with the job."""
+        if secret is None:
+            return None, None
+        if self._fernet is not None:
+            return ENCRYPTED_PREFIX + self._fernet.encrypt(secret.encode('utf-8')).decode('ascii'), None
+        with self._lock:
+            self._memory[job_id] = secret
+        return None, os.getpid()
+
+    def open(self, job_id, stored):
+        if stored is None:
+            with self._lock:
+                return self._memory.get(job_id)
+        if self._fernet is None or not stored.startswith(ENCRYPTED_PREFIX):
+            return None
+        try:
+            return self._fernet.decrypt(stored[len(ENCRYPTED_PREFIX):].encode('ascii')).decode('utf-8')
+        except InvalidToken:
+            print("Jobs: could not decrypt a job secret (was JOB_SECRET_KEY changed?).")
+            return None
+
+    def drop(self, job_id):
+        with self._lock:
+            self._memory.pop(job_id, None)
+
+    def held(self):
+        with self._lock:
+            return list(self._memory)
+
+
+class Job:
+    """What a handler sees: the payload, the secret and a progress channel."""
+
+    def __init__(self, store, row, secret=None):
+        self._store = store
+        self.id = row['id']
+        self.kind = row['kind']
+        self.payload = json.loads(row['payload']) if row['payload'] else {}
+        self.secret = secret
+        self.attempt = row['attempts']
+        self.last_attempt = row['attempts'] >= row['max_attempts']
+
+    def append_progress(self, text):
+        """Publishes partial output. Returns True if the job was cancelled."""
+        return self._store.append_progress(self.id, text)
+
+    def cancelled(self):
+        return self._store.cancel_requested(self.id)
+
+
+class JobStore:
+    """The jobs table (one SQLite connection per thread, autocommit + WAL)."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        con = self._con()
+        con.execute("PRAGMA journal_mode=WAL")
+        con.executescript(SCHEMA_SQL)
+
+    def _con(self):
+        con = getattr(self._local, 'con', None)
+        if con is None:
+            con = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            con.row_factory = sqlite3.Row
+            self._local.con = con
+        return con
+
+    def insert(self, job_id, kind, payload, secret, max_attempts=1, dedup_key=None, secret_pid=None):
+        """
+        Queues the job, unless one with the same dedup_key exists. Returns the
+        id of the job stored. 'secret' is the sealed value (see SecretBox).
+        """
+        con = self._con()
+        row = con.execute(
+            """INSERT INTO jobs (id, kind, payload, secret, secret_pid, status, max_attempts,
+                                 enqueued_at, dedup_key)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+               ON CONFLICT (dedup_key) DO NOTHING
+               RETURNING id""",
+            (job_id, kind, json.dumps(payload), secret, secret_pid, QUEUED, max_attempts, time.time(), dedup_key)
+        ).fetchone()
+        if row is not None:
+            return row['id']
+        return con.execute("SELECT id FROM jobs WHERE dedup_key = ?", (dedup_key,)).fetchone()['id']
+
+    def claim(self, pid):
+        """
+        Atomically moves the oldest runnable queued job to 'running'. Returns
+        its row or None. Jobs whose secret another process holds are skipped.
+        """
+        now = time.time()
+        return self._con().execute(
+            """UPDATE jobs SET status = ?, started_at = ?, owner_pid = ?, attempts = attempts + 1
+               WHERE id = (SELECT id FROM jobs WHERE status = ? AND run_after <= ?
+                             AND (secret_pid IS NULL OR secret_pid = ?)
+                           ORDER BY enqueued_at LIMIT 1)
+                 AND status = ?
+               RETURNING *""",
+            (RUNNING, now, pid, QUEUED, now, pid, QUEUED)
+        ).fetchone()
+
+    def retry(self, job_id, error, delay):
+        """
+        Puts a failed attempt back in the queue (unless it was cancelled
+        meanwhile). Returns the job's new status.
+        """
+        row = self._con().execute(
+            """UPDATE jobs SET status = CASE WHEN cancel_requested THEN ? ELSE ? END,
+                   error = ?, run_after = ?, owner_pid = NULL, progress = '',
+                   finished_at = CASE WHEN cancel_requested THEN ? ELSE NULL END,
+                   secret = CASE WHEN cancel_requested THEN NULL ELSE secret END
+               WHERE id = ? AND status = ?
+               RETURNING status""",
+            (CANCELLED, QUEUED, error, time.time() + delay, time.time(), job_id, RUNNING)
+        ).fetchone()
+        return row['status'] if row else None
+
+    def finish(self, job_id, status, result=None, error=None):
+        self._con().execute(
+            """UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, secret = NULL
+               WHERE id = ? AND status = ?""",
+            (status, json.dumps(result) if result is not None else None, error, time.time(), job_id, RUNNING)
+        )
+
+    def append_progress(self, job_id, text):
+        row = self._con().execute(
+            "UPDATE jobs SET progress = progress || ? WHERE id = ? RETURNING cancel_requested",
+            (text, job_id)
+        ).fetchone()
+        return bool(row and row['cancel_requested'])
+
+    def cancel_requested(self, job_id):
+        row = self._con().execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row['cancel_requested'])
+
+    def cancel(self, job_id):
+        """Queued jobs are cancelled outright; running ones are asked to stop."""
+        self._con().execute(
+            """UPDATE jobs SET cancel_requested = 1,
+                   status = CASE WHEN status = ? THEN ? ELSE status END,
+                   finished_at = CASE WHEN status = ? THEN ? ELSE finished_at END,
+                   secret = CASE WHEN status = ? THEN NULL ELSE secret END
+               WHERE id = ?""",
+            (QUEUED, CANCELLED, QUEUED, time.time(), QUEUED, job_id)
+        )
+
+    def unfinished(self, job_ids):
+        """The ids among job_ids that are still queued or running."""
+        if not job_ids:
+            return set()
+        rows = self._con().execute(
+            f"""SELECT id FROM jobs WHERE status IN (?, ?) AND id IN ({', '.join('?' * len(job_ids))})""",
+            (QUEUED, RUNNING, *job_ids)
+        ).fetchall()
+        return {row['id'] for row in rows}
+
+    def fail_lost_secrets(self):
+        """Unfinished jobs whose in-memory secret died with its process can never run: fail them."""
+        rows = self._con().execute(
+            "SELECT DISTINCT secret_pid FROM jobs WHERE secret_pid IS NOT NULL AND status IN (?, ?)",
+            (QUEUED, RUNNING)
+        ).fetchall()
+        failed = 0
+        for row in rows:
+            pid = row['secret_pid']
+            if not _pid_alive(pid):
+                failed += self._con().execute(
+                    """UPDATE jobs SET status = ?, error = ?, finished_at = ?, owner_pid = NULL
+                       WHERE secret_pid = ? AND status IN (?, ?)""",
+                    (FAILED, SECRET_LOST_ERROR, time.time(), pid, QUEUED, RUNNING)
+                ).rowcount
+        return failed
+
+    def get(self, job_id):
+        return self._con().execute(
+            """SELECT id, kind, status, progress, result, error, attempts, max_attempts,
+                      enqueued_at, run_after, started_at, finished_at
+               FROM jobs WHERE id = ?""", (job_id,)
+        ).fetchone()
+
+    def requeue_orphans(self):
+        """Jobs left 'running' by a process that no longer exists go back in the queue."""
+        rows = self._con().execute(
+            "SELECT DISTINCT owner_pid FROM jobs WHERE status = ?", (RUNNING,)
+        ).fetchall()
+        requeued = 0
+        for row in rows:
+            pid = row['owner_pid']
+            if pid is None or not _pid_alive(pid):
+                requeued += self._con().execute(
+                    """UPDATE jobs SET status = ?, owner_pid = NULL, started_at = NULL, progress = ''
+                       WHERE status = ? AND owner_pid IS ?""",
+                    (QUEUED, RUNNING, pid)
+                ).rowcount
+        return requeued
+
+    def purge_finished(self, older_than):
+        con = self._con()
+        con.execute(
+            f"UPDATE jobs SET secret = NULL WHERE secret IS NOT NULL AND status IN ({', '.join('?' * len(FINISHED_STATUSES))})",
+            FINISHED_STATUSES
+        )
+        con.execute(
+            f"DELETE FROM jobs WHERE status IN ({', '.join('?' * len(FINISHED_STATUSES))}) AND finished_at < ?",
+            (*FINISHED_STATUSES, time.time() - older_than)
+        )
+
+    def counts(self):
+        rows = self._con().execute(
+            "SELECT status, COUNT(*) AS n, MIN(enqueued_at) AS oldest FROM jobs WHERE status IN (?, ?) GROUP BY status",
+            (QUEUED, RUNNING)
+        ).fetchall()
+        counts = {QUEUED: 0, RUNNING: 0, 'oldest_queued_age_s': 0.0}
+        for row in rows:
+            counts[row['status']] = row['n']
+            if row['status'] == QUEUED and row['oldest']:
+                counts['oldest_queued_age_s'] = round(time.time() - row['oldest'], 2)
+        return counts
+
+
+class JobExecutor:
+    """JOB_WORKERS threads per process, each claiming and running one job at a time."""
+
+    def __init__(self, store, workers):
+        self.store = store
+        self.workers = workers
+        self._wakeup = threading.Event()
+        self._threads = []
+        self._last_purge = 0.0
+        self.secrets = SecretBox(JOB_SECRET_KEY)
+
+        # --- Counters per job kind (read via stats()) ---
+        self._stats_lock = threading.Lock()
+        self._stats = {}
+        self._coalesced = {}  # kind -> duplicate submissions answered with an existing job
+
+    def start(self):
+        requeued = self.store.requeue_orphans()
+        if requeued:
+            print(f"Jobs: re-queued {requeued} jobs left running by a stopped process.")
+        self._fail_lost_secrets()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'job-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def wake(self):
+        self._wakeup.set()
+
+    def _run(self):
+        pid = os.getpid()
+        while True:
+            try:
+                row = self.store.claim(pid)
+            except sqlite3.Error as e:
+                print(f"Jobs: could not claim a job: {e}")
+                row = None
+            if row is None:
+                self._maybe_purge()
+                self._wakeup.wait(JOB_POLL_INTERVAL)
+                self._wakeup.clear()
+                continue
+            self._execute(row)
+
+    def _execute(self, row):
+        job = Job(self.store, row, self.secrets.open(row['id'], row['secret']))
+        # A retry waits from the moment it became runnable again.
+        wait_time = row['started_at'] - max(row['enqueued_at'], row['run_after'])
+        started = time.perf_counter()
+        handler = _handlers.get(job.kind)
+        try:
+            if handler is None:
+                raise LookupError(f"No handler registered for job kind '{job.kind}'")
+            result = handler(job)
+            status = CANCELLED if job.cancelled() else DONE
+            self.store.finish(job.id, status, result=result)
+        except Exception as e:
+            if job.last_attempt:
+                print(f"Jobs: {job.kind} job {job.id} failed: {e}")
+                status = FAILED
+                self.store.finish(job.id, FAILED, error=str(e))
+            else:
+                delay = JOB_RETRY_DELAY * 2 ** (job.attempt - 1)
+                print(f"Jobs: {job.kind} job {job.id} failed (attempt {job.attempt}), "
+                      f"retrying in {delay:.1f}s: {e}")
+                status = 'retried'
+                if self.store.retry(job.id, str(e), delay) != QUEUED:
+                    self.secrets.drop(job.id)  # cancelled meanwhile
+        if status != 'retried':
+            self.secrets.drop(job.id)
+        self._record(job.kind, status, wait_time, time.perf_counter() - started)
+
+    def _maybe_purge(self):
+        if time.monotonic() - self._last_purge < 300:
+            return
+        self._last_purge = time.monotonic()
+        try:
+            self.store.purge_finished(JOB_RETENTION)
+            self._fail_lost_secrets()
+            self.drop_finished_secrets()
+        except sqlite3.Error as e:
+            print(f"Jobs: could not purge finished jobs: {e}")
+
+    def _fail_lost_secrets(self):
+        failed = self.store.fail_lost_secrets()
+        if failed:
+            print(f"Jobs: failed {failed} jobs whose secret was held by a stopped process.")
+
+    def drop_finished_secrets(self):
+        """Forgets in-memory secrets of jobs that ended elsewhere (e.g. cancelled while queued)."""
+        held = self.secrets.held()
+        unfinished = self.store.unfinished(held)
+        for job_id in held:
+            if job_id not in unfinished:
+                self.secrets.drop(job_id)
+
+    def record_coalesced(self, kind):
+        with self._stats_lock:
+            self._coalesced[kind] = self._coalesced.get(kind, 0) + 1
+
+    def _record(self, kind, status, wait_time, run_time):
+        with self._stats_lock:
+            entry = self._stats.setdefault(kind, {
+                'runs': 0, 'done': 0, 'failed': 0, 'cancelled': 0, 'retried': 0,
+                'wait_total': 0.0, 'wait_max': 0.0, 'run_total': 0.0, 'run_max': 0.0,
+            })
+            entry['runs'] += 1
+            entry[status] += 1
+            entry['wait_total'] += wait_time
+            entry['wait_max'] = max(entry['wait_max'], wait_time)
+            entry['run_total'] += run_time
+            entry['run_max'] = max(entry['run_max'], run_time)
+
+    def stats(self):
+        with self._stats_lock:
+            kinds = {
+                kind: {
+                    'runs': e['runs'], 'done': e['done'], 'failed': e['failed'],
+                    'cancelled': e['cancelled'], 'retried': e['retried'],
+                    'wait_avg_ms': round(1000 * e['wait_total'] / e['runs'], 1),
+                    'wait_max_ms': round(1000 * e['wait_max'], 1),
+                    'run_avg_ms': round(1000 * e['run_total'] / e['runs'], 1),
+                    'run_max_ms': round(1000 * e['run_max'], 1),
+                }
+                for kind, e in self._stats.items()
+            }
+            coalesced = dict(self._coalesced)
+        alive = sum(1 for thread in self._threads if thread.is_alive())
+        return dict(self.store.counts(), workers=self.workers, workers_alive=alive, kinds=kinds, coalesced=coalesced)
+
+
+# --- Process-wide executor ---
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """The executor for this process, started on first use (and again after a fork)."""
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        with _executor_lock:
+            if _executor is None or _executor_pid != os.getpid():
+                _executor = JobExecutor(JobStore(JOBS_DB_PATH), JOB_WORKERS)
+                _executor.start()
+                _executor_pid = os.getpid()
+    return _executor
+
+
+def submit(kind, payload, secret=None, max_attempts=1, dedup_key=None):
+    """
+    Queues a job and returns its id. With a dedup_key that was already
+    submitted, nothing is queued and the existing job's id is returned.
+    """
+    executor = get_executor()
+    new_id = uuid.uuid4().hex
+    sealed, secret_pid = executor.secrets.seal(new_id, secret)
+    try:
+        job_id = executor.store.insert(new_id, kind, payload, sealed, max_attempts, dedup_key, secret_pid)
+    except Exception:
+        executor.secrets.drop(new_id)
+        raise
+    if job_id != new_id:
+        executor.secrets.drop(new_id)
+        executor.record_coalesced(kind)
+        print(f"Jobs: duplicate {kind} submission ({dedup_key}) joined job {job_id}.")
+    else:
+        executor.wake()
+    return job_id
+
+
+def get_job(job_id, offset=0):
+    """
+    The job's status as a dict: status, progress text from 'offset' on,
+    result (decoded), error (of the last failed attempt), attempts so far,
+    and wait/run times in ms. None if unknown.
+    """
+    row = get_executor().store.get(job_id)
+    if row is None:
+        return None
+    now = time.time()
+    started = row['started_at']
+    return {
+        'id': row['id'],
+        'kind': row['kind'],
+        'status': row['status'],
+        'progress': row['progress'][offset:],
+        'progress_length': len(row['progress']),
+        'result': json.loads(row['result']) if row['result'] else None,
+        'error': row['error'],
+        'attempts': row['attempts'],
+        'max_attempts': row['max_attempts'],
+        'wait_ms': round(1000 * ((started or now) - row['enqueued_at'])),
+        'run_ms': round(1000 * ((row['finished_at'] or now) - started)) if started else 0,
+    }
+
+
+def cancel(job_id):
+    executor = get_executor()
+    executor.store.cancel(job_id)
+    row = executor.store.get(job_id)
+    if row is None or row['status'] in FINISHED_STATUSES:
+        executor.secrets.drop(job_id)
+
+
+def job_stats():
+    return get_executor().stats()
+
+
+# --- Polling endpoints (job ids are random and unguessable) ---
+@server.route('/jobs/<job_id>')
+def job_status(job_id):
+    try:
+        offset = max(0, int(request.args.get('offset', 0)))
+    except ValueError:
+        offset = 0
+    job = get_job(job_id, offset)
+    if job is None:
+        abort(404)
+    return jsonify(job)
+
+
+@server.route('/jobs/<job_id>/cancel', methods=['POST'])
+def job_cancel(job_id):
+    cancel(job_id)
+    return jsonify({'id': job_id, 'cancel_requested': True})
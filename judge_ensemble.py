@@ -0,0 +1,222 @@
+import os
+import time
+import statistics
+import threading
+import contextvars
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# --- Judge ensemble ---
+# One judge call decides the winner and all ten scores, so a verdict can
+# swing on a single sample. With JUDGE_ENSEMBLE set, every judgment is
+# asked of several judges at once -- different models and/or temperatures,
+# e.g. "gemini-2.0-flash@0.2,gemini-2.0-flash@0.8,gemini-2.5-flash" -- and
+# the answers are combined: the median of each score and the majority
+# winner. The reasoning text is taken from the judge closest to that
+# consensus, and every judge's own scores are kept in
+# final_results['ensemble'].
+#
+# The calls run in parallel, and the judgment returns as soon as QUORUM
+# judges have answered (by default a majority) or DEADLINE seconds have
+# passed, so it takes about as long as one call. Judges still running
+# then finish in the background and their answers are dropped. A judgment
+# made before the quorum was reached is marked 'quorum_met': False and is
+# not cached (judgment_cache.py), so the debate is judged again next time.
+#
+# Leave JUDGE_ENSEMBLE empty (the default) for a single judge.
+
+JUDGE_ENSEMBLE = os.environ.get('JUDGE_ENSEMBLE', '')
+JUDGE_ENSEMBLE_QUORUM = int(os.environ.get('JUDGE_ENSEMBLE_QUORUM', '0'))          # 0 = majority
+JUDGE_ENSEMBLE_DEADLINE = float(os.environ.get('JUDGE_ENSEMBLE_DEADLINE', '30'))   # seconds
+JUDGE_ENSEMBLE_WORKERS = int(os.environ.get('JUDGE_ENSEMBLE_WORKERS', '16'))
+
+SIDES = ('User', 'AI')
+WINNERS = ('User', 'AI', 'Draw')
+
+
+def parse_judges(spec):
+    """'model@temperature,model,...' -> [(model, temperature or None), ...]."""
+    judges = []
+    for item in spec.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        model, _, temperature = item.partition('@')
+        judges.append((model.strip(), float(temperature) if temperature.strip() else None))
+    return judges
+
+
+def judge_label(model, temperature):
+    return model if temperature is None else f"{model}@{temperature:g}"
+
+
+class JudgeEnsemble:
+    """Runs the configured judges concurrently and combines their judgments."""
+
+    def __init__(self, judges, quorum, deadline, workers):
+        self.judges = judges
+        self.quorum = min(quorum or len(judges) // 2 + 1, len(judges)) if judges else 0
+        self.deadline = deadline
+        self._pool = None
+        self._workers = workers
+        self._lock = threading.Lock()
+        self.runs = 0
+        self.quorum_misses = 0
+        self.late_judges = 0
+        self.failed_judges = 0
+        self.total_ms = 0.0
+
+    @property
+    def enabled(self):
+        return len(self.judges) > 1
+
+    def label(self):
+        """Identifies the judge setup (part of the judgment cache key)."""
+        return ",".join(judge_label(model, temperature) for model, temperature in self.judges)
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix='judge')
+            return self._pool
+
+    def judge(self, judge_one):
+        """
+        Calls judge_one(model, temperature) for every judge in parallel; each
+        returns a judgment dict (with 'error' on failure). Returns the
+        combined judgment, or the first error if no judge answered.
+        """
+        started = time.perf_counter()
+        pool = self._get_pool()
+        # Pool threads do not inherit context variables: each judge runs in a
+        # copy of the caller's, so llm_scheduler.acting_for() still applies.
+        context = contextvars.copy_context()
+        futures = {pool.submit(context.copy().run, judge_one, model, temperature): judge_label(model, temperature)
+                   for model, temperature in self.judges}
+        answers = {}   # label -> judgment
+        errors = {}    # label -> error text
+        pending = set(futures)
+        deadline = started + self.deadline
+        while pending and len(answers) < self.quorum:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                label = futures[future]
+                try:
+                    judgment = future.result()
+                except Exception as e:
+                    judgment = {'error': f"Judge API/Parsing failed: {e}"}
+                if isinstance(judgment, dict) and 'error' not in judgment:
+                    answers[label] = judgment
+                else:
+                    errors[label] = judgment.get('error') if isinstance(judgment, dict) else 'Invalid judgment'
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self.runs += 1
+            self.total_ms += elapsed_ms
+            self.late_judges += len(pending)
+            self.failed_judges += len(errors)
+            if len(answers) < self.quorum:
+                self.quorum_misses += 1
+
+        if not answers:
+            first_error = next(iter(errors.values()), None) or \
+                f"No judge answered within {self.deadline:g}s."
+            return {'error': first_error, 'raw_text': 'N/A'}
+        late = 'Still judging when the quorum was reached.' if len(answers) >= self.quorum \
+            else 'No answer before the deadline.'
+        combined = combine(answers)
+        combined['ensemble'] = {
+            'judges': [
+                {'judge': label, 'scores': answers[label].get('scores'),
+                 'overallWinner': (answers[label].get('reasoning') or {}).get('overallWinner')}
+                if label in answers else
+                {'judge': label, 'error': errors.get(label, late)}
+                for label in futures.values()
+            ],
+            'requested': len(self.judges),
+            'answered': len(answers),
+            'quorum': self.quorum,
+            'quorum_met': len(answers) >= self.quorum,
+            'elapsed_ms': round(elapsed_ms, 1),
+        }
+        return combined
+
+    def stats(self):
+        with self._lock:
+            return {
+                'judges': self.label() if self.enabled else None,
+                'quorum': self.quorum,
+                'deadline_s': self.deadline,
+                'runs': self.runs,
+                'quorum_misses': self.quorum_misses,
+                'late_judges': self.late_judges,
+                'failed_judges': self.failed_judges,
+                'avg_ms': round(self.total_ms / self.runs, 1) if self.runs else 0.0,
+            }
+
+
+def _score(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def median_scores(judgments):
+    """{'User': {metric: median}, 'AI': {...}} over every judge that gave a number."""
+    medians = {}
+    for side in SIDES:
+        metrics = []
+        for judgment in judgments:
+            for metric in (judgment.get('scores') or {}).get(side) or {}:
+                if metric not in metrics:
+                    metrics.append(metric)
+        side_medians = {}
+        for metric in metrics:
+            values = [_score(((j.get('scores') or {}).get(side) or {}).get(metric)) for j in judgments]
+            values = [v for v in values if v is not None]
+            side_medians[metric] = round(statistics.median(values), 1) if values else None
+        medians[side] = side_medians
+    return medians
+
+
+def majority_winner(judgments):
+    """The most common overallWinner; a tie between the leaders is a Draw."""
+    votes = Counter((j.get('reasoning') or {}).get('overallWinner') for j in judgments)
+    votes = Counter({winner: n for winner, n in votes.items() if winner in WINNERS})
+    if not votes:
+        return 'Draw'
+    ranked = votes.most_common()
+    if len(ranked) > 1 and ranked[0][1] == ranked[1][1]:
+        return 'Draw'
+    return ranked[0][0]
+
+
+def _distance(judgment, medians):
+    total = 0.0
+    for side, side_medians in medians.items():
+        for metric, median in side_medians.items():
+            value = _score(((judgment.get('scores') or {}).get(side) or {}).get(metric))
+            if value is not None and median is not None:
+                total += abs(value - median)
+    return total
+
+
+def combine(answers):
+    """One judgment from several: median scores, majority winner, the closest judge's reasoning."""
+    judgments = list(answers.values())
+    medians = median_scores(judgments)
+    winner = majority_winner(judgments)
+    agreeing = [j for j in judgments if (j.get('reasoning') or {}).get('overallWinner') == winner] or judgments
+    closest = min(agreeing, key=lambda j: _distance(j, medians))
+    reasoning = dict(closest.get('reasoning') or {})
+    reasoning['overallWinner'] = winner
+    return {'scores': medians, 'reasoning': reasoning}
+
+
+ensemble = JudgeEnsemble(parse_judges(JUDGE_ENSEMBLE), JUDGE_ENSEMBLE_QUORUM,
+                         JUDGE_ENSEMBLE_DEADLINE, JUDGE_ENSEMBLE_WORKERS)
@@ -38,7 +38,7 @@ judge_mode_layout = html.Div(className='layout-wrapper', children=[
                     dcc.Input(
                         id='judge-turns-input', type='number',
                         placeholder='Number of turns (per player)',
-                        min=1, max=10, step=1,
+                        min=1, max=50, step=1,
                         className='input-field'
                     ),
 
@@ -0,0 +1,182 @@
+import os
+import copy
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+import repository
+
+# --- Judgment cache ---
+# A judgment depends only on what the judge is shown, so it is cached under
+# a hash of exactly that: the prompt version (a hash of the judge prompts),
+# the topic, both stances, the transcript (whitespace-normalised) and the
+# judge model. The same debate judged twice -- a retried job, a re-opened
+# results page, a bulk re-judge with unchanged prompts -- costs one LLM call.
+#
+# Lookups go through a bounded in-process LRU, then the 'judgment_cache'
+# table (shared by every worker process and kept across restarts). Only
+# successful judgments are stored, so an error is always retried for real.
+# Identical judgments requested at the same time in one process share a
+# single call: the later ones wait for the first and get its result. An
+# ensemble judgment that missed its quorum (judge_ensemble.py) is not
+# stored either.
+#
+# Editing the judge prompts changes the prompt version, so old entries are
+# never hit again; the first lookup after such a change also deletes them
+# from the table (invalidate_stale).
+
+JUDGMENT_CACHE_ENABLED = os.environ.get('JUDGMENT_CACHE', '1') != '0'
+JUDGMENT_CACHE_SIZE = int(os.environ.get('JUDGMENT_CACHE_SIZE', '256'))   # in-memory entries
+
+
+def prompt_version(*prompts):
+    """Short hash identifying a set of judge prompts."""
+    digest = hashlib.sha256()
+    for prompt in prompts:
+        digest.update(prompt.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()[:16]
+
+
+def cacheable(judgment):
+    """Only complete, successful judgments are kept."""
+    return 'error' not in judgment and (judgment.get('ensemble') or {}).get('quorum_met', True)
+
+
+def normalize_transcript(text):
+    """Collapses whitespace so formatting-only differences share a cache entry."""
+    return " ".join((text or "").split())
+
+
+class JudgmentCache:
+    """LRU in front of the judgment_cache table, with per-key call coalescing."""
+
+    def __init__(self, version, max_entries, enabled=True):
+        self.version = version
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self._entries = OrderedDict()  # cache key -> judgment
+        self._inflight = {}            # cache key -> threading.Event
+        self._lock = threading.Lock()
+        self._stale_checked = False
+        self.memory_hits = 0
+        self.table_hits = 0
+        self.coalesced = 0
+        self.misses = 0
+        self.stores = 0
+        self.errors = 0
+        self.invalidated = 0
+
+    def key(self, topic, user_stance, ai_stance, transcript, model):
+        parts = [self.version, topic, user_stance, ai_stance, normalize_transcript(transcript), model]
+        return hashlib.sha256(json.dumps(parts).encode('utf-8')).hexdigest()
+
+    def get_or_compute(self, cache_key, compute):
+        """
+        The cached judgment for 'cache_key', or compute() if there is none.
+        compute() returns a judgment dict; it is cached if cacheable().
+        """
+        if not self.enabled:
+            return compute()
+        self.invalidate_stale()
+
+        while True:
+            with self._lock:
+                judgment = self._entries.get(cache_key)
+                if judgment is not None:
+                    self._entries.move_to_end(cache_key)
+                    self.memory_hits += 1
+                    return copy.deepcopy(judgment)
+                waiting = self._inflight.get(cache_key)
+                if waiting is None:
+                    self._inflight[cache_key] = threading.Event()
+                    break
+            # Someone is judging this transcript right now; use their result.
+            waiting.wait()
+            with self._lock:
+                judgment = self._entries.get(cache_key)
+                if judgment is not None:
+                    self.coalesced += 1
+                    return copy.deepcopy(judgment)
+            # Their judgment was not cached (it failed): try again ourselves.
+
+        try:
+            judgment = self._load(cache_key)
+            if judgment is not None:
+                self._count('table_hits')
+            else:
+                self._count('misses')
+                judgment = compute()
+                if cacheable(judgment):
+                    self._save(cache_key, judgment)
+            if cacheable(judgment):
+                self._remember(cache_key, copy.deepcopy(judgment))
+            return judgment
+        finally:
+            with self._lock:
+                self._inflight.pop(cache_key).set()
+
+    def _remember(self, cache_key, judgment):
+        with self._lock:
+            self._entries[cache_key] = judgment
+            self._entries.move_to_end(cache_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _load(self, cache_key):
+        try:
+            row = repository.get_cached_judgment(cache_key, self.version)
+            return json.loads(row) if row else None
+        except Exception as e:
+            print(f"Judgment cache: lookup failed, judging without it: {e}")
+            self._count('errors')
+            return None
+
+    def _save(self, cache_key, judgment):
+        try:
+            repository.store_cached_judgment(cache_key, self.version, json.dumps(judgment))
+            self._count('stores')
+        except Exception as e:
+            print(f"Judgment cache: could not store judgment: {e}")
+            self._count('errors')
+
+    def invalidate_stale(self):
+        """Deletes cached judgments made with other judge prompts (once per process)."""
+        with self._lock:
+            if self._stale_checked:
+                return
+            self._stale_checked = True
+        try:
+            deleted = repository.delete_stale_judgments(self.version)
+        except Exception as e:
+            print(f"Judgment cache: could not clear stale judgments: {e}")
+            self._count('errors')
+            return
+        if deleted:
+            print(f"Judgment cache: judge prompts changed, dropped {deleted} cached judgments.")
+            with self._lock:
+                self.invalidated += deleted
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def stats(self):
+        with self._lock:
+            hits = self.memory_hits + self.table_hits + self.coalesced
+            lookups = hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'prompt_version': self.version,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'memory_hits': self.memory_hits,
+                'table_hits': self.table_hits,
+                'coalesced': self.coalesced,
+                'misses': self.misses,
+                'hit_rate': round(hits / lookups, 3) if lookups else 0.0,
+                'stores': self.stores,
+                'errors': self.errors,
+                'invalidated': self.invalidated,
+            }
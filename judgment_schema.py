@@ -0,0 +1,204 @@
+import json
+import threading
+from functools import lru_cache
+from typing import Annotated, Literal
+
+from pydantic import BaseModel, Field, ValidationError, create_model
+
+# --- Judgment schema ---
+# The judge's output format, declared once. The same classes are
+#   - sent to Gemini as the response schema, so the model is constrained to
+#     produce exactly these fields (scores 0-10, winner one of three values);
+#   - used to parse the reply with pydantic's compiled JSON validator, which
+#     decodes and checks it in one pass.
+# A reply that is valid JSON but has some missing or invalid fields keeps
+# the good ones: only the bad fields are asked for again (repair_model
+# builds a schema for just those), instead of judging the whole debate again.
+
+Score = Annotated[float, Field(ge=0, le=10)]
+Winner = Literal['User', 'AI', 'Draw']
+
+
+class SideScores(BaseModel):
+    # Same skills (and order) as repository.STAT_SKILLS.
+    logicalConsistency: Score
+    evidenceAndExamples: Score
+    clarityAndConcision: Score
+    rebuttalEffectiveness: Score
+    overallPersuasiveness: Score
+
+
+class Scores(BaseModel):
+    User: SideScores
+    AI: SideScores
+
+
+class Reasoning(BaseModel):
+    strongestArgumentUser: str
+    strongestArgumentAI: str
+    weakestArgumentUser: str
+    weakestArgumentAI: str
+    rebuttalAnalysis: str
+    overallWinner: Winner
+    constructiveFeedbackUser: str
+    constructiveFeedbackAI: str
+
+
+class Judgment(BaseModel):
+    scores: Scores
+    reasoning: Reasoning
+
+
+REPAIR_PROMPT = """
+{judge_prompt}
+---
+You already judged this debate. Your answer was:
+{raw_text}
+---
+These fields were missing or invalid: {fields}.
+Reply with a JSON object containing only these fields, with valid values that are consistent with the
+rest of your judgment.
+"""
+
+
+class JudgmentParseError(Exception):
+    """The judge's reply could not be turned into a valid judgment."""
+
+
+def _extract_object(raw_text):
+    """The first JSON object in raw_text (ignoring any text around it), or None."""
+    start = (raw_text or "").find('{')
+    if start < 0:
+        return None
+    try:
+        value, _ = json.JSONDecoder().raw_decode(raw_text, start)
+    except ValueError:
+        return None
+    return value if isinstance(value, dict) else None
+
+
+def _problem_paths(error):
+    """Field paths (tuples) named by a ValidationError, outermost first."""
+    paths = []
+    for detail in error.errors():
+        path = tuple(str(part) for part in detail['loc'])
+        if path and path not in paths:
+            paths.append(path)
+    return paths
+
+
+def parse(raw_text):
+    """
+    (judgment dict, problem paths). Problems is empty for a valid judgment;
+    otherwise the dict holds what was parsed and the paths are the fields to
+    repair. Returns (None, None) if there is no JSON object at all.
+    """
+    try:
+        return Judgment.model_validate_json(raw_text).model_dump(), []
+    except ValidationError:
+        pass
+    data = _extract_object(raw_text)
+    if data is None:
+        return None, None
+    try:
+        return Judgment.model_validate(data).model_dump(), []
+    except ValidationError as e:
+        return data, _problem_paths(e)
+
+
+def _subset_model(model, paths, name):
+    groups = {}
+    for path in paths:
+        groups.setdefault(path[0], []).append(path[1:])
+    fields = {}
+    for field_name, rests in groups.items():
+        field = model.model_fields[field_name]
+        if any(not rest for rest in rests) or not isinstance(field.annotation, type) \
+                or not issubclass(field.annotation, BaseModel):
+            fields[field_name] = (field.annotation, field)
+        else:
+            fields[field_name] = (_subset_model(field.annotation, rests, name + field_name[:1].upper() + field_name[1:]), ...)
+    return create_model(name, **fields)
+
+
+@lru_cache(maxsize=64)
+def repair_model(paths):
+    """A schema with only the given fields of Judgment (paths: tuple of tuples)."""
+    return _subset_model(Judgment, paths, 'JudgmentRepair')
+
+
+def _merge(data, patch):
+    for key, value in patch.items():
+        if isinstance(value, dict) and isinstance(data.get(key), dict):
+            _merge(data[key], value)
+        else:
+            data[key] = value
+    return data
+
+
+def apply_repair(data, paths, repair_text):
+    """Merges a repair reply into the partial judgment; returns (judgment, problem paths)."""
+    try:
+        patch = repair_model(tuple(paths)).model_validate_json(repair_text).model_dump()
+    except ValidationError:
+        patch = _extract_object(repair_text) or {}
+    merged = _merge(data, patch)
+    try:
+        return Judgment.model_validate(merged).model_dump(), []
+    except ValidationError as e:
+        return merged, _problem_paths(e)
+
+
+def describe(paths):
+    return ", ".join(".".join(path) for path in paths)
+
+
+# --- Parse statistics (per judge model) ---
+_parse_stats = {}
+_parse_stats_lock = threading.Lock()
+
+
+def _record(model, outcome):
+    with _parse_stats_lock:
+        entry = _parse_stats.setdefault(model, {'replies': 0, 'valid': 0, 'repaired': 0,
+                                                'repair_failed': 0, 'unparseable': 0})
+        entry['replies'] += 1
+        entry[outcome] += 1
+
+
+def parse_stats():
+    """Per model: replies, how many were valid, repaired or failed, and the failure rate."""
+    with _parse_stats_lock:
+        return {
+            model: dict(entry, failure_rate=round(
+                (entry['repair_failed'] + entry['unparseable']) / entry['replies'], 3))
+            for model, entry in _parse_stats.items()
+        }
+
+
+def decode(raw_text, model, repair):
+    """
+    The validated judgment in raw_text. Missing or invalid fields are asked
+    for once with repair(fields, repair_schema), which returns the model's
+    reply. Raises JudgmentParseError if the judgment is still not valid.
+    """
+    judgment, problems = parse(raw_text)
+    if judgment is None:
+        _record(model, 'unparseable')
+        raise JudgmentParseError("No JSON object found.")
+    if not problems:
+        _record(model, 'valid')
+        return judgment
+
+    print(f"Judgment from {model} has invalid fields, asking for a repair: {describe(problems)}")
+    try:
+        repair_text = repair(describe(problems), repair_model(tuple(problems)))
+    except Exception as e:
+        _record(model, 'repair_failed')
+        raise JudgmentParseError(f"Invalid fields ({describe(problems)}), repair request failed: {e}")
+    judgment, problems = apply_repair(judgment, problems, repair_text)
+    if problems:
+        _record(model, 'repair_failed')
+        raise JudgmentParseError(f"Invalid fields after repair: {describe(problems)}")
+    _record(model, 'repaired')
+    return judgment
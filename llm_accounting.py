@@ -0,0 +1,181 @@
+import os
+import math
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+import persistence
+from google.genai import errors
+from circuit_breaker import CircuitOpenError
+from llm_scheduler import LLMDeadlineExceeded, current_caller, is_rate_limited
+
+# --- LLM call accounting ---
+# Every opponent, judge, repair and summary call made through llm_client.py
+# is recorded: model, prompt and completion tokens (from the response's
+# usage metadata), time to first token (streamed replies), total latency,
+# retries and outcome, plus the user and debate mode it was made for (set
+# with llm_scheduler.acting_for). Records go to the llm_calls table through
+# the write-behind queue (persistence.py), so a call never waits on the
+# database.
+#
+# /server-stats ('llm_calls') shows this process's recent calls per call
+# type: counts, tokens, estimated cost and p50/p95/p99 latencies over the
+# last LLM_LATENCY_WINDOW calls. llm_report.py aggregates the table across
+# every worker, per call type, user and mode -- run it before and after a
+# prompt edit to spot regressions.
+
+LLM_CALL_LOG = os.environ.get('LLM_CALL_LOG', '1') != '0'                   # write llm_calls rows
+LLM_LATENCY_WINDOW = int(os.environ.get('LLM_LATENCY_WINDOW', '1000'))      # calls per type, in memory
+# US$ per million tokens, for the cost estimates (gemini-2.0-flash list prices).
+LLM_PRICE_INPUT_PER_M = float(os.environ.get('LLM_PRICE_INPUT_PER_M', '0.10'))
+LLM_PRICE_OUTPUT_PER_M = float(os.environ.get('LLM_PRICE_OUTPUT_PER_M', '0.40'))
+
+OK = 'ok'
+CANCELLED = 'cancelled'  # not a failure: nobody was waiting any more
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers (None if empty)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def estimated_cost(prompt_tokens, completion_tokens):
+    return ((prompt_tokens or 0) * LLM_PRICE_INPUT_PER_M
+            + (completion_tokens or 0) * LLM_PRICE_OUTPUT_PER_M) / 1_000_000
+
+
+def outcome_of(e):
+    if isinstance(e, CircuitOpenError):
+        return 'circuit_open'
+    if isinstance(e, LLMDeadlineExceeded):
+        return 'deadline'
+    if is_rate_limited(e):
+        return 'rate_limited'
+    if isinstance(e, errors.APIError):
+        return f"error_{e.code}"
+    return 'error'
+
+
+class CallRecord:
+    """One LLM call being timed; the caller reports its first token and usage."""
+
+    def __init__(self, call_type, model):
+        self.call_type = call_type
+        self.model = model
+        self.user, self.mode = current_caller()
+        self.started = time.perf_counter()
+        self.ttft_ms = None
+        self.retries = 0  # counted by llm_scheduler
+        self.prompt_tokens = None
+        self.completion_tokens = None
+
+    def first_token(self):
+        if self.ttft_ms is None:
+            self.ttft_ms = (time.perf_counter() - self.started) * 1000
+
+    def usage(self, response):
+        usage = getattr(response, 'usage_metadata', None)
+        if usage is None:
+            return
+        self.prompt_tokens = getattr(usage, 'prompt_token_count', None)
+        self.completion_tokens = getattr(usage, 'candidates_token_count', None)
+        if self.completion_tokens is None and getattr(usage, 'total_token_count', None) is not None:
+            self.completion_tokens = usage.total_token_count - (self.prompt_tokens or 0)
+
+    def row(self, outcome):
+        return {
+            'called_at': time.time(),
+            'username': self.user,
+            'debate_mode': self.mode,
+            'call_type': self.call_type,
+            'model': self.model,
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+            'ttft_ms': round(self.ttft_ms, 1) if self.ttft_ms is not None else None,
+            'latency_ms': round((time.perf_counter() - self.started) * 1000, 1),
+            'retries': self.retries,
+            'outcome': outcome,
+        }
+
+
+class CallStats:
+    """Per call type: counters plus a window of recent latencies."""
+
+    def __init__(self, window):
+        self.window = window
+        self._types = {}
+        self._lock = threading.Lock()
+
+    def add(self, row):
+        with self._lock:
+            entry = self._types.get(row['call_type'])
+            if entry is None:
+                entry = self._types[row['call_type']] = {
+                    'calls': 0, 'failed': 0, 'retries': 0, 'prompt_tokens': 0, 'completion_tokens': 0,
+                    'outcomes': {}, 'latency': deque(maxlen=self.window), 'ttft': deque(maxlen=self.window),
+                }
+            entry['calls'] += 1
+            entry['retries'] += row['retries']
+            entry['outcomes'][row['outcome']] = entry['outcomes'].get(row['outcome'], 0) + 1
+            if row['outcome'] != OK:
+                entry['failed'] += row['outcome'] != CANCELLED
+                return
+            entry['prompt_tokens'] += row['prompt_tokens'] or 0
+            entry['completion_tokens'] += row['completion_tokens'] or 0
+            entry['latency'].append(row['latency_ms'])
+            if row['ttft_ms'] is not None:
+                entry['ttft'].append(row['ttft_ms'])
+
+    def stats(self):
+        with self._lock:
+            out = {}
+            for call_type, entry in self._types.items():
+                latency, ttft = list(entry['latency']), list(entry['ttft'])
+                out[call_type] = {
+                    'calls': entry['calls'],
+                    'failed': entry['failed'],
+                    'retries': entry['retries'],
+                    'outcomes': dict(entry['outcomes']),
+                    'prompt_tokens': entry['prompt_tokens'],
+                    'completion_tokens': entry['completion_tokens'],
+                    'est_cost_usd': round(estimated_cost(entry['prompt_tokens'], entry['completion_tokens']), 4),
+                    'latency_ms': {f"p{pct}": percentile(latency, pct) for pct in (50, 95, 99)},
+                    'ttft_ms': {f"p{pct}": percentile(ttft, pct) for pct in (50, 95, 99)} if ttft else None,
+                }
+            return out
+
+
+_call_stats = CallStats(LLM_LATENCY_WINDOW)
+
+
+@contextmanager
+def record(call_type, model):
+    """
+    Times the LLM call made inside the block and records it when the block
+    ends: 'ok', an error outcome if it raises, or 'cancelled' if it is
+    abandoned (a streamed reply the user left).
+    """
+    call = CallRecord(call_type, model)
+    outcome = CANCELLED
+    try:
+        yield call
+        outcome = OK
+    except Exception as e:
+        outcome = outcome_of(e)
+        raise
+    finally:
+        row = call.row(outcome)
+        _call_stats.add(row)
+        if LLM_CALL_LOG:
+            try:
+                persistence.submit('llm_call', row)
+            except Exception as e:
+                print(f"LLM accounting: could not queue the call record: {e}")
+
+
+def call_stats():
+    return _call_stats.stats()
@@ -0,0 +1,135 @@
+import os
+import sys
+import time
+import uuid
+import argparse
+import threading
+
+# --- Offline LLM benchmark ---
+# Plays simulated debates against the local LLM stand-in (local_llm.py):
+# each user streams opponent replies turn by turn, then has the debate
+# judged, through the same code the app runs (llm_client's sessions,
+# scheduler, circuit breakers and prompt cache, callbacks.call_judge's
+# schema validation). Reports throughput and p50/p95/p99 latencies.
+#
+# Latency and failure injection are set with the LOCAL_LLM_* variables;
+# the same settings and seed give the same replies. Rate limits apply as in
+# production (GEMINI_RPM_PER_KEY); raise them to measure the app alone.
+#
+#   LLM_PROVIDER=local GEMINI_RPM_PER_KEY=100000 python llm_bench.py --users 20 --turns 3
+
+os.environ.setdefault('LLM_PROVIDER', 'local')
+os.environ.setdefault('LLM_CALL_LOG', '0')  # keep benchmark calls out of llm_calls
+
+import llm_client
+from callbacks import DEBATE_OPPONENT_PROMPT, DEBATE_SETUP_PROMPT, DEBATE_JUDGE_CASE_PROMPT, call_judge
+from circuit_breaker import breakers
+from llm_scheduler import scheduler
+from llm_accounting import percentile
+
+TOPIC = "Should homework be banned in primary schools?"
+
+
+class Results:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}  # metric -> [seconds]
+        self.errors = {}   # metric -> count
+
+    def add(self, metric, seconds):
+        with self._lock:
+            self.samples.setdefault(metric, []).append(seconds)
+
+    def error(self, metric, e):
+        with self._lock:
+            self.errors[metric] = self.errors.get(metric, 0) + 1
+        print(f"  {metric} failed: {e}")
+
+
+def play_debate(user, api_key, turns, results):
+    setup_prompt = DEBATE_SETUP_PROMPT.format(topic=TOPIC, user_stance='For', opponent_stance='Against')
+    chat_id = uuid.uuid4().hex
+    history = []
+    transcript = ""
+    for turn in range(1, turns + 1):
+        message = f"Argument {turn} from user {user}: homework takes time away from play and family."
+        started = time.perf_counter()
+        first = None
+        reply = ''
+        try:
+            for chunk in llm_client.stream_opponent_reply(api_key, DEBATE_OPPONENT_PROMPT, setup_prompt,
+                                                          history, message, chat_id=chat_id):
+                if first is None:
+                    first = time.perf_counter() - started
+                reply += chunk
+        except Exception as e:
+            results.error('opponent_reply', e)
+            return
+        results.add('opponent_first_chunk', first if first is not None else time.perf_counter() - started)
+        results.add('opponent_reply', time.perf_counter() - started)
+        history += [{'role': 'user', 'parts': [message]}, {'role': 'model', 'parts': [reply]}]
+        transcript += f"User (For): {message}\n\nAI (Against): {reply}\n\n"
+
+    judge_prompt = DEBATE_JUDGE_CASE_PROMPT.format(topic=TOPIC, user_stance='For', ai_stance='Against',
+                                                   transcript=transcript)
+    started = time.perf_counter()
+    judgment = call_judge(api_key, judge_prompt)
+    if 'error' in judgment:
+        results.error('judgment', judgment['error'])
+    else:
+        results.add('judgment', time.perf_counter() - started)
+
+
+def run(users, debates, turns, shared_key):
+    results = Results()
+
+    def user_loop(user):
+        api_key = 'bench-shared-key' if shared_key else f"bench-key-{user}"
+        for _ in range(debates):
+            play_debate(user, api_key, turns, results)
+
+    threads = [threading.Thread(target=user_loop, args=(user,), name=f"bench-{user}") for user in range(users)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - started
+
+
+def report(results, elapsed):
+    replies = len(results.samples.get('opponent_reply', []))
+    judged = len(results.samples.get('judgment', []))
+    print(f"\n{elapsed:.1f}s: {replies} opponent replies ({replies / elapsed:.2f}/s), "
+          f"{judged} judgments ({judged / elapsed:.2f}/s)")
+    print(f"{'metric':<22}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'errors':>8}")
+    for metric in ('opponent_first_chunk', 'opponent_reply', 'judgment'):
+        values = results.samples.get(metric, [])
+        cells = [percentile(values, pct) for pct in (50, 95, 99)] + [max(values) if values else None]
+        print(f"{metric:<22}{len(values):>6}" + ''.join(
+            f"{value * 1000:>10.0f}" if value is not None else f"{'-':>10}" for value in cells
+        ) + f"{results.errors.get(metric, 0):>8}")
+    sched = scheduler.stats()
+    print(f"scheduler: {sched['queued']} queued (avg wait {sched['avg_wait_ms']} ms), {sched['retries']} retries, "
+          f"{sched['rate_limited']} rate limited, {sched['deadline_exceeded']} deadlines exceeded")
+    print(f"circuit trips: {sum(entry.get('trips', 0) for entry in breakers.stats().values())} (provider-wide)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark debates against the local LLM stand-in.")
+    parser.add_argument('--users', type=int, default=10, help="concurrent simulated users")
+    parser.add_argument('--debates', type=int, default=1, help="debates per user")
+    parser.add_argument('--turns', type=int, default=3, help="turns per debate")
+    parser.add_argument('--shared-key', action='store_true', help="all users share one API key")
+    args = parser.parse_args()
+
+    if llm_client.LLM_PROVIDER != 'local':
+        sys.exit("llm_bench.py only runs against the local stand-in (LLM_PROVIDER=local).")
+    print(f"{args.users} users x {args.debates} debates x {args.turns} turns, "
+          f"{'one shared key' if args.shared_key else 'one key per user'}.")
+    results, elapsed = run(args.users, args.debates, args.turns, args.shared_key)
+    report(results, elapsed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,463 @@
+import os
+import time
+import hashlib
+import itertools
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+from google import genai
+from google.genai import types
+
+import local_llm
+import llm_accounting
+from prompt_cache import prompt_cache, is_cache_error
+from llm_scheduler import scheduler, LLM_REQUEST_TIMEOUT
+
+# --- Gemini clients ---
+# google.generativeai's genai.configure() sets ONE api key for the whole
+# process, so under a threaded gunicorn worker two users' turns could race
+# and be sent with each other's key. Every call now goes through a
+# google-genai Client bound to the requesting user's key. Clients are kept
+# in a small LRU cache keyed by a hash of the key (the raw key is never used
+# as a dict key or logged), so a user's turns reuse one client and its
+# HTTP connection pool instead of rebuilding them every turn.
+
+# LLM_PROVIDER picks what the clients talk to:
+#   gemini - Google's API (default)
+#   local  - local_llm.py's offline stand-in (load tests, benchmarks)
+# Everything else in this module (and every caller) is the same for both.
+LLM_PROVIDER = os.environ.get('LLM_PROVIDER', 'gemini')
+CLIENT_CACHE_SIZE = int(os.environ.get('GEMINI_CLIENT_CACHE_SIZE', '256'))
+OPPONENT_MODEL = os.environ.get('GEMINI_OPPONENT_MODEL', 'gemini-2.0-flash')
+JUDGE_MODEL = os.environ.get('GEMINI_JUDGE_MODEL', 'gemini-2.0-flash')
+SUMMARY_MODEL = os.environ.get('GEMINI_SUMMARY_MODEL', 'gemini-2.0-flash')
+CHAT_SESSION_CACHE_SIZE = int(os.environ.get('GEMINI_CHAT_SESSIONS', '512'))
+CHAT_SESSION_TTL = float(os.environ.get('GEMINI_CHAT_SESSION_TTL', '1800'))                # seconds idle
+CHAT_SESSION_MAX_BYTES = int(os.environ.get('GEMINI_CHAT_SESSION_MAX_BYTES', str(64 * 1024 * 1024)))
+
+
+def key_fingerprint(api_key):
+    """Stable, non-reversible id for an API key."""
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()
+
+
+class ClientCache:
+    """Thread-safe LRU cache of genai.Client objects, one per API key."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._clients = OrderedDict()  # key fingerprint -> genai.Client
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, api_key):
+        if not api_key:
+            raise ValueError("No Google API key provided.")
+        fingerprint = key_fingerprint(api_key)
+        with self._lock:
+            client = self._clients.get(fingerprint)
+            if client is not None:
+                self._clients.move_to_end(fingerprint)
+                self.hits += 1
+                return client
+            self.misses += 1
+
+        # Build outside the lock; if two threads race, the first one stored wins.
+        client = _new_client(api_key)
+        with self._lock:
+            existing = self._clients.get(fingerprint)
+            if existing is not None:
+                self._clients.move_to_end(fingerprint)
+                return existing
+            self._clients[fingerprint] = client
+            while len(self._clients) > self.max_size:
+                self._clients.popitem(last=False)
+                self.evictions += 1
+        return client
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._clients),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+def _new_client(api_key):
+    if LLM_PROVIDER == 'local':
+        return local_llm.LocalClient(api_key)
+    return genai.Client(api_key=api_key,
+                        http_options=types.HttpOptions(timeout=int(LLM_REQUEST_TIMEOUT * 1000)))
+
+
+_client_cache = ClientCache(CLIENT_CACHE_SIZE)
+
+
+def get_client(api_key):
+    """The cached genai.Client for this key. Raises ValueError if the key is empty."""
+    return _client_cache.get(api_key)
+
+
+def client_cache_stats():
+    return _client_cache.stats()
+
+
+def scheduler_stats():
+    return scheduler.stats()
+
+
+def call_stats():
+    return llm_accounting.call_stats()
+
+
+def provider_stats():
+    if LLM_PROVIDER == 'local':
+        return dict(local_llm.stats(), provider=LLM_PROVIDER)
+    return {'provider': LLM_PROVIDER}
+
+
+# --- Request configs (built once, shared by every client) ---
+# The fixed instructions (judge rubric, opponent rules) are the system
+# instruction; everything debate-specific goes in the contents after them.
+# When the prompt cache has the instructions (see prompt_cache.py) the
+# request names the cache instead; these configs are the uncached fallback.
+JSON_MODE = {'response_mime_type': 'application/json'}
+
+
+@lru_cache(maxsize=16)
+def judge_config(system_prompt, temperature=None, response_schema=None):
+    return types.GenerateContentConfig(system_instruction=system_prompt, temperature=temperature,
+                                       response_schema=response_schema, **JSON_MODE)
+
+
+@lru_cache(maxsize=16)
+def opponent_config(system_prompt):
+    return types.GenerateContentConfig(system_instruction=system_prompt)
+
+
+def with_timeout(config, timeout):
+    """'config' (or a blank one) with the HTTP timeout set to 'timeout' seconds."""
+    http_options = types.HttpOptions(timeout=max(1, int(timeout * 1000)))
+    if config is None:
+        return types.GenerateContentConfig(http_options=http_options)
+    return config.model_copy(update={'http_options': http_options})
+
+
+def prefix_cache_stats():
+    return prompt_cache.stats()
+
+
+def _prefix_config(client, api_key, model, system_prompt, fallback_config, extra):
+    """(config, cache name) for a request starting with 'system_prompt'; the name is None if uncached."""
+    name = prompt_cache.lookup(client, key_fingerprint(api_key), model, system_prompt)
+    if name:
+        try:
+            return prompt_cache.request_config(name, system_prompt, extra), name
+        except Exception as e:
+            if not is_cache_error(e):
+                raise
+            prompt_cache.invalidate(name)
+    return fallback_config, None
+
+
+def to_contents(chat_history):
+    """chat_history entries -> API contents. Extra keys ('time', 'player_name') are dropped."""
+    return [
+        {'role': 'model' if entry['role'] == 'model' else 'user',
+         'parts': [{'text': str((entry.get('parts') or [''])[0])}]}
+        for entry in chat_history
+    ]
+
+
+# --- Rate limiting ---
+# Every request below is run through llm_scheduler (per-key rate limits,
+# retries, deadline). Token use is estimated up front from the prompt size
+# (about 4 characters per token, plus room for the reply) and corrected
+# from the response's usage metadata.
+OUTPUT_TOKEN_ALLOWANCE = 1024
+
+
+def _estimate_tokens(*texts):
+    return sum(len(text or '') for text in texts) // 4 + OUTPUT_TOKEN_ALLOWANCE
+
+
+def _settle(key_id, estimate, response):
+    usage = getattr(response, 'usage_metadata', None)
+    total = getattr(usage, 'total_token_count', None)
+    if total is not None:
+        scheduler.settle(key_id, total - estimate)
+
+
+def _response_text(response):
+    text = response.text
+    if text is None:
+        raise ValueError("The model returned no text (the response may have been blocked).")
+    return text
+
+
+# --- Opponent chat sessions ---
+# Each practice debate keeps its opponent conversation here between turns:
+# the history as validated Content objects, plus the setup message and key
+# it belongs to. A turn then converts only the new message instead of
+# rebuilding and re-validating the whole history. The Gemini API itself is
+# stateless, so the (compacted) history is still part of every request.
+# Sessions live in a per-process LRU bounded by count, idle time (TTL) and
+# approximate size. When the debate's older turns are summarized, the
+# session drops them and keeps going. On a miss (another worker, a restart,
+# an expired entry, or a history that no longer matches) the session is
+# rebuilt from the chat_history sent with the turn.
+def _content_text(content):
+    return ''.join(part.text or '' for part in (content.parts or []))
+
+
+def _turn_digest(role, text):
+    return hashlib.sha256(f"{role}\0{text}".encode('utf-8')).digest()
+
+
+def _history_digests(chat_history):
+    """One digest per chat_history turn, of its role and text as sent to the model."""
+    return [_turn_digest(c['role'], c['parts'][0]['text']) for c in to_contents(chat_history)]
+
+
+class ChatSession:
+    """One debate's opponent conversation (its setup message and turns)."""
+
+    def __init__(self, key_id, setup_prompt, contents):
+        self.key_id = key_id
+        self.setup_prompt = setup_prompt
+        self.contents = contents
+        self.digests = [_turn_digest(c.role, _content_text(c)) for c in contents]
+        self.size = len(setup_prompt) + sum(len(_content_text(c)) for c in contents)
+        self.last_used = time.monotonic()
+
+    def resume(self, key_id, setup_prompt, chat_history):
+        """
+        Lines the session up with 'chat_history' (the turns sent verbatim).
+        When older turns were folded into a summary (compaction.py), the new
+        setup message is taken and the summarized prefix dropped. Returns
+        False if the session does not hold this history: every turn's role
+        and text must match, so an edited or reordered turn is a miss.
+        """
+        drop = len(self.contents) - len(chat_history)
+        if key_id != self.key_id or drop < 0 or (drop == 0 and setup_prompt != self.setup_prompt):
+            return False
+        if _history_digests(chat_history) != self.digests[drop:]:
+            return False
+        if drop:
+            self.size -= sum(len(_content_text(c)) for c in self.contents[:drop])
+            self.size += len(setup_prompt) - len(self.setup_prompt)
+            self.contents = self.contents[drop:]
+            self.digests = self.digests[drop:]
+            self.setup_prompt = setup_prompt
+        return True
+
+    def append_turn(self, user_content, reply):
+        self.contents = self.contents + [user_content, types.Content(role='model', parts=[types.Part(text=reply)])]
+        self.digests = self.digests + [_turn_digest('user', _content_text(user_content)), _turn_digest('model', reply)]
+        self.size += len(_content_text(user_content)) + len(reply)
+
+
+class ChatSessionRegistry:
+    """Thread-safe LRU of ChatSession objects keyed by the debate's chat id."""
+
+    def __init__(self, max_sessions, ttl, max_bytes):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._sessions = OrderedDict()  # chat id -> ChatSession
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.expired = 0
+        self.evictions = 0
+
+    def checkout(self, chat_id, key_id, setup_prompt, chat_history):
+        """
+        Takes the debate's session out of the registry if it still matches,
+        else returns None (a miss). Checked-out sessions are not shared, so a
+        session is only ever used by one turn at a time.
+        """
+        with self._lock:
+            session = self._sessions.pop(chat_id, None)
+            if session is not None:
+                self._bytes -= session.size
+            if session is None:
+                self.misses += 1
+                return None
+            if time.monotonic() - session.last_used > self.ttl:
+                self.expired += 1
+                self.misses += 1
+                return None
+            if not session.resume(key_id, setup_prompt, chat_history):
+                self.stale += 1
+                self.misses += 1
+                return None
+            self.hits += 1
+            return session
+
+    def checkin(self, chat_id, session):
+        session.last_used = time.monotonic()
+        with self._lock:
+            previous = self._sessions.pop(chat_id, None)
+            if previous is not None:
+                self._bytes -= previous.size
+            self._sessions[chat_id] = session
+            self._bytes += session.size
+            now = time.monotonic()
+            while self._sessions:
+                oldest_id, oldest = next(iter(self._sessions.items()))
+                if now - oldest.last_used > self.ttl:
+                    self.expired += 1
+                elif len(self._sessions) > self.max_sessions or self._bytes > self.max_bytes:
+                    self.evictions += 1
+                else:
+                    break
+                del self._sessions[oldest_id]
+                self._bytes -= oldest.size
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._sessions),
+                'max_size': self.max_sessions,
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'stale': self.stale,
+                'expired': self.expired,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+            }
+
+
+_chat_sessions = ChatSessionRegistry(CHAT_SESSION_CACHE_SIZE, CHAT_SESSION_TTL, CHAT_SESSION_MAX_BYTES)
+
+
+def chat_session_stats():
+    return _chat_sessions.stats()
+
+
+@lru_cache(maxsize=256)
+def _setup_contents(setup_prompt):
+    """The debate's setup (topic, stances, summary) as the opening exchange."""
+    return (types.Content(role='user', parts=[types.Part(text=setup_prompt)]),
+            types.Content(role='model', parts=[types.Part(text="Understood. I am ready for your argument.")]))
+
+
+def stream_opponent_reply(api_key, system_prompt, setup_prompt, chat_history, message, chat_id=None):
+    """
+    Yields the AI opponent's reply to 'message', chunk by chunk.
+    system_prompt is the fixed rules (cacheable), setup_prompt this debate's
+    topic and stances, chat_history the earlier turns. With a chat_id the
+    debate's live session is reused (and kept for the next turn once the
+    reply is complete).
+    """
+    client = get_client(api_key)
+    key_id = key_fingerprint(api_key)
+    session = _chat_sessions.checkout(chat_id, key_id, setup_prompt, chat_history) if chat_id else None
+    if session is None:
+        contents = [types.Content.model_validate(c) for c in to_contents(chat_history)]
+        session = ChatSession(key_id, setup_prompt, contents)
+
+    user_content = types.Content(role='user', parts=[types.Part(text=message)])
+    contents = list(_setup_contents(setup_prompt)) + session.contents + [user_content]
+    estimate = _estimate_tokens(system_prompt, setup_prompt, message,
+                                *(_content_text(c) for c in session.contents))
+
+    # Retried (and rate limited) up to the first chunk; after that the reply is streaming.
+    def start(timeout):
+        config, cache_name = _prefix_config(client, api_key, OPPONENT_MODEL, system_prompt,
+                                            opponent_config(system_prompt), {})
+        try:
+            stream = client.models.generate_content_stream(model=OPPONENT_MODEL, contents=contents,
+                                                           config=with_timeout(config, timeout))
+            return stream, next(stream, None)
+        except Exception as e:
+            if cache_name is None or not is_cache_error(e):
+                raise
+            prompt_cache.invalidate(cache_name)
+            stream = client.models.generate_content_stream(
+                model=OPPONENT_MODEL, contents=contents, config=with_timeout(opponent_config(system_prompt), timeout)
+            )
+            return stream, next(stream, None)
+
+    with llm_accounting.record('opponent_reply', OPPONENT_MODEL) as call:
+        stream, first = scheduler.call(key_id, start, tokens=estimate, record=call)
+        call.first_token()
+        reply = []
+        chunk = None
+        for chunk in itertools.chain([first] if first is not None else [], stream):
+            if chunk.text:
+                reply.append(chunk.text)
+                yield chunk.text
+        call.usage(chunk)
+    _settle(key_id, estimate, chunk)
+
+    # Only a reply that arrived in full is kept; a cancelled or failed turn
+    # leaves nothing behind and the next turn rebuilds the session.
+    if chat_id:
+        session.append_turn(user_content, ''.join(reply))
+        _chat_sessions.checkin(chat_id, session)
+
+
+def generate_judgment_text(api_key, judge_rubric, judge_prompt, model=None, temperature=None,
+                           response_schema=None, call_type='judgment'):
+    """
+    Raw (JSON) text of the judge's verdict on 'judge_prompt' (the debate),
+    judged by 'judge_rubric'. model/temperature default to JUDGE_MODEL and
+    the model's own default (judge_ensemble.py varies them); response_schema
+    (a pydantic model, see judgment_schema.py) constrains the output.
+    call_type labels the call in the call log (llm_accounting.py).
+    """
+    model = model or JUDGE_MODEL
+    client = get_client(api_key)
+    key_id = key_fingerprint(api_key)
+    extra = dict(JSON_MODE, temperature=temperature, response_schema=response_schema)
+    estimate = _estimate_tokens(judge_rubric, judge_prompt)
+
+    def request(timeout):
+        config, cache_name = _prefix_config(client, api_key, model, judge_rubric,
+                                            judge_config(judge_rubric, temperature, response_schema), extra)
+        try:
+            return client.models.generate_content(model=model, contents=judge_prompt,
+                                                  config=with_timeout(config, timeout))
+        except Exception as e:
+            if cache_name is None or not is_cache_error(e):
+                raise
+            prompt_cache.invalidate(cache_name)
+            return client.models.generate_content(
+                model=model, contents=judge_prompt,
+                config=with_timeout(judge_config(judge_rubric, temperature, response_schema), timeout)
+            )
+
+    with llm_accounting.record(call_type, model) as call:
+        response = scheduler.call(key_id, request, tokens=estimate, record=call)
+        call.usage(response)
+        text = _response_text(response)
+    _settle(key_id, estimate, response)
+    return text
+
+
+def generate_summary(api_key, summary_prompt):
+    """Plain-text summary (used by compaction.py)."""
+    client = get_client(api_key)
+    key_id = key_fingerprint(api_key)
+    estimate = _estimate_tokens(summary_prompt)
+    with llm_accounting.record('summary', SUMMARY_MODEL) as call:
+        response = scheduler.call(key_id, lambda timeout: client.models.generate_content(
+            model=SUMMARY_MODEL, contents=summary_prompt, config=with_timeout(None, timeout)
+        ), tokens=estimate, record=call)
+        call.usage(response)
+        text = _response_text(response)
+    _settle(key_id, estimate, response)
+    return text
@@ -0,0 +1,94 @@
+import sys
+import time
+import argparse
+
+from dotenv import load_dotenv
+
+# --- LLM call report ---
+# Reads the llm_calls table (see llm_accounting.py) -- every worker's calls
+# -- and prints, for the last --hours:
+#   - per call type and model: calls, failures, and p50/p95/p99 of the
+#     total latency and of the time to first token;
+#   - per debate mode and per user: calls, retries, tokens and estimated
+#     cost (LLM_PRICE_INPUT_PER_M / LLM_PRICE_OUTPUT_PER_M).
+# Run it before and after a prompt edit to see what the edit cost.
+#
+#   python llm_report.py --hours 24 --top-users 20
+
+load_dotenv()  # DATABASE_URL, same as run.py
+
+from repository import llm_call_rollup, iter_llm_call_latencies
+from llm_accounting import OK, CANCELLED, percentile, estimated_cost
+
+PERCENTILES = (50, 95, 99)
+
+
+def _ms(value):
+    return f"{value:>10.0f}" if value is not None else f"{'-':>10}"
+
+
+def latency_report(since):
+    samples = {}  # (call_type, model) -> {'calls', 'failed', 'latency', 'ttft'}
+    for row in iter_llm_call_latencies(since):
+        entry = samples.setdefault((row['call_type'], row['model']),
+                                   {'calls': 0, 'failed': 0, 'latency': [], 'ttft': []})
+        entry['calls'] += 1
+        if row['outcome'] != OK:
+            entry['failed'] += row['outcome'] != CANCELLED
+            continue
+        entry['latency'].append(row['latency_ms'])
+        if row['ttft_ms'] is not None:
+            entry['ttft'].append(row['ttft_ms'])
+
+    print(f"{'call type':<16}{'model':<22}{'calls':>7}{'failed':>7}"
+          + ''.join(f"{f'lat p{pct}':>10}" for pct in PERCENTILES)
+          + ''.join(f"{f'ttft p{pct}':>10}" for pct in PERCENTILES) + "   (ms)")
+    for (call_type, model), entry in sorted(samples.items(), key=lambda item: (item[0][0], item[0][1] or '')):
+        print(f"{call_type:<16}{(model or '-'):<22}{entry['calls']:>7}{entry['failed']:>7}"
+              + ''.join(_ms(percentile(entry['latency'], pct)) for pct in PERCENTILES)
+              + ''.join(_ms(percentile(entry['ttft'], pct)) for pct in PERCENTILES))
+    if not samples:
+        print("(no calls)")
+
+
+def rollup_report(group, since, top=None):
+    totals = {}
+    for row in llm_call_rollup(group, since):
+        entry = totals.setdefault(row['grp'], {'calls': 0, 'failed': 0, 'retries': 0,
+                                               'prompt_tokens': 0, 'completion_tokens': 0})
+        for field in entry:
+            entry[field] += row[field] or 0
+    ranked = sorted(totals.items(), key=lambda item: -(item[1]['prompt_tokens'] + item[1]['completion_tokens']))
+    if top:
+        ranked = ranked[:top]
+
+    print(f"{group:<24}{'calls':>7}{'failed':>7}{'retries':>8}{'prompt tok':>12}{'output tok':>12}{'est. $':>10}")
+    for name, entry in ranked:
+        cost = estimated_cost(entry['prompt_tokens'], entry['completion_tokens'])
+        print(f"{str(name)[:23]:<24}{entry['calls']:>7}{entry['failed']:>7}{entry['retries']:>8}"
+              f"{entry['prompt_tokens']:>12,}{entry['completion_tokens']:>12,}{cost:>10.4f}")
+    if not ranked:
+        print("(no calls)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latency, token and cost report of logged LLM calls.")
+    parser.add_argument('--hours', type=float, default=24, help="how far back to look")
+    parser.add_argument('--top-users', type=int, default=20, help="users to list (by tokens)")
+    args = parser.parse_args()
+
+    since = time.time() - args.hours * 3600
+    try:
+        print(f"LLM calls in the last {args.hours:g} hours\n")
+        latency_report(since)
+        print()
+        rollup_report('mode', since)
+        print()
+        rollup_report('user', since, top=args.top_users)
+    except Exception as e:
+        print(f"An error occurred while reading llm_calls: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+import os
+import re
+import time
+import itertools
+import threading
+import contextvars
+from contextlib import contextmanager
+
+import httpx
+from google.genai import errors
+from tenacity import Retrying, retry_if_exception, wait_random_exponential
+
+import circuit_breaker
+
+# --- LLM call scheduler ---
+# Every Gemini request goes through here (see llm_client.py). Per API key it
+# keeps a token bucket for requests/min and tokens/min. A call that would
+# go over the limit waits in the key's queue instead of being sent and
+# failing with 429. Transient failures (429, 5xx, timeouts, dropped
+# connections) are retried with jittered exponential backoff; a 429 also
+# pauses the whole key for the delay the server asks for. Each call has an
+# overall deadline covering queueing, retries and the requests themselves:
+# each attempt gets fn(timeout), with the HTTP timeout cut to what is left
+# of the deadline, and no attempt starts with less than
+# LLM_MIN_ATTEMPT_BUDGET left. Past the deadline the call fails with
+# LLMDeadlineExceeded rather than hanging a turn or a judgment.
+#
+# Many users can share one key (a server key, or a class sharing a key).
+# While calls wait for a key, the next slot goes to the waiting user who
+# has been served least during this busy period (ties: first come, first
+# served), so one user's burst -- an ensemble judgment, a bulk re-judge --
+# cannot starve everyone else's turns. The user is set per job with
+# acting_for().
+#
+# Calls also go through the 'gemini' circuit breakers (circuit_breaker.py):
+# while Gemini or the key is failing, a call fails at once with
+# CircuitOpenError instead of queueing, and is not retried.
+#
+# Counts are per process; with several workers sharing a key, divide the
+# limits by the number of workers.
+
+GEMINI_RPM_PER_KEY = float(os.environ.get('GEMINI_RPM_PER_KEY', '15'))
+GEMINI_TPM_PER_KEY = float(os.environ.get('GEMINI_TPM_PER_KEY', '1000000'))
+LLM_CALL_DEADLINE = float(os.environ.get('LLM_CALL_DEADLINE', '90'))      # seconds, queueing + retries + requests
+LLM_MAX_ATTEMPTS = int(os.environ.get('LLM_MAX_ATTEMPTS', '5'))
+LLM_BACKOFF_MAX = float(os.environ.get('LLM_BACKOFF_MAX', '20'))          # seconds between attempts
+LLM_REQUEST_TIMEOUT = float(os.environ.get('LLM_REQUEST_TIMEOUT', '60'))  # seconds per HTTP request
+LLM_MIN_ATTEMPT_BUDGET = float(os.environ.get('LLM_MIN_ATTEMPT_BUDGET', '3'))  # seconds an attempt needs at least
+
+TRANSIENT_STATUS = (408, 429, 500, 502, 503, 504)
+
+_current_caller = contextvars.ContextVar('llm_caller', default=(None, None))  # (user, debate mode)
+
+
+class LLMDeadlineExceeded(Exception):
+    """The call could not be completed (queueing plus retries) before its deadline."""
+
+
+@contextmanager
+def acting_for(user, mode=None):
+    """
+    LLM calls made inside this block are queued as 'user' (for fairness)
+    and logged as made for that user and debate mode (llm_accounting.py).
+    """
+    token = _current_caller.set((user, mode))
+    try:
+        yield
+    finally:
+        _current_caller.reset(token)
+
+
+def current_caller():
+    """(user, debate mode) set by the enclosing acting_for(), or (None, None)."""
+    return _current_caller.get()
+
+
+def is_rate_limited(e):
+    return isinstance(e, errors.APIError) and e.code == 429
+
+
+def is_transient(e):
+    """Worth retrying: rate limits, server errors, timeouts and dropped connections."""
+    if isinstance(e, errors.APIError):
+        return e.code in TRANSIENT_STATUS
+    return isinstance(e, (httpx.TimeoutException, httpx.TransportError, ConnectionError, TimeoutError))
+
+
+def breaker_outcome(e):
+    """How a failed Gemini request counts for the circuit breaker."""
+    if is_rate_limited(e):
+        return circuit_breaker.NEUTRAL  # the scheduler's business
+    if is_transient(e):
+        return circuit_breaker.FAILURE
+    return circuit_breaker.SUCCESS      # the service answered; the request was at fault
+
+
+def retry_after(e):
+    """Seconds the server asked us to wait (Retry-After header or RetryInfo), or None."""
+    response = getattr(e, 'response', None)
+    header = getattr(response, 'headers', {}).get('retry-after') if response is not None else None
+    if header:
+        try:
+            return float(header)
+        except ValueError:
+            pass
+    match = re.search(r"'retryDelay': '([\d.]+)s'", str(getattr(e, 'details', '')))
+    return float(match.group(1)) if match else None
+
+
+class KeyBucket:
+    """Requests and tokens available on one API key, refilled continuously."""
+
+    def __init__(self, rpm, tpm):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.requests = rpm
+        self.tokens = tpm
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.waiting = []   # tickets: (seq, user, tokens)
+        self.served = {}    # user -> calls granted while the queue was busy
+
+    def refill(self, now):
+        elapsed = now - self.updated
+        self.updated = now
+        self.requests = min(self.rpm, self.requests + elapsed * self.rpm / 60)
+        self.tokens = min(self.tpm, self.tokens + elapsed * self.tpm / 60)
+
+    def wait_time(self, tokens, now):
+        """Seconds until a call needing 'tokens' fits (0 if it fits now)."""
+        tokens = min(tokens, self.tpm)
+        wait = max(0.0, self.paused_until - now)
+        if self.requests < 1:
+            wait = max(wait, (1 - self.requests) * 60 / self.rpm)
+        if self.tokens < tokens:
+            wait = max(wait, (tokens - self.tokens) * 60 / self.tpm)
+        return wait
+
+    def next_ticket(self):
+        return min(self.waiting, key=lambda ticket: (self.served.get(ticket[1], 0), ticket[0]))
+
+
+class LLMScheduler:
+    """Per-key token buckets with fair queueing, retries and deadlines."""
+
+    def __init__(self, rpm, tpm, deadline, max_attempts, backoff_max, request_timeout, min_attempt_budget):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.deadline = deadline
+        self.request_timeout = request_timeout
+        self.min_attempt_budget = min_attempt_budget
+        self.max_attempts = max_attempts
+        self.backoff_max = backoff_max
+        self._buckets = {}  # key id -> KeyBucket
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self.calls = 0
+        self.queued = 0
+        self.wait_ms_total = 0.0
+        self.wait_ms_max = 0.0
+        self.retries = 0
+        self.rate_limited = 0
+        self.deadline_exceeded = 0
+        self.failures = 0
+
+    def set_limits(self, rpm=None, tpm=None):
+        """Changes the per-key limits, for new keys and for keys already in use."""
+        with self._cond:
+            if rpm is not None:
+                self.rpm = rpm
+            if tpm is not None:
+                self.tpm = tpm
+            now = time.monotonic()
+            for bucket in self._buckets.values():
+                bucket.refill(now)  # capacity built up so far counts at the old rate
+                bucket.rpm, bucket.tpm = self.rpm, self.tpm
+                bucket.requests = min(bucket.requests, bucket.rpm)
+                bucket.tokens = min(bucket.tokens, bucket.tpm)
+            self._cond.notify_all()
+
+    def _bucket(self, key_id):
+        bucket = self._buckets.get(key_id)
+        if bucket is None:
+            bucket = self._buckets[key_id] = KeyBucket(self.rpm, self.tpm)
+        return bucket
+
+    def acquire(self, key_id, tokens, user, deadline):
+        """Waits for this user's turn and for capacity on the key; raises LLMDeadlineExceeded."""
+        started = time.monotonic()
+        with self._cond:
+            bucket = self._bucket(key_id)
+            ticket = (next(self._seq), user, tokens)
+            bucket.waiting.append(ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    bucket.refill(now)
+                    wait = None
+                    if bucket.next_ticket() is ticket:
+                        wait = bucket.wait_time(tokens, now)
+                        if wait <= 0:
+                            bucket.requests -= 1
+                            bucket.tokens -= tokens
+                            bucket.served[user] = bucket.served.get(user, 0) + 1
+                            break
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        self.deadline_exceeded += 1
+                        raise LLMDeadlineExceeded(
+                            f"The AI service is busy (rate limit); no slot within {self.deadline:g}s.")
+                    self._cond.wait(timeout=min(remaining, wait) if wait is not None else remaining)
+            finally:
+                bucket.waiting.remove(ticket)
+                if not bucket.waiting:
+                    bucket.served.clear()  # busy period over
+                self._cond.notify_all()
+            waited_ms = (time.monotonic() - started) * 1000
+            self.calls += 1
+            if waited_ms >= 1:
+                self.queued += 1
+            self.wait_ms_total += waited_ms
+            self.wait_ms_max = max(self.wait_ms_max, waited_ms)
+
+    def settle(self, key_id, extra_tokens):
+        """Corrects a call's token estimate once the real usage is known."""
+        with self._cond:
+            self._bucket(key_id).tokens -= extra_tokens
+
+    def pause(self, key_id, seconds):
+        """Holds every call on the key (after a 429) and empties its request bucket."""
+        with self._cond:
+            bucket = self._bucket(key_id)
+            bucket.paused_until = max(bucket.paused_until, time.monotonic() + seconds)
+            bucket.requests = min(bucket.requests, 0)
+            self.rate_limited += 1
+
+    def call(self, key_id, fn, tokens=0, deadline=None, record=None):
+        """
+        Runs fn(timeout) once a slot on the key is free, retrying transient
+        errors until it succeeds, attempts run out or the deadline passes.
+        'timeout' (seconds) is what the request may take: LLM_REQUEST_TIMEOUT,
+        or less if the deadline is closer. The retries are counted on
+        'record' (an llm_accounting.CallRecord).
+        """
+        deadline_at = time.monotonic() + (deadline or self.deadline)
+        user, _ = current_caller()
+        backoff = wait_random_exponential(multiplier=0.5, max=self.backoff_max)
+
+        def attempt():
+            circuit_breaker.breakers.check('gemini', key_id)  # fail fast rather than queue
+            # The slot must leave time for the request itself.
+            self.acquire(key_id, tokens, user, deadline_at - self.min_attempt_budget)
+            timeout = min(self.request_timeout, deadline_at - time.monotonic())
+            if timeout < self.min_attempt_budget:
+                with self._cond:
+                    self.deadline_exceeded += 1
+                raise LLMDeadlineExceeded(
+                    f"The AI service did not answer within {deadline or self.deadline:g}s.")
+            try:
+                with circuit_breaker.guard('gemini', key_id, classify=breaker_outcome):
+                    return fn(timeout)
+            except Exception as e:
+                if is_rate_limited(e):
+                    self.pause(key_id, retry_after(e) or 1.0)
+                raise
+
+        def wait(retry_state):
+            return max(0.0, min(backoff(retry_state), deadline_at - time.monotonic()))
+
+        def stop(retry_state):
+            return (retry_state.attempt_number >= self.max_attempts
+                    or time.monotonic() >= deadline_at)
+
+        def before_sleep(retry_state):
+            with self._cond:
+                self.retries += 1
+            if record is not None:
+                record.retries += 1
+            print(f"LLM call failed ({retry_state.outcome.exception()}), retrying in "
+                  f"{retry_state.next_action.sleep:.1f}s (attempt {retry_state.attempt_number})")
+
+        try:
+            return Retrying(retry=retry_if_exception(is_transient), wait=wait, stop=stop,
+                            before_sleep=before_sleep, reraise=True)(attempt)
+        except Exception:
+            with self._cond:
+                self.failures += 1
+            raise
+
+    def stats(self):
+        with self._cond:
+            return {
+                'rpm_per_key': self.rpm,
+                'tpm_per_key': self.tpm,
+                'keys': len(self._buckets),
+                'waiting': sum(len(bucket.waiting) for bucket in self._buckets.values()),
+                'calls': self.calls,
+                'queued': self.queued,
+                'avg_wait_ms': round(self.wait_ms_total / self.calls, 1) if self.calls else 0.0,
+                'max_wait_ms': round(self.wait_ms_max, 1),
+                'retries': self.retries,
+                'rate_limited': self.rate_limited,
+                'deadline_exceeded': self.deadline_exceeded,
+                'failures': self.failures,
+            }
+
+
+scheduler = LLMScheduler(GEMINI_RPM_PER_KEY, GEMINI_TPM_PER_KEY, LLM_CALL_DEADLINE,
+                         LLM_MAX_ATTEMPTS, LLM_BACKOFF_MAX, LLM_REQUEST_TIMEOUT, LLM_MIN_ATTEMPT_BUDGET)
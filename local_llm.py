@@ -0,0 +1,222 @@
+import os
+import json
+import time
+import random
+import hashlib
+import threading
+import typing
+from types import SimpleNamespace
+
+from pydantic import BaseModel
+from google.genai import errors
+
+# --- Local LLM stand-in ---
+# With LLM_PROVIDER=local (see llm_client.py) every "Gemini" client is a
+# LocalClient: no network, no quota. It answers the same calls the app
+# makes -- models.generate_content and models.generate_content_stream --
+# with replies that depend only on the request:
+#   - a response_schema (the judge, judgment_schema.py) gets a valid JSON
+#     object for that schema, with a winner that agrees with the scores;
+#   - anything else (opponent replies, summaries) gets plain text, streamed
+#     in LOCAL_LLM_CHUNKS pieces.
+# Everything in front of the client -- scheduler, circuit breakers, chat
+# sessions, prompt cache, schema validation -- runs as it does for real,
+# so load tests and benchmarks measure the app rather than Gemini.
+#
+# Latency is drawn from a lognormal distribution (median and sigma below),
+# separately for the time to the first chunk and for whole responses.
+# Failures can be injected: LOCAL_LLM_ERROR_RATE of the calls fail with a
+# 503 and LOCAL_LLM_RATE_LIMIT_RATE with a 429 (asking for a retry after
+# LOCAL_LLM_RETRY_DELAY seconds). Latencies and failures come from one
+# random stream seeded with LOCAL_LLM_SEED, so a single-threaded run is
+# exactly reproducible.
+
+LOCAL_LLM_FIRST_CHUNK_MS = float(os.environ.get('LOCAL_LLM_FIRST_CHUNK_MS', '400'))   # median
+LOCAL_LLM_RESPONSE_MS = float(os.environ.get('LOCAL_LLM_RESPONSE_MS', '1500'))        # median
+LOCAL_LLM_LATENCY_SIGMA = float(os.environ.get('LOCAL_LLM_LATENCY_SIGMA', '0.4'))
+LOCAL_LLM_CHUNK_MS = float(os.environ.get('LOCAL_LLM_CHUNK_MS', '50'))                # between chunks
+LOCAL_LLM_CHUNKS = int(os.environ.get('LOCAL_LLM_CHUNKS', '8'))
+LOCAL_LLM_ERROR_RATE = float(os.environ.get('LOCAL_LLM_ERROR_RATE', '0'))
+LOCAL_LLM_RATE_LIMIT_RATE = float(os.environ.get('LOCAL_LLM_RATE_LIMIT_RATE', '0'))
+LOCAL_LLM_RETRY_DELAY = float(os.environ.get('LOCAL_LLM_RETRY_DELAY', '1'))           # seconds
+LOCAL_LLM_SEED = int(os.environ.get('LOCAL_LLM_SEED', '0'))
+
+WORDS = ("evidence", "however", "consider", "policy", "society", "example", "therefore", "cost",
+         "benefit", "long-term", "students", "research", "clearly", "risk", "fairness", "data",
+         "argument", "impact", "counterpoint", "history", "economy", "privacy", "trust", "growth")
+
+
+class LocalLLM:
+    """Shared state of every LocalClient: the random stream and the counters."""
+
+    def __init__(self, seed):
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.streams = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.latency_ms_total = 0.0
+
+    def _draw(self, median_ms):
+        """(latency in seconds, failure or None) for the next call."""
+        with self._lock:
+            latency = median_ms * self._rng.lognormvariate(0, LOCAL_LLM_LATENCY_SIGMA) / 1000 if median_ms > 0 else 0.0
+            roll = self._rng.random()
+            self.latency_ms_total += latency * 1000
+        if roll < LOCAL_LLM_RATE_LIMIT_RATE:
+            return latency, 429
+        if roll < LOCAL_LLM_RATE_LIMIT_RATE + LOCAL_LLM_ERROR_RATE:
+            return latency, 503
+        return latency, None
+
+    def _fail(self, code):
+        if code == 429:
+            self._count('rate_limited')
+            raise errors.ClientError(429, {'error': {
+                'code': 429, 'status': 'RESOURCE_EXHAUSTED', 'message': 'Injected rate limit (local LLM).',
+                'details': [{'@type': 'type.googleapis.com/google.rpc.RetryInfo',
+                             'retryDelay': f"{LOCAL_LLM_RETRY_DELAY:g}s"}],
+            }})
+        self._count('errors')
+        raise errors.ServerError(503, {'error': {
+            'code': 503, 'status': 'UNAVAILABLE', 'message': 'Injected failure (local LLM).',
+        }})
+
+    def generate(self, model, contents, config):
+        self._count('calls')
+        latency, failure = self._draw(LOCAL_LLM_RESPONSE_MS)
+        time.sleep(latency)
+        if failure:
+            self._fail(failure)
+        text = reply_text(model, contents, config)
+        return _response(text, contents)
+
+    def stream(self, model, contents, config):
+        self._count('calls')
+        self._count('streams')
+        latency, failure = self._draw(LOCAL_LLM_FIRST_CHUNK_MS)
+        text = reply_text(model, contents, config)
+        return self._chunks(text, contents, latency, failure)
+
+    def _chunks(self, text, contents, latency, failure):
+        time.sleep(latency)
+        if failure:
+            self._fail(failure)
+        words = text.split(' ')
+        size = max(1, -(-len(words) // max(1, LOCAL_LLM_CHUNKS)))
+        pieces = [' '.join(words[i:i + size]) + ' ' for i in range(0, len(words), size)]
+        pieces[-1] = pieces[-1].rstrip()
+        for i, piece in enumerate(pieces):
+            if i:
+                time.sleep(LOCAL_LLM_CHUNK_MS / 1000)
+            # Like Gemini, the last chunk carries the usage of the whole reply.
+            usage = _response(text, contents).usage_metadata if i == len(pieces) - 1 else None
+            yield SimpleNamespace(text=piece, usage_metadata=usage)
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'streams': self.streams,
+                'injected_errors': self.errors,
+                'injected_rate_limits': self.rate_limited,
+                'avg_latency_ms': round(self.latency_ms_total / self.calls, 1) if self.calls else 0.0,
+            }
+
+
+local_llm = LocalLLM(LOCAL_LLM_SEED)
+
+
+class LocalModels:
+    def generate_content(self, model, contents, config=None):
+        return local_llm.generate(model, contents, config)
+
+    def generate_content_stream(self, model, contents, config=None):
+        return local_llm.stream(model, contents, config)
+
+
+class LocalClient:
+    """Stands in for genai.Client (only what llm_client.py uses)."""
+
+    def __init__(self, api_key):
+        self.api_key = api_key
+        self.models = LocalModels()
+
+
+# --- Replies ---
+
+def _text_of(contents):
+    if isinstance(contents, str):
+        return contents
+    parts = []
+    for content in contents or []:
+        for part in getattr(content, 'parts', None) or []:
+            parts.append(getattr(part, 'text', None) or '')
+    return '\n'.join(parts)
+
+
+def _response(text, contents):
+    prompt_tokens, reply_tokens = len(_text_of(contents)) // 4, len(text) // 4
+    return SimpleNamespace(text=text, usage_metadata=SimpleNamespace(
+        prompt_token_count=prompt_tokens, candidates_token_count=reply_tokens,
+        total_token_count=prompt_tokens + reply_tokens))
+
+
+def _rng_for(model, contents, config):
+    """A random generator seeded by the request, so the same request gets the same reply."""
+    digest = hashlib.sha256()
+    digest.update(str(model).encode('utf-8'))
+    digest.update(_text_of(contents).encode('utf-8'))
+    digest.update(str(getattr(config, 'system_instruction', '') or '').encode('utf-8'))
+    return random.Random(digest.hexdigest())
+
+
+def _sentence(rng, words=12):
+    text = ' '.join(rng.choice(WORDS) for _ in range(words))
+    return text[0].upper() + text[1:] + '.'
+
+
+def reply_text(model, contents, config):
+    rng = _rng_for(model, contents, config)
+    schema = getattr(config, 'response_schema', None)
+    if isinstance(schema, type) and issubclass(schema, BaseModel):
+        return json.dumps(fake_object(schema, rng))
+    if getattr(config, 'response_mime_type', None) == 'application/json':
+        return json.dumps({'text': _sentence(rng)})
+    return ' '.join(_sentence(rng, rng.randint(10, 20)) for _ in range(rng.randint(3, 6)))
+
+
+def _fake_value(annotation, metadata, name, rng):
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return fake_object(annotation, rng)
+    if typing.get_origin(annotation) is typing.Literal:
+        return rng.choice(typing.get_args(annotation))
+    if annotation in (int, float):
+        low = next((m.ge for m in metadata if getattr(m, 'ge', None) is not None), 0)
+        high = next((m.le for m in metadata if getattr(m, 'le', None) is not None), 10)
+        value = rng.uniform(max(low, (low + high) / 3), high)
+        return int(value) if annotation is int else round(value * 2) / 2
+    return f"{name}: {_sentence(rng)}"
+
+
+def fake_object(schema, rng):
+    """A valid instance of the pydantic model 'schema', as a dict."""
+    data = {name: _fake_value(field.annotation, field.metadata, name, rng)
+            for name, field in schema.model_fields.items()}
+    # A judgment's winner follows its scores, as a real judge's would.
+    scores, reasoning = data.get('scores'), data.get('reasoning')
+    if isinstance(scores, dict) and isinstance(reasoning, dict) and 'overallWinner' in reasoning:
+        totals = {side: sum(v for v in (scores.get(side) or {}).values() if isinstance(v, (int, float)))
+                  for side in ('User', 'AI')}
+        reasoning['overallWinner'] = ('User' if totals['User'] > totals['AI'] else
+                                      'AI' if totals['AI'] > totals['User'] else 'Draw')
+    return data
+
+
+def stats():
+    return local_llm.stats()
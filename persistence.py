@@ -0,0 +1,295 @@
+import os
+import json
+import time
+import glob
+import uuid
+import queue
+import atexit
+import sqlite3
+import threading
+
+import psycopg2
+
+import repository
+from db_pool import BASE_DIR, PoolTimeoutError
+
+# --- Write-behind persistence ---
+# Finished debates, stats updates and LLM call records are handed to a background thread
+# instead of being written inside the Dash callback. The thread batches
+# whatever is queued into one transaction (repository.write_batch), retries
+# transient database errors with backoff, and never loses a job:
+#   * if the in-memory queue is full, the job is appended to a journal file;
+#   * if the database stays down, the batch is appended to the journal;
+#   * on shutdown, anything not yet written is appended to the journal.
+# Journals are replayed when the worker is idle and when a process starts.
+# Jobs are plain JSON dicts: {'kind': 'debate' | 'stats' | 'llm_call', 'payload': {...}}.
+
+QUEUE_MAX_SIZE = int(os.environ.get('PERSIST_QUEUE_SIZE', '1000'))
+BATCH_SIZE = int(os.environ.get('PERSIST_BATCH_SIZE', '50'))
+MAX_ATTEMPTS = int(os.environ.get('PERSIST_MAX_ATTEMPTS', '5'))
+RETRY_BASE_DELAY = float(os.environ.get('PERSIST_RETRY_DELAY', '0.5'))        # seconds, doubled per attempt
+DRAIN_TIMEOUT = float(os.environ.get('PERSIST_DRAIN_TIMEOUT', '20'))          # keep below gunicorn's graceful_timeout
+JOURNAL_REPLAY_INTERVAL = float(os.environ.get('PERSIST_REPLAY_INTERVAL', '30'))
+JOURNAL_DIR = os.environ.get('PERSIST_JOURNAL_DIR') or os.path.join(BASE_DIR, 'persist_journal')
+
+# Errors worth retrying: the database (or a pooled connection) is unavailable
+# or busy. Anything else means the job itself is bad.
+TRANSIENT_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError,
+                    sqlite3.OperationalError, PoolTimeoutError)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+class WriteBehindQueue:
+    """Bounded job queue drained by one background writer thread per process."""
+
+    def __init__(self, journal_dir, max_size, batch_size):
+        self.journal_dir = journal_dir
+        self.batch_size = batch_size
+        self._queue = queue.Queue(maxsize=max_size)
+        self._journal_lock = threading.Lock()
+        self._journal_path = os.path.join(journal_dir, f"pending-{os.getpid()}.jsonl")
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_replay = 0.0
+
+        # --- Counters (read via stats()) ---
+        self._stats_lock = threading.Lock()
+        self.enqueued = 0
+        self.written = 0
+        self.batches = 0
+        self.retries = 0
+        self.spilled = 0
+        self.replayed = 0
+        self.failed = 0
+        self.flush_time_total = 0.0
+        self.flush_time_max = 0.0
+        self.flush_time_last = 0.0
+
+    # --- Producer side (Dash callbacks) ---
+    def submit(self, kind, payload):
+        """Queues one job and returns immediately."""
+        job = {'kind': kind, 'payload': payload}
+        with self._stats_lock:
+            self.enqueued += 1
+        if self._stop.is_set():
+            self._spill([job])
+            return
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            print(f"WARNING: Persistence queue full ({self._queue.maxsize}); journaling {kind} job.")
+            self._spill([job])
+
+    # --- Worker thread ---
+    def start(self):
+        os.makedirs(self.journal_dir, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name='persistence-writer', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        self._replay_journals()
+        while True:
+            try:
+                job = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                if self._stop.is_set():
+                    return
+                if time.monotonic() - self._last_replay >= JOURNAL_REPLAY_INTERVAL:
+                    self._replay_journals()
+                continue
+
+            batch = [job]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._flush(batch)
+
+    def _flush(self, batch):
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            started = time.perf_counter()
+            try:
+                repository.write_batch(batch)
+            except TRANSIENT_ERRORS as e:
+                print(f"Persistence: database unavailable (attempt {attempt}/{MAX_ATTEMPTS}): {e}")
+                with self._stats_lock:
+                    self.retries += 1
+                if attempt < MAX_ATTEMPTS:
+                    time.sleep(RETRY_BASE_DELAY * 2 ** (attempt - 1))
+                continue
+            except Exception as e:
+                if len(batch) > 1:
+                    # One bad job must not sink the rest: write them one by one.
+                    for job in batch:
+                        self._flush([job])
+                    return
+                print(f"CRITICAL ERROR: Could not persist {batch[0]['kind']} job: {e}")
+                with self._stats_lock:
+                    self.failed += 1
+                self._spill(batch, prefix='failed')
+                return
+
+            elapsed = time.perf_counter() - started
+            with self._stats_lock:
+                self.written += len(batch)
+                self.batches += 1
+                self.flush_time_total += elapsed
+                self.flush_time_max = max(self.flush_time_max, elapsed)
+                self.flush_time_last = elapsed
+            return
+
+        # Still failing: keep the jobs on disk for the next replay.
+        self._spill(batch)
+
+    # --- Journal ---
+    def _spill(self, jobs, prefix='pending'):
+        """Appends jobs to this process's journal ('failed' jobs are never replayed)."""
+        path = self._journal_path if prefix == 'pending' else \
+            os.path.join(self.journal_dir, f"failed-{os.getpid()}.jsonl")
+        with self._journal_lock:
+            os.makedirs(self.journal_dir, exist_ok=True)
+            with open(path, 'a', encoding='utf-8') as f:
+                for job in jobs:
+                    f.write(json.dumps(job) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+        if prefix == 'pending':
+            with self._stats_lock:
+                self.spilled += len(jobs)
+
+    def _claim_journals(self):
+        """
+        Renames replayable journals to a name only this process uses: our own
+        pending file, plus those left behind by processes that have exited.
+        """
+        claimed = []
+        for path in glob.glob(os.path.join(self.journal_dir, '*.jsonl')):
+            name = os.path.basename(path)
+            kind, _, rest = name.partition('-')
+            if kind not in ('pending', 'replaying'):
+                continue
+            try:
+                pid = int(rest.split('-')[0].split('.')[0])
+            except ValueError:
+                continue
+            if pid != os.getpid() and _pid_alive(pid):
+                continue
+            target = os.path.join(self.journal_dir, f"replaying-{os.getpid()}-{uuid.uuid4().hex}.jsonl")
+            with self._journal_lock:
+                try:
+                    os.rename(path, target)  # atomic: only one process wins
+                except OSError:
+                    continue
+            claimed.append(target)
+        return claimed
+
+    def _replay_journals(self):
+        self._last_replay = time.monotonic()
+        if not os.path.isdir(self.journal_dir):
+            return
+        for path in self._claim_journals():
+            print(f"Persistence: replaying journal {os.path.basename(path)}")
+            with open(path, encoding='utf-8') as f:
+                batch = []
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        batch.append(json.loads(line))
+                    except ValueError:
+                        continue  # torn write from a crash
+                    if len(batch) >= self.batch_size:
+                        self._replay_batch(batch)
+                        batch = []
+                if batch:
+                    self._replay_batch(batch)
+            os.remove(path)
+
+    def _replay_batch(self, batch):
+        with self._stats_lock:
+            self.replayed += len(batch)
+        self._flush(batch)
+
+    # --- Shutdown ---
+    def shutdown(self, timeout):
+        """
+        Stops accepting work, waits up to 'timeout' seconds for the queue to
+        drain, and journals whatever is left.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        leftover = []
+        while True:
+            try:
+                leftover.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if leftover:
+            print(f"Persistence: journaling {len(leftover)} unwritten jobs on shutdown.")
+            self._spill(leftover)
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'queue_depth': self._queue.qsize(),
+                'queue_max_size': self._queue.maxsize,
+                'enqueued': self.enqueued,
+                'written': self.written,
+                'batches': self.batches,
+                'retries': self.retries,
+                'spilled': self.spilled,
+                'replayed': self.replayed,
+                'failed': self.failed,
+                'flush_latency_avg_ms': round(1000 * self.flush_time_total / self.batches, 2) if self.batches else 0.0,
+                'flush_latency_max_ms': round(1000 * self.flush_time_max, 2),
+                'flush_latency_last_ms': round(1000 * self.flush_time_last, 2),
+                'worker_alive': bool(self._thread and self._thread.is_alive()),
+            }
+
+
+# --- Process-wide queue ---
+_queue = None
+_queue_pid = None
+_queue_lock = threading.Lock()
+
+
+def get_queue():
+    """The queue for this process, started on first use (and again after a fork)."""
+    global _queue, _queue_pid
+    if _queue is None or _queue_pid != os.getpid():
+        with _queue_lock:
+            if _queue is None or _queue_pid != os.getpid():
+                _queue = WriteBehindQueue(JOURNAL_DIR, QUEUE_MAX_SIZE, BATCH_SIZE)
+                _queue.start()
+                _queue_pid = os.getpid()
+    return _queue
+
+
+def submit(kind, payload):
+    get_queue().submit(kind, payload)
+
+
+def queue_stats():
+    return get_queue().stats()
+
+
+def shutdown_queue(timeout=DRAIN_TIMEOUT):
+    """Drain (or journal) pending writes. Called from gunicorn's worker_exit hook."""
+    if _queue is not None and _queue_pid == os.getpid():
+        _queue.shutdown(timeout)
+
+
+# Covers 'python run.py' and any exit that skips the gunicorn hook.
+atexit.register(shutdown_queue)
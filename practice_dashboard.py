@@ -5,6 +5,9 @@ from components import header
 practice_dashboard_layout = html.Div(className='layout-wrapper', children=[
     header,
     html.Div(className='main-container', children=[
+        # Re-renders the page once the judgment lands (enabled by 'render_practice_dashboard' while it is pending)
+        dcc.Interval(id='practice-dashboard-poll', interval=1000, disabled=True),
+
         # This card is wider to accommodate the gauges and table
         html.Div(className='card dashboard-card', children=[
             
@@ -9,6 +9,9 @@ practice_layout = html.Div(className='layout-wrapper', children=[
         # This dcc.Store must be outside the hidden div so it always loads
         dcc.Store(id='stt-output-store'),
         dcc.Store(id='timer-store'),
+        # AI replies run as background jobs: request (job id) -> assets/opponent_stream.js -> result
+        dcc.Store(id='opponent-stream-request'),
+        dcc.Store(id='opponent-stream-result'),
 
         # --- POPUP ADDED HERE ---
         # This hidden dialog will be triggered by callbacks if API keys are missing
@@ -44,7 +47,7 @@ practice_layout = html.Div(className='layout-wrapper', children=[
                     dcc.Input(
                         id='debate-turns-input', type='number',
                         placeholder='Number of turns (e.g., 3)',
-                        min=1, max=10, step=1,
+                        min=1, max=50, step=1,
                         className='input-field'
                     ),
                     html.Button('Start Debate', id='start-debate-button', n_clicks=0, className='btn btn-primary')
@@ -0,0 +1,220 @@
+import os
+import time
+import uuid
+import hashlib
+import threading
+from contextlib import contextmanager
+
+from google.genai import types, errors
+
+# --- Prompt-prefix caching ---
+# The judge rubric and the opponent's rules are fixed text sent with every
+# request. With Gemini explicit context caching they are uploaded once per
+# API key (and model) as a CachedContent, and requests refer to it by name
+# instead of re-sending it: fewer input tokens and a shorter time to first
+# token. Handles are kept here and their TTL is extended shortly before it
+# runs out, so an active key never pays for the upload twice.
+#
+# Caching is an optimisation only. If the cache cannot be created (prompt
+# below the model's minimum cacheable size, a model without caching, no
+# permission) the key/model is remembered as uncacheable for a while and
+# the request simply sends the prompt as its system instruction. If a cache
+# disappears on the server side, the request is retried without it.
+#
+# PROMPT_CACHE_BACKEND selects where caches live:
+#   gemini - Gemini's caches API (default)
+#   local  - an in-process stand-in with the same behaviour (TTL, expiry,
+#            minimum size), so this can be exercised offline
+#   off    - never cache
+# With LLM_PROVIDER=local (llm_client.py) the default is local.
+
+PROMPT_CACHE_BACKEND = os.environ.get('PROMPT_CACHE_BACKEND',
+                                      'local' if os.environ.get('LLM_PROVIDER') == 'local' else 'gemini')
+PROMPT_CACHE_TTL = int(os.environ.get('PROMPT_CACHE_TTL', '3600'))                # seconds
+PROMPT_CACHE_REFRESH_MARGIN = int(os.environ.get('PROMPT_CACHE_REFRESH_MARGIN', '300'))
+PROMPT_CACHE_RETRY_AFTER = int(os.environ.get('PROMPT_CACHE_RETRY_AFTER', '900'))  # after a failed create
+LOCAL_CACHE_MIN_CHARS = int(os.environ.get('PROMPT_CACHE_LOCAL_MIN_CHARS', '0'))
+
+
+class CacheUnavailable(Exception):
+    """The cached content is gone (expired or deleted); send the prompt instead."""
+
+
+def is_cache_error(e):
+    """True if a request failed because of its cached content."""
+    if isinstance(e, CacheUnavailable):
+        return True
+    return (isinstance(e, errors.APIError) and e.code in (400, 403, 404)
+            and 'cache' in str(e).lower())
+
+
+class GeminiCacheBackend:
+    """Caches stored by Gemini (client.caches)."""
+
+    def create(self, client, model, system_prompt, ttl):
+        cached = client.caches.create(model=model, config=types.CreateCachedContentConfig(
+            system_instruction=system_prompt, ttl=f"{ttl}s", display_name='debate-prompt-prefix'
+        ))
+        return cached.name
+
+    def refresh(self, client, name, ttl):
+        client.caches.update(name=name, config=types.UpdateCachedContentConfig(ttl=f"{ttl}s"))
+
+    def request_config(self, name, system_prompt, extra):
+        return types.GenerateContentConfig(cached_content=name, **extra)
+
+
+class LocalCacheBackend:
+    """
+    Offline stand-in for the caches API. Caches live in this process and
+    expire like Gemini's; requests get the stored prompt back as their
+    system instruction.
+    """
+
+    def __init__(self, min_chars=0):
+        self.min_chars = min_chars
+        self._caches = {}  # name -> (system_prompt, expires_at)
+        self._lock = threading.Lock()
+
+    def create(self, client, model, system_prompt, ttl):
+        if len(system_prompt) < self.min_chars:
+            raise ValueError(f"Cached content is too small ({len(system_prompt)} < {self.min_chars} chars).")
+        name = f"cachedContents/local-{uuid.uuid4().hex}"
+        with self._lock:
+            self._caches[name] = (system_prompt, time.time() + ttl)
+        return name
+
+    def _get(self, name):
+        with self._lock:
+            entry = self._caches.get(name)
+            if entry is None or entry[1] <= time.time():
+                self._caches.pop(name, None)
+                raise CacheUnavailable(f"{name} not found (expired or deleted).")
+            return entry
+
+    def refresh(self, client, name, ttl):
+        system_prompt, _ = self._get(name)
+        with self._lock:
+            self._caches[name] = (system_prompt, time.time() + ttl)
+
+    def request_config(self, name, system_prompt, extra):
+        cached_prompt, _ = self._get(name)
+        return types.GenerateContentConfig(system_instruction=cached_prompt, **extra)
+
+
+class PromptCache:
+    """Cache names per (API key, model, prompt), with TTL refresh and negative caching."""
+
+    def __init__(self, backend, ttl, refresh_margin, retry_after):
+        self.backend = backend
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self.retry_after = retry_after
+        self._entries = {}  # (key id, model, prompt hash) -> {'name', 'expires_at'} or {'name': None, 'retry_at'}
+        self._locks = {}    # cache key -> [lock, users]; a slow create only blocks its own key
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.creates = 0
+        self.refreshes = 0
+        self.failures = 0
+        self.fallbacks = 0
+        self.invalidations = 0
+
+    @contextmanager
+    def _entry_lock(self, cache_key):
+        """Holds the entry's lock; it is dropped again once no lookup is using it."""
+        with self._lock:
+            holder = self._locks.setdefault(cache_key, [threading.Lock(), 0])
+            holder[1] += 1
+        try:
+            with holder[0]:
+                yield
+        finally:
+            with self._lock:
+                holder[1] -= 1
+                if holder[1] == 0:
+                    del self._locks[cache_key]
+
+    def _evict_expired(self, now):
+        """Drops entries past their expiry (or retry time) that no lookup is using."""
+        with self._lock:
+            for cache_key, entry in list(self._entries.items()):
+                if cache_key not in self._locks and entry.get('expires_at', entry.get('retry_at')) <= now:
+                    del self._entries[cache_key]
+
+    def lookup(self, client, key_id, model, system_prompt):
+        """The cache name to use for this prompt, or None to send the prompt itself."""
+        if self.backend is None:
+            return None
+        cache_key = (key_id, model, hashlib.sha256(system_prompt.encode('utf-8')).hexdigest())
+        with self._entry_lock(cache_key):
+            now = time.time()
+            entry = self._entries.get(cache_key)
+            if entry is not None and entry['name'] is None:
+                if now < entry['retry_at']:
+                    self._count('fallbacks')
+                    return None
+                entry = None
+            if entry is not None and entry['expires_at'] - now > self.refresh_margin:
+                self._count('hits')
+                return entry['name']
+            if entry is not None and entry['expires_at'] > now:
+                try:
+                    self.backend.refresh(client, entry['name'], self.ttl)
+                    entry['expires_at'] = now + self.ttl
+                    self._count('refreshes')
+                    return entry['name']
+                except Exception as e:
+                    print(f"Prompt cache: refresh failed, creating a new cache: {e}")
+            self._evict_expired(now)
+            try:
+                name = self.backend.create(client, model, system_prompt, self.ttl)
+            except Exception as e:
+                print(f"Prompt cache: cannot cache this prompt for {model}, sending it uncached: {e}")
+                self._entries[cache_key] = {'name': None, 'retry_at': now + self.retry_after}
+                self._count('failures')
+                self._count('fallbacks')
+                return None
+            self._entries[cache_key] = {'name': name, 'expires_at': now + self.ttl}
+            self._count('creates')
+            return name
+
+    def invalidate(self, name):
+        """Forgets a cache the server no longer has (the next lookup creates a new one)."""
+        with self._lock:
+            for cache_key, entry in list(self._entries.items()):
+                if entry.get('name') == name:
+                    del self._entries[cache_key]
+            self.invalidations += 1
+
+    def request_config(self, name, system_prompt, extra):
+        return self.backend.request_config(name, system_prompt, extra)
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'backend': PROMPT_CACHE_BACKEND,
+                'entries': sum(1 for entry in self._entries.values() if entry['name']),
+                'hits': self.hits,
+                'creates': self.creates,
+                'refreshes': self.refreshes,
+                'failures': self.failures,
+                'fallbacks': self.fallbacks,
+                'invalidations': self.invalidations,
+            }
+
+
+def _make_backend(kind):
+    if kind == 'off':
+        return None
+    if kind == 'local':
+        return LocalCacheBackend(LOCAL_CACHE_MIN_CHARS)
+    return GeminiCacheBackend()
+
+
+prompt_cache = PromptCache(_make_backend(PROMPT_CACHE_BACKEND), PROMPT_CACHE_TTL,
+                           PROMPT_CACHE_REFRESH_MARGIN, PROMPT_CACHE_RETRY_AFTER)
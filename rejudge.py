@@ -0,0 +1,255 @@
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import itertools
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import pytz
+from dotenv import load_dotenv
+
+# --- Bulk re-judging of debate_history ---
+# After DEBATE_JUDGE_PROMPT or the judge model changes, re-scores every
+# finished debate with the current judge and stores the new judgments in
+# rejudged_results under the current judge version (a hash of the judge
+# prompts plus the judge model or ensemble). final_results itself is not
+# touched.
+#
+# Debates are read in id order and their transcripts rebuilt from
+# debate_turns; the whole transcript is judged (not the rolling summary the
+# live judge may have used). Each result is committed as soon as it is
+# judged and debates that already have one are skipped, so an interrupted
+# run simply continues where it stopped. Failed judgments are not stored and
+# are tried again by the next run.
+#
+# Judge calls are spread over the API keys in $REJUDGE_API_KEYS (comma
+# separated), each with at most --concurrency calls in flight and paced to
+# --rpm requests per minute, so the run stays just under each key's rate
+# limit. Identical transcripts are judged once (judgment_cache.py).
+#
+# At the end user_stats is rebuilt from the practice debates, using the new
+# judgment where there is one and the original otherwise. Only users with
+# at least one judged practice debate are updated; stats of debates no
+# longer in debate_history (e.g. archived with export_history.py --delete)
+# are lost. Use --skip-stats to leave user_stats alone.
+#
+#   REJUDGE_API_KEYS=key1,key2 python rejudge.py --rpm 15 --concurrency 4
+
+load_dotenv()  # DATABASE_URL, same as run.py
+
+from db_init import initialize_database
+from repository import (STAT_SKILLS, count_debates_to_rejudge, list_debates_to_rejudge,
+                        store_rejudged_result, iter_practice_results, set_user_stats)
+from callbacks import get_judgment, judge_ensemble, judge_version
+from llm_scheduler import scheduler
+
+PROGRESS_INTERVAL = 10  # seconds
+
+
+class KeyPacer:
+    """One API key: at most 'concurrency' judgments at a time, calls spaced to 'rpm'."""
+
+    def __init__(self, api_key, rpm, concurrency):
+        self.api_key = api_key
+        self.interval = 60.0 / rpm
+        self._slots = threading.Semaphore(concurrency)
+        self._lock = threading.Lock()
+        self._next_at = time.monotonic()
+
+    def acquire(self, calls):
+        """Blocks until a judgment making 'calls' requests may start on this key."""
+        self._slots.acquire()
+        with self._lock:
+            now = time.monotonic()
+            start_at = max(now, self._next_at)
+            self._next_at = start_at + calls * self.interval
+        time.sleep(max(0.0, start_at - now))
+
+    def release(self):
+        self._slots.release()
+
+
+def rejudge_one(row, pacer, version, calls):
+    """Judges one debate and stores the result. Returns None, or the error."""
+    debate_state = json.loads(row['debate_state'] or '{}')
+    # Judge the full transcript, not the summary the live debate ended with.
+    debate_state.pop('context', None)
+    pacer.acquire(calls)
+    try:
+        judgment = get_judgment(debate_state, row['chat_history'], pacer.api_key)
+    finally:
+        pacer.release()
+    if 'error' in judgment:
+        return judgment['error']
+    store_rejudged_result(row['id'], version, json.dumps(judgment), str(datetime.now(pytz.utc)))
+    return None
+
+
+def _format_eta(seconds):
+    if seconds is None:
+        return '?'
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m" if hours else f"{minutes}m{seconds:02d}s"
+
+
+def rejudge(api_keys, rpm, concurrency, batch_size, limit=None):
+    """Re-judges every debate without a result for the current judge version."""
+    version = judge_version()
+    calls = len(judge_ensemble.judges) if judge_ensemble.enabled else 1
+    total = count_debates_to_rejudge(version)
+    if limit:
+        total = min(total, limit)
+    if not total:
+        print(f"Every finished debate already has a result for judge version {version}.")
+        return version, 0, 0
+
+    pacers = [KeyPacer(key, rpm, concurrency) for key in api_keys]
+    workers = len(pacers) * concurrency
+    print(f"Re-judging {total} debates with judge version {version}: {len(pacers)} keys, "
+          f"{concurrency} in flight and {rpm} requests/min per key ({calls} per judgment).")
+
+    started = time.perf_counter()
+    last_report = started
+    judged = failed = submitted = 0
+    after_id = 0
+    key_cycle = itertools.cycle(pacers)
+    in_flight = {}  # future -> debate id
+
+    def collect(done):
+        nonlocal judged, failed
+        for future in done:
+            debate_id = in_flight.pop(future)
+            try:
+                error = future.result()
+            except Exception as e:
+                error = str(e)
+            if error:
+                failed += 1
+                print(f"  debate {debate_id}: {error}")
+            else:
+                judged += 1
+
+    def report(force=False):
+        nonlocal last_report
+        now = time.perf_counter()
+        if not force and now - last_report < PROGRESS_INTERVAL:
+            return
+        last_report = now
+        finished = judged + failed
+        rate = finished / (now - started) if now > started else 0
+        eta = (total - finished) / rate if rate else None
+        print(f"  {finished}/{total} ({judged} judged, {failed} failed) "
+              f"{rate * 60:,.1f} debates/min, ETA {_format_eta(eta)}")
+
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='rejudge')
+    try:
+        while submitted < total:
+            rows = list_debates_to_rejudge(version, after_id, batch_size)
+            if not rows:
+                break
+            for row in rows[:total - submitted]:
+                # Keep the queue short so memory does not grow with the corpus.
+                while len(in_flight) >= workers * 2:
+                    done, _ = wait(in_flight, timeout=PROGRESS_INTERVAL, return_when=FIRST_COMPLETED)
+                    collect(done)
+                    report()
+                in_flight[pool.submit(rejudge_one, row, next(key_cycle), version, calls)] = row['id']
+                submitted += 1
+            after_id = rows[-1]['id']
+        while in_flight:
+            done, _ = wait(in_flight, timeout=PROGRESS_INTERVAL, return_when=FIRST_COMPLETED)
+            collect(done)
+            report()
+    except KeyboardInterrupt:
+        print("\nInterrupted; finishing the judgments in flight. Re-run to continue.")
+        pool.shutdown(wait=True, cancel_futures=True)
+        collect([future for future in in_flight if future.done() and not future.cancelled()])
+        report(force=True)
+        raise
+    pool.shutdown()
+
+    report(force=True)
+    elapsed = time.perf_counter() - started
+    print(f"Re-judged {judged} debates in {elapsed:.1f}s; {failed} failed (re-run to retry them).")
+    return version, judged, failed
+
+
+def _score(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def rebuild_user_stats(version):
+    """
+    Recomputes user_stats from the practice debates in id order, with the
+    same rules as the live update (callbacks.update_user_stats): malformed
+    judgments are skipped and a missing score leaves the average unchanged.
+    """
+    stats = {}
+    for row in iter_practice_results(version):
+        try:
+            judgment = json.loads(row['rejudged'] or row['final_results'] or 'null')
+        except (TypeError, ValueError):
+            continue
+        if not isinstance(judgment, dict) or 'scores' not in judgment or 'reasoning' not in judgment:
+            continue
+        winner = judgment['reasoning'].get('overallWinner', 'Draw')
+        outcome = 'debates_won' if winner == 'User' else 'debates_lost' if winner == 'AI' else 'debates_drawn'
+        entry = stats.setdefault(row['username'], dict(
+            {'debates_won': 0, 'debates_lost': 0, 'debates_drawn': 0},
+            **{'avg_' + skill: 0.0 for skill in STAT_SKILLS}
+        ))
+        count = entry['debates_won'] + entry['debates_lost'] + entry['debates_drawn']
+        user_scores = (judgment['scores'] or {}).get('User') or {}
+        for skill in STAT_SKILLS:
+            score = _score(user_scores.get(skill))
+            average = entry['avg_' + skill]
+            entry['avg_' + skill] = (average * count + (average if score is None else score)) / (count + 1)
+        entry[outcome] += 1
+
+    updated = set_user_stats(stats)
+    print(f"Rebuilt user_stats for {updated} users from judge version {version}.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-judge finished debates with the current judge.")
+    parser.add_argument('--keys-env', default='REJUDGE_API_KEYS',
+                        help="environment variable holding comma-separated Google API keys")
+    parser.add_argument('--rpm', type=float, default=15, help="requests per minute allowed per key")
+    parser.add_argument('--concurrency', type=int, default=4, help="judgments in flight per key")
+    parser.add_argument('--batch-size', type=int, default=200, help="debates read per query")
+    parser.add_argument('--limit', type=int, help="stop after this many debates")
+    parser.add_argument('--skip-stats', action='store_true', help="do not rebuild user_stats afterwards")
+    args = parser.parse_args()
+
+    api_keys = [key.strip() for key in os.environ.get(args.keys_env, '').split(',') if key.strip()]
+    if not api_keys:
+        sys.exit(f"No API keys: set {args.keys_env} to one or more comma-separated Google API keys.")
+
+    initialize_database()  # makes sure rejudged_results exists
+    scheduler.set_limits(rpm=args.rpm)  # the per-key limit every LLM call is held to (llm_scheduler.py)
+    try:
+        version, judged, failed = rejudge(api_keys, args.rpm, args.concurrency, args.batch_size, args.limit)
+    except KeyboardInterrupt:
+        sys.exit(1)
+    except Exception as e:
+        print(f"An error occurred while re-judging: {e}", file=sys.stderr)
+        print("Judged debates are saved; re-run to continue.", file=sys.stderr)
+        sys.exit(1)
+
+    if not args.skip_stats:
+        try:
+            rebuild_user_stats(version)
+        except Exception as e:
+            print(f"An error occurred while rebuilding user_stats: {e}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1285 @@
+import io
+import os
+import re
+import csv
+import json
+import time
+import sqlite3
+import threading
+
+import psycopg2
+
+from db_pool import db_connection, is_postgres
+
+# --- Data Access Layer ---
+# This is the only module that runs SQL against users, user_stats and
+# debate_history. Each statement is written once (with '?' placeholders)
+# and rendered for both dialects when this module is imported, so call
+# sites never rebuild SQL strings per request. The hot queries are run as
+# server-side prepared statements on PostgreSQL (PREPARE once per pooled
+# connection, then EXECUTE), which skips parse/plan on every call.
+
+# Set DB_PREPARED_STATEMENTS=0 when running behind a transaction-mode
+# pooler (e.g. PgBouncer) that cannot keep per-session prepared statements.
+USE_PREPARED_STATEMENTS = os.environ.get('DB_PREPARED_STATEMENTS', '1') != '0'
+
+# Raised by create_user() when the username is already taken.
+INTEGRITY_ERRORS = (sqlite3.IntegrityError, psycopg2.IntegrityError)
+
+STAT_SKILLS = ['logicalConsistency', 'evidenceAndExamples', 'clarityAndConcision',
+               'rebuttalEffectiveness', 'overallPersuasiveness']
+
+
+class Statement:
+    """A single SQL statement, pre-rendered for SQLite and PostgreSQL."""
+
+    def __init__(self, name, sql, prepare=False, pg_returning=None):
+        self.name = name
+        self.prepare = prepare
+        self.param_count = sql.count('?')
+
+        # SQLite uses the '?' paramstyle as written (and cur.lastrowid for ids).
+        self.sqlite_sql = sql
+        if pg_returning:
+            sql = f"{sql.rstrip()} RETURNING {pg_returning}"
+        # psycopg2 uses '%s' for plain (client-side) parameter binding.
+        self.pg_sql = sql.replace('?', '%s')
+
+        # Server-side prepared variant: PREPARE name AS ... $1, $2 ...
+        numbered = sql
+        for i in range(1, self.param_count + 1):
+            numbered = numbered.replace('?', f'${i}', 1)
+        self.pg_prepare_sql = f"PREPARE {name} AS {numbered}"
+        args = ', '.join(['%s'] * self.param_count)
+        self.pg_execute_sql = f"EXECUTE {name} ({args})" if self.param_count else f"EXECUTE {name}"
+
+
+# --- Statements (built once at import) ---
+# The avg_* columns are declared camelCase in SQLite but folded to lowercase
+# by PostgreSQL, so they are always selected with lowercase aliases.
+SQL_INSERT_USER = Statement('insert_user', """
+    INSERT INTO users (name, username, password) VALUES (?, ?, ?)
+""")
+
+SQL_INSERT_USER_STATS = Statement('insert_user_stats', """
+    INSERT INTO user_stats (
+        username, debates_won, debates_lost, debates_drawn,
+        avg_logicalconsistency, avg_evidenceandexamples,
+        avg_clarityandconcision, avg_rebuttaleffectiveness,
+        avg_overallpersuasiveness
+    ) VALUES (?, 0, 0, 0, 0.0, 0.0, 0.0, 0.0, 0.0)
+""")
+
+SQL_SELECT_PASSWORD = Statement('select_password', """
+    SELECT password FROM users WHERE username = ?
+""", prepare=True)
+
+# --- Atomic stats update ---
+# One UPDATE bumps the right win/loss/draw counter and folds the new scores
+# into every running mean, using the row's *old* values on the right-hand
+# side. No read-modify-write in Python, so two debates finishing at the same
+# time for the same user cannot overwrite each other.
+# Params: won, lost, drawn (0/1 each), then one score per STAT_SKILLS entry
+# (None keeps the current average), then username.
+_STATS_TOTAL = "(COALESCE(debates_won, 0) + COALESCE(debates_lost, 0) + COALESCE(debates_drawn, 0))"
+_STATS_AVG_UPDATES = ",\n        ".join(
+    f"avg_{skill.lower()} = (COALESCE(avg_{skill.lower()}, 0.0) * {_STATS_TOTAL}"
+    f" + COALESCE(?, avg_{skill.lower()}, 0.0)) / ({_STATS_TOTAL} + 1)"
+    for skill in STAT_SKILLS
+)
+_STATS_INCREMENT_SQL = f"""
+    UPDATE user_stats SET
+        debates_won = COALESCE(debates_won, 0) + ?,
+        debates_lost = COALESCE(debates_lost, 0) + ?,
+        debates_drawn = COALESCE(debates_drawn, 0) + ?,
+        {_STATS_AVG_UPDATES}
+    WHERE username = ?
+"""
+_STATS_COLUMNS = ",\n           ".join(
+    ['username', 'debates_won', 'debates_lost', 'debates_drawn'] +
+    [f"avg_{skill.lower()} AS avg_{skill.lower()}" for skill in STAT_SKILLS]
+)
+
+SQL_SELECT_USER_STATS = Statement('select_user_stats', f"""
+    SELECT {_STATS_COLUMNS}
+    FROM user_stats WHERE username = ?
+""", prepare=True)
+
+# SQLite: plain UPDATE, then re-read the row inside the same transaction.
+SQL_INCREMENT_USER_STATS = Statement('increment_user_stats', _STATS_INCREMENT_SQL)
+# PostgreSQL: the new row comes straight back from the UPDATE.
+SQL_INCREMENT_USER_STATS_RETURNING = Statement(
+    'increment_user_stats_returning',
+    _STATS_INCREMENT_SQL + f"RETURNING {_STATS_COLUMNS}",
+    prepare=True
+)
+
+# A debate is counted in its user's stats once: the flag on its history row
+# is set in the same transaction as the stats UPDATE, so a judgment job that
+# is retried or requeued after it already counted the debate changes nothing.
+SQL_MARK_STATS_APPLIED = Statement('mark_stats_applied', """
+    UPDATE debate_history SET stats_applied = 1
+    WHERE id = ? AND COALESCE(stats_applied, 0) = 0
+""", prepare=True)
+
+# --- Debates and their turns ---
+# A debate_history row is created when the debate starts (final_results NULL
+# until it is judged) and every turn is written to debate_turns as it
+# happens, so an interrupted debate keeps everything said so far and no
+# transcript is ever stored (or parsed) as one JSON blob. The chat_history
+# column is only read for rows saved before debate_turns existed.
+SQL_INSERT_DEBATE = Statement('insert_debate', """
+    INSERT INTO debate_history
+    (username, debate_mode, debate_topic, debate_state, final_results, timestamp)
+    VALUES (?, ?, ?, ?, ?, ?)
+""", prepare=True, pg_returning='id')
+
+SQL_FINISH_DEBATE = Statement('finish_debate', """
+    UPDATE debate_history SET debate_state = ?, final_results = ?, timestamp = ?
+    WHERE id = ?
+""", prepare=True)
+
+# Re-sending a turn that is already stored is a no-op.
+SQL_INSERT_TURN = Statement('insert_turn', """
+    INSERT INTO debate_turns (debate_id, turn_index, role, player_name, text, speaking_time)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (debate_id, turn_index) DO NOTHING
+""", prepare=True)
+
+SQL_DELETE_TURNS_FROM = Statement('delete_turns_from', """
+    DELETE FROM debate_turns WHERE debate_id = ? AND turn_index >= ?
+""")
+
+# Params: debate_id, last turn_index already seen (-1 for the start), limit
+SQL_SELECT_TURNS = Statement('select_turns', """
+    SELECT turn_index, role, player_name, text, speaking_time
+    FROM debate_turns WHERE debate_id = ? AND turn_index > ?
+    ORDER BY turn_index
+    LIMIT ?
+""", prepare=True)
+
+# --- History listing (keyset pagination) ---
+# Served by idx_debate_history_user_ts (username, timestamp DESC, id DESC),
+# created in db_init.py. Pages continue from the last (timestamp, id) seen
+# instead of using OFFSET, so page N costs the same as page 1.
+SQL_LIST_DEBATES_FIRST_PAGE = Statement('list_debates_first_page', """
+    SELECT id, debate_topic, debate_mode, timestamp, final_results IS NULL AS unfinished
+    FROM debate_history WHERE username = ?
+    ORDER BY timestamp DESC, id DESC
+    LIMIT ?
+""", prepare=True)
+
+SQL_LIST_DEBATES_NEXT_PAGE = Statement('list_debates_next_page', """
+    SELECT id, debate_topic, debate_mode, timestamp, final_results IS NULL AS unfinished
+    FROM debate_history WHERE username = ? AND (timestamp, id) < (?, ?)
+    ORDER BY timestamp DESC, id DESC
+    LIMIT ?
+""", prepare=True)
+
+# --- Full-text search over topics and transcripts ---
+# 'debate_search' holds one document per debate (created in db_init.py):
+#   SQLite:     an FTS5 virtual table whose rowid is debate_history.id
+#   PostgreSQL: a table with a generated tsvector column and a GIN index
+# Rows are written when a debate is saved or finished, in the same
+# transaction, so the index is maintained incrementally and never rebuilt
+# at query time.
+# Highlighted terms in snippets are wrapped in these two marker characters.
+SNIPPET_START = '\x02'
+SNIPPET_END = '\x03'
+
+# FTS5 has no upsert, so an existing document is deleted first.
+SQL_UNINDEX_DEBATE_SQLITE = Statement('unindex_debate_sqlite', """
+    DELETE FROM debate_search WHERE rowid = ?
+""")
+
+SQL_INDEX_DEBATE_SQLITE = Statement('index_debate_sqlite', """
+    INSERT INTO debate_search (rowid, username, debate_topic, transcript)
+    VALUES (?, ?, ?, ?)
+""")
+
+SQL_INDEX_DEBATE_PG = Statement('index_debate', """
+    INSERT INTO debate_search (debate_id, username, debate_topic, transcript)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT (debate_id) DO UPDATE SET
+        debate_topic = EXCLUDED.debate_topic, transcript = EXCLUDED.transcript
+""", prepare=True)
+
+# Params: snippet start marker, end marker, FTS5 query, username, limit
+SQL_SEARCH_DEBATES_SQLITE = Statement('search_debates_sqlite', """
+    SELECT h.id, h.debate_topic, h.debate_mode, h.timestamp,
+           snippet(debate_search, -1, ?, ?, '…', 16) AS snippet
+    FROM debate_search
+    JOIN debate_history h ON h.id = debate_search.rowid
+    WHERE debate_search MATCH ? AND debate_search.username = ?
+    ORDER BY debate_search.rank
+    LIMIT ?
+""")
+
+# Params: ts_headline options, tsquery text, username, limit.
+# Only the top 'limit' matches are ranked and headlined.
+SQL_SEARCH_DEBATES_PG = Statement('search_debates', """
+    SELECT h.id, h.debate_topic, h.debate_mode, h.timestamp,
+           ts_headline('english', s.debate_topic || E'\\n' || s.transcript, s.query, ?) AS snippet
+    FROM (
+        SELECT debate_id, debate_topic, COALESCE(transcript, '') AS transcript, query,
+               ts_rank_cd(search_vector, query) AS rank
+        FROM debate_search, to_tsquery('english', ?) AS query
+        WHERE username = ? AND search_vector @@ query
+        ORDER BY rank DESC
+        LIMIT ?
+    ) s
+    JOIN debate_history h ON h.id = s.debate_id
+    ORDER BY s.rank DESC
+""", prepare=True)
+
+_PG_HEADLINE_OPTIONS = (
+    f"StartSel={SNIPPET_START}, StopSel={SNIPPET_END}, "
+    "MaxWords=30, MinWords=10, MaxFragments=2, FragmentDelimiter=\" … \""
+)
+
+SQL_SELECT_UNINDEXED_SQLITE = Statement('select_unindexed_sqlite', """
+    SELECT id, username, debate_topic, chat_history FROM debate_history
+    WHERE id > ? AND final_results IS NOT NULL
+      AND id NOT IN (SELECT rowid FROM debate_search)
+    ORDER BY id LIMIT ?
+""")
+
+SQL_SELECT_UNINDEXED_PG = Statement('select_unindexed', """
+    SELECT id, username, debate_topic, chat_history FROM debate_history h
+    WHERE id > ? AND final_results IS NOT NULL
+      AND NOT EXISTS (SELECT 1 FROM debate_search s WHERE s.debate_id = h.id)
+    ORDER BY id LIMIT ?
+""")
+
+SQL_SELECT_DEBATE = Statement('select_debate', """
+    SELECT id, username, debate_mode, debate_topic, debate_state,
+           final_results, timestamp
+    FROM debate_history WHERE id = ? AND username = ?
+""")
+
+SQL_SELECT_LEGACY_TRANSCRIPT = Statement('select_legacy_transcript', """
+    SELECT chat_history FROM debate_history WHERE id = ?
+""")
+
+# --- Backfill of pre-debate_turns transcripts (see backfill_debate_turns.py) ---
+SQL_SELECT_LEGACY_BATCH = Statement('select_legacy_batch', """
+    SELECT id, chat_history FROM debate_history
+    WHERE id > ? AND chat_history IS NOT NULL
+    ORDER BY id LIMIT ?
+""")
+
+SQL_CLEAR_LEGACY_TRANSCRIPT = Statement('clear_legacy_transcript', """
+    UPDATE debate_history SET chat_history = NULL WHERE id = ?
+""")
+
+
+# --- Bulk import (used by bulk_import.py) ---
+# SQLite: executemany straight into the tables. PostgreSQL: each chunk is
+# COPYed into a temporary staging table and merged with one INSERT ... SELECT.
+# Existing users are left untouched; imported stats overwrite existing ones.
+# Stats rows for usernames that are not in users are dropped.
+_IMPORT_STATS_COLUMNS = ['debates_won', 'debates_lost', 'debates_drawn'] + \
+    [f"avg_{skill.lower()}" for skill in STAT_SKILLS]
+_IMPORT_STATS_UPSERT = "ON CONFLICT (username) DO UPDATE SET " + ", ".join(
+    f"{col} = EXCLUDED.{col}" for col in _IMPORT_STATS_COLUMNS)
+
+IMPORT_USER_COLUMNS = ['name', 'username', 'password']
+IMPORT_STATS_COLUMNS = ['username'] + _IMPORT_STATS_COLUMNS
+
+SQL_IMPORT_USER_SQLITE = Statement('import_user_sqlite', """
+    INSERT INTO users (name, username, password) VALUES (?, ?, ?)
+    ON CONFLICT (username) DO NOTHING
+""")
+
+SQL_IMPORT_USER_STATS_SQLITE = Statement('import_user_stats_sqlite', f"""
+    INSERT INTO user_stats (username, {', '.join(_IMPORT_STATS_COLUMNS)})
+    SELECT {', '.join(['?'] * len(IMPORT_STATS_COLUMNS))}
+    WHERE EXISTS (SELECT 1 FROM users WHERE username = ?)
+    {_IMPORT_STATS_UPSERT}
+""")
+
+SQL_CREATE_IMPORT_USERS_PG = Statement('create_import_users', """
+    CREATE TEMP TABLE IF NOT EXISTS import_users (
+        name TEXT, username TEXT, password TEXT
+    ) ON COMMIT DROP
+""")
+
+SQL_CREATE_IMPORT_USER_STATS_PG = Statement('create_import_user_stats', f"""
+    CREATE TEMP TABLE IF NOT EXISTS import_user_stats (
+        username TEXT, debates_won INTEGER, debates_lost INTEGER, debates_drawn INTEGER,
+        {', '.join(f"avg_{skill.lower()} FLOAT" for skill in STAT_SKILLS)}
+    ) ON COMMIT DROP
+""")
+
+SQL_MERGE_IMPORT_USERS_PG = Statement('merge_import_users', """
+    INSERT INTO users (name, username, password)
+    SELECT DISTINCT ON (username) name, username, password FROM import_users
+    ON CONFLICT (username) DO NOTHING
+""")
+
+SQL_MERGE_IMPORT_USER_STATS_PG = Statement('merge_import_user_stats', f"""
+    INSERT INTO user_stats (username, {', '.join(_IMPORT_STATS_COLUMNS)})
+    SELECT DISTINCT ON (s.username) s.username, {', '.join('s.' + col for col in _IMPORT_STATS_COLUMNS)}
+    FROM import_user_stats s JOIN users u ON u.username = s.username
+    {_IMPORT_STATS_UPSERT}
+""")
+
+SQL_CLEAR_IMPORT_USERS_PG = Statement('clear_import_users', "TRUNCATE import_users")
+SQL_CLEAR_IMPORT_USER_STATS_PG = Statement('clear_import_user_stats', "TRUNCATE import_user_stats")
+
+# Every user gets a (zeroed) stats row, as create_user() does.
+SQL_FILL_MISSING_USER_STATS = Statement('fill_missing_user_stats', """
+    INSERT INTO user_stats (username)
+    SELECT u.username FROM users u
+    WHERE NOT EXISTS (SELECT 1 FROM user_stats s WHERE s.username = u.username)
+""")
+
+
+# --- Archival export (used by export_history.py) ---
+# Exports walk debate_history in id order between two ids, streaming both
+# the debates and their turns (merged in Python on debate_id), so a single
+# pass needs constant memory. On PostgreSQL these run as server-side cursors.
+SQL_EXPORT_FIRST_RECENT_ID = Statement('export_first_recent_id', """
+    SELECT MIN(id) AS first_recent_id FROM debate_history WHERE id > ? AND timestamp >= ?
+""")
+
+SQL_EXPORT_LAST_ID = Statement('export_last_id', """
+    SELECT MAX(id) AS last_id FROM debate_history WHERE id > ?
+""")
+
+SQL_EXPORT_DEBATES = Statement('export_debates', """
+    SELECT id, username, debate_mode, debate_topic, debate_state, chat_history,
+           final_results, timestamp
+    FROM debate_history WHERE id > ? AND id <= ?
+    ORDER BY id
+""")
+
+SQL_EXPORT_TURNS = Statement('export_turns', """
+    SELECT debate_id, turn_index, role, player_name, text, speaking_time
+    FROM debate_turns WHERE debate_id > ? AND debate_id <= ?
+    ORDER BY debate_id, turn_index
+""")
+
+# Archived rows are deleted in id ranges of at most 'limit' debates.
+SQL_NEXT_DELETE_BATCH_END = Statement('next_delete_batch_end', """
+    SELECT MAX(id) AS batch_end FROM (
+        SELECT id FROM debate_history WHERE id > ? AND id <= ? ORDER BY id LIMIT ?
+    ) batch
+""")
+
+SQL_DELETE_TURNS_RANGE = Statement('delete_turns_range', """
+    DELETE FROM debate_turns WHERE debate_id > ? AND debate_id <= ?
+""")
+
+SQL_DELETE_SEARCH_RANGE_SQLITE = Statement('delete_search_range_sqlite', """
+    DELETE FROM debate_search WHERE rowid > ? AND rowid <= ?
+""")
+
+SQL_DELETE_SEARCH_RANGE_PG = Statement('delete_search_range', """
+    DELETE FROM debate_search WHERE debate_id > ? AND debate_id <= ?
+""")
+
+SQL_DELETE_DEBATES_RANGE = Statement('delete_debates_range', """
+    DELETE FROM debate_history WHERE id > ? AND id <= ?
+""")
+
+# --- Judgment cache (see judgment_cache.py) ---
+SQL_SELECT_CACHED_JUDGMENT = Statement('select_cached_judgment', """
+    SELECT judgment FROM judgment_cache WHERE cache_key = ? AND prompt_version = ?
+""", prepare=True)
+
+SQL_INSERT_CACHED_JUDGMENT = Statement('insert_cached_judgment', """
+    INSERT INTO judgment_cache (cache_key, prompt_version, judgment) VALUES (?, ?, ?)
+    ON CONFLICT (cache_key) DO NOTHING
+""", prepare=True)
+
+SQL_DELETE_STALE_JUDGMENTS = Statement('delete_stale_judgments', """
+    DELETE FROM judgment_cache WHERE prompt_version <> ?
+""")
+
+# --- Bulk re-judging (see rejudge.py) ---
+# Finished debates (final_results set) without a result for this judge version.
+_NOT_REJUDGED = """
+    final_results IS NOT NULL AND NOT EXISTS (
+        SELECT 1 FROM rejudged_results r WHERE r.debate_id = debate_history.id AND r.judge_version = ?
+    )
+"""
+
+SQL_COUNT_DEBATES_TO_REJUDGE = Statement('count_debates_to_rejudge', f"""
+    SELECT COUNT(*) AS remaining FROM debate_history WHERE {_NOT_REJUDGED}
+""")
+
+SQL_SELECT_DEBATES_TO_REJUDGE = Statement('select_debates_to_rejudge', f"""
+    SELECT id, username, debate_mode, debate_state FROM debate_history
+    WHERE id > ? AND {_NOT_REJUDGED}
+    ORDER BY id LIMIT ?
+""")
+
+SQL_UPSERT_REJUDGED_RESULT = Statement('upsert_rejudged_result', """
+    INSERT INTO rejudged_results (debate_id, judge_version, final_results, judged_at)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT (debate_id, judge_version) DO UPDATE SET
+        final_results = excluded.final_results, judged_at = excluded.judged_at
+""", prepare=True)
+
+SQL_SELECT_PRACTICE_RESULTS = Statement('select_practice_results', """
+    SELECT h.id, h.username, h.final_results, r.final_results AS rejudged
+    FROM debate_history h
+    LEFT JOIN rejudged_results r ON r.debate_id = h.id AND r.judge_version = ?
+    WHERE h.id > ? AND h.debate_mode = 'practice' AND h.username IS NOT NULL
+    ORDER BY h.id LIMIT ?
+""")
+
+SQL_SET_USER_STATS = Statement('set_user_stats', """
+    UPDATE user_stats SET
+        debates_won = ?, debates_lost = ?, debates_drawn = ?,
+        """ + ",\n        ".join(f"avg_{skill.lower()} = ?" for skill in STAT_SKILLS) + """
+    WHERE username = ?
+""")
+
+# --- LLM call log (see llm_accounting.py) ---
+LLM_CALL_COLUMNS = ('called_at', 'username', 'debate_mode', 'call_type', 'model', 'prompt_tokens',
+                    'completion_tokens', 'ttft_ms', 'latency_ms', 'retries', 'outcome')
+
+SQL_INSERT_LLM_CALL = Statement('insert_llm_call', f"""
+    INSERT INTO llm_calls ({", ".join(LLM_CALL_COLUMNS)})
+    VALUES ({", ".join("?" for _ in LLM_CALL_COLUMNS)})
+""", prepare=True)
+
+# Per-user / per-mode rollups: one row per (group, call type).
+SQL_LLM_CALL_ROLLUPS = {
+    group: Statement(f'llm_call_rollup_{group}', f"""
+        SELECT COALESCE({column}, '-') AS grp, call_type,
+               COUNT(*) AS calls,
+               SUM(CASE WHEN outcome IN ('ok', 'cancelled') THEN 0 ELSE 1 END) AS failed,
+               SUM(retries) AS retries,
+               SUM(COALESCE(prompt_tokens, 0)) AS prompt_tokens,
+               SUM(COALESCE(completion_tokens, 0)) AS completion_tokens,
+               AVG(latency_ms) AS avg_latency_ms
+        FROM llm_calls WHERE called_at >= ?
+        GROUP BY COALESCE({column}, '-'), call_type
+        ORDER BY grp, call_type
+    """)
+    for group, column in (('user', 'username'), ('mode', 'debate_mode'))
+}
+
+SQL_SELECT_LLM_CALL_LATENCIES = Statement('select_llm_call_latencies', """
+    SELECT id, call_type, model, ttft_ms, latency_ms, outcome
+    FROM llm_calls WHERE called_at >= ? AND id > ?
+    ORDER BY id LIMIT ?
+""")
+
+
+# LIMIT used when every turn of a debate is wanted.
+_ALL_TURNS = 2 ** 31 - 1
+
+
+# --- Query instrumentation ---
+_query_stats = {}
+_query_stats_lock = threading.Lock()
+
+
+def _record(name, elapsed):
+    with _query_stats_lock:
+        entry = _query_stats.setdefault(name, {'calls': 0, 'errors': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+        entry['calls'] += 1
+        entry['total_ms'] += elapsed * 1000
+        entry['max_ms'] = max(entry['max_ms'], elapsed * 1000)
+
+
+def _record_error(name):
+    with _query_stats_lock:
+        entry = _query_stats.setdefault(name, {'calls': 0, 'errors': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+        entry['errors'] += 1
+
+
+def query_stats():
+    """Per-statement call counts and timings (exposed via /server-stats)."""
+    with _query_stats_lock:
+        return {
+            name: dict(entry,
+                       avg_ms=round(entry['total_ms'] / entry['calls'], 3) if entry['calls'] else 0.0,
+                       total_ms=round(entry['total_ms'], 3),
+                       max_ms=round(entry['max_ms'], 3))
+            for name, entry in _query_stats.items()
+        }
+
+
+def execute(con, cur, stmt, params=()):
+    """Run a Statement on the cursor using the right dialect for 'con'."""
+    started = time.perf_counter()
+    try:
+        if isinstance(con, sqlite3.Connection):
+            cur.execute(stmt.sqlite_sql, params)
+        elif stmt.prepare and USE_PREPARED_STATEMENTS and hasattr(con, 'prepared_statements'):
+            if stmt.name not in con.prepared_statements:
+                cur.execute(stmt.pg_prepare_sql)
+                con.prepared_statements.add(stmt.name)
+            cur.execute(stmt.pg_execute_sql, params)
+        else:
+            cur.execute(stmt.pg_sql, params)
+    except Exception:
+        _record_error(stmt.name)
+        raise
+    _record(stmt.name, time.perf_counter() - started)
+
+
+def execute_many(con, cur, stmt, rows):
+    """executemany() counterpart of execute(); plain (unprepared) SQL on both dialects."""
+    started = time.perf_counter()
+    try:
+        if isinstance(con, sqlite3.Connection):
+            cur.executemany(stmt.sqlite_sql, rows)
+        else:
+            cur.executemany(stmt.pg_sql, rows)
+    except Exception:
+        _record_error(stmt.name)
+        raise
+    _record(stmt.name, time.perf_counter() - started)
+
+
+def _row_to_dict(row):
+    return dict(row) if row is not None else None
+
+
+# --- Users ---
+def create_user(name, username, password):
+    """
+    Creates the user and their empty stats row in one transaction.
+    Raises one of INTEGRITY_ERRORS if the username already exists.
+    """
+    with db_connection() as con:
+        try:
+            cur = con.cursor()
+            execute(con, cur, SQL_INSERT_USER, (name, username, password))
+            execute(con, cur, SQL_INSERT_USER_STATS, (username,))
+            con.commit()
+        except Exception:
+            con.rollback()
+            raise
+
+
+def get_user_password(username):
+    """Returns the stored password for 'username', or None if no such user."""
+    with db_connection() as con:
+        cur = con.cursor()
+        execute(con, cur, SQL_SELECT_PASSWORD, (username,))
+        row = cur.fetchone()
+    return row['password'] if row else None
+
+
+# --- User Stats ---
+def get_user_stats(username):
+    """Returns the user's stats row as a dict (lowercase column keys), or None."""
+    with db_connection() as con:
+        cur = con.cursor()
+        execute(con, cur, SQL_SELECT_USER_STATS, (username,))
+        return _row_to_dict(cur.fetchone())
+
+
+def _apply_debate_result(con, cur, username, outcome, user_scores, debate_id=None):
+    if debate_id is not None:
+        execute(con, cur, SQL_MARK_STATS_APPLIED, (debate_id,))
+        if cur.rowcount == 0:
+            # Already counted (or the debate is gone): leave the stats alone.
+            execute(con, cur, SQL_SELECT_USER_STATS, (username,))
+            return _row_to_dict(cur.fetchone())
+    params = (
+        1 if outcome == 'won' else 0,
+        1 if outcome == 'lost' else 0,
+        1 if outcome == 'drawn' else 0,
+        *[user_scores.get(skill) for skill in STAT_SKILLS],
+        username,
+    )
+    if isinstance(con, sqlite3.Connection):
+        execute(con, cur, SQL_INCREMENT_USER_STATS, params)
+        execute(con, cur, SQL_SELECT_USER_STATS, (username,))
+    else:
+        execute(con, cur, SQL_INCREMENT_USER_STATS_RETURNING, params)
+    return _row_to_dict(cur.fetchone())
+
+
+def apply_debate_result(username, outcome, user_scores, debate_id=None):
+    """
+    Atomically records one finished debate in the user's stats.
+    'outcome' is 'won', 'lost' or 'drawn'; 'user_scores' maps each skill in
+    STAT_SKILLS to a float, or None to leave that average unchanged.
+    With a 'debate_id', a debate that was already counted is skipped.
+    Returns the updated stats row as a dict, or None if the user has no row.
+    """
+    with db_connection() as con:
+        try:
+            cur = con.cursor()
+            row = _apply_debate_result(con, cur, username, outcome, user_scores, debate_id)
+            con.commit()
+            return row
+        except Exception:
+            con.rollback()
+            raise
+
+
+# --- Debate History ---
+def build_search_transcript(chat_history):
+    """Plain text of every turn, as stored in the search index."""
+    lines = []
+    for entry in chat_history or []:
+        parts = entry.get('parts') or ['']
+        lines.append(str(parts[0]))
+    return "\n".join(lines)
+
+
+def _index_debate(con, cur, debate_id, username, debate_topic, transcript):
+    if isinstance(con, sqlite3.Connection):
+        execute(con, cur, SQL_UNINDEX_DEBATE_SQLITE, (debate_id,))
+        execute(con, cur, SQL_INDEX_DEBATE_SQLITE, (debate_id, username, debate_topic or '', transcript))
+    else:
+        execute(con, cur, SQL_INDEX_DEBATE_PG, (debate_id, username, debate_topic or '', transcript))
+
+
+def _write_turn(con, cur, debate_id, turn_index, entry):
+    parts = entry.get('parts') or ['']
+    execute(con, cur, SQL_INSERT_TURN, (
+        debate_id, turn_index, entry.get('role') or 'user', entry.get('player_name'),
+        str(parts[0]), entry.get('time')
+    ))
+
+
+def turns_to_chat_history(rows):
+    """Rebuilds the session's chat_history entries from debate_turns rows."""
+    chat_history = []
+    for row in rows:
+        entry = {'role': row['role'], 'parts': [row['text'] or '']}
+        if row['speaking_time'] is not None:
+            entry['time'] = row['speaking_time']
+        if row['player_name'] is not None:
+            entry['player_name'] = row['player_name']
+        chat_history.append(entry)
+    return chat_history
+
+
+def _insert_debate(con, cur, username, debate_mode, debate_topic, state_json, results_json,
+                   timestamp, chat_history):
+    execute(con, cur, SQL_INSERT_DEBATE, (
+        username, debate_mode, debate_topic, state_json, results_json, timestamp
+    ))
+    if isinstance(con, sqlite3.Connection):
+        debate_id = cur.lastrowid
+    else:
+        debate_id = cur.fetchone()['id']
+    for turn_index, entry in enumerate(chat_history or []):
+        _write_turn(con, cur, debate_id, turn_index, entry)
+    if results_json is not None:
+        _index_debate(con, cur, debate_id, username, debate_topic,
+                      build_search_transcript(chat_history))
+    return debate_id
+
+
+def _finish_debate(con, cur, debate_id, username, debate_topic, state_json, results_json,
+                   timestamp, chat_history):
+    execute(con, cur, SQL_FINISH_DEBATE, (state_json, results_json, timestamp, debate_id))
+    if cur.rowcount != 1:
+        return False
+    for turn_index, entry in enumerate(chat_history or []):
+        _write_turn(con, cur, debate_id, turn_index, entry)
+    _index_debate(con, cur, debate_id, username, debate_topic,
+                  build_search_transcript(chat_history))
+    return True
+
+
+def insert_debate(username, debate_mode, debate_topic, state_json, results_json, timestamp,
+                  chat_history=None):
+    """
+    Inserts a debate_history row and returns its id. Called with
+    results_json=None when a debate starts; with results (and the full
+    chat_history) it saves a finished debate, its turns and its search
+    document in one transaction.
+    """
+    with db_connection() as con:
+        try:
+            cur = con.cursor()
+            debate_id = _insert_debate(con, cur, username, debate_mode, debate_topic,
+                                       state_json, results_json, timestamp, chat_history)
+            con.commit()
+            return debate_id
+        except Exception:
+            con.rollback()
+            raise
+
+
+def record_turn(debate_id, turn_index, entry):
+    """Stores one chat_history entry as it happens. Safe to repeat."""
+    with db_connection() as con:
+        try:
+            cur = con.cursor()
+            _write_turn(con, cur, debate_id, turn_index, entry)
+            con.commit()
+        except Exception:
+            con.rollback()
+            raise
+
+
+def discard_turns(debate_id, from_index):
+    """Deletes the debate's turns from 'from_index' on (turns that were undone)."""
+    with db_connection() as con:
+        try:
+            cur = con.cursor()
+            execute(con, cur, SQL_DELETE_TURNS_FROM, (debate_id, from_index))
+            con.commit()
+        except Exception:
+            con.rollback()
+            raise
+
+
+def finish_debate(debate_id, username, debate_topic, state_json, results_json, timestamp,
+                  chat_history):
+    """
+    Marks a started debate as finished: stores the final state and results,
+    writes any turns that did not make it in yet and indexes the transcript.
+    Returns False if the row no longer exists.
+    """
+    with db_connection() as con:
+        try:
+            cur = con.cursor()
+            finished = _finish_debate(con, cur, debate_id, username, debate_topic,
+                                      state_json, results_json, timestamp, chat_history)
+            con.commit()
+            return finished
+        except Exception:
+            con.rollback()
+            raise
+
+
+# --- Batched writes (used by persistence.py) ---
+def _save_finished_debate(con, cur, job):
+    if job.get('debate_id') and _finish_debate(
+            con, cur, job['debate_id'], job['username'], job['debate_topic'],
+            job['state_json'], job['results_json'], job['timestamp'], job['chat_history']):
+        return
+    _insert_debate(con, cur, job['username'], job['debate_mode'], job['debate_topic'],
+                   job['state_json'], job['results_json'], job['timestamp'], job['chat_history'])
+
+
+def _apply_stats_job(con, cur, job):
+    _apply_debate_result(con, cur, job['username'], job['outcome'], job['scores'], job.get('debate_id'))
+
+
+def _insert_llm_call(con, cur, job):
+    execute(con, cur, SQL_INSERT_LLM_CALL, tuple(job.get(column) for column in LLM_CALL_COLUMNS))
+
+
+BATCH_WRITERS = {
+    'debate': _save_finished_debate,
+    'stats': _apply_stats_job,
+    'llm_call': _insert_llm_call,
+}
+
+
+def write_batch(jobs):
+    """
+    Applies a list of {'kind': ..., 'payload': ...} jobs (kinds are the keys
+    of BATCH_WRITERS) on one connection, in one transaction: either every
+    job in the batch is written or none is.
+    """
+    with db_connection() as con:
+        try:
+            cur = con.cursor()
+            for job in jobs:
+                BATCH_WRITERS[job['kind']](con, cur, job['payload'])
+            con.commit()
+        except Exception:
+            con.rollback()
+            raise
+
+
+def list_debates_page(username, limit, cursor=None):
+    """
+    Returns one page of (id, debate_topic, debate_mode, timestamp) rows,
+    newest first, plus the cursor for the next page (None on the last page).
+    'cursor' is the value returned by the previous call, or None for page 1.
+    """
+    with db_connection() as con:
+        cur = con.cursor()
+        # Fetch one extra row to find out whether another page exists.
+        if cursor is None:
+            execute(con, cur, SQL_LIST_DEBATES_FIRST_PAGE, (username, limit + 1))
+        else:
+            execute(con, cur, SQL_LIST_DEBATES_NEXT_PAGE,
+                    (username, cursor['timestamp'], cursor['id'], limit + 1))
+        rows = [_row_to_dict(row) for row in cur.fetchall()]
+
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last_ts = rows[-1]['timestamp']
+    # SQLite hands back the stored text as-is; Postgres returns a datetime.
+    next_cursor = {
+        'timestamp': last_ts if isinstance(last_ts, str) else last_ts.isoformat(),
+        'id': rows[-1]['id'],
+    }
+    return rows, next_cursor
+
+
+def _fts5_query(text):
+    """
+    Turns free text into a safe FTS5 query: every word is quoted (so user
+    input can never be FTS5 syntax) and the last word is a prefix match,
+    which makes search-as-you-type work.
+    """
+    words = re.findall(r"\w+", text or "")
+    if not words:
+        return None
+    quoted = [f'"{w}"' for w in words]
+    quoted[-1] += '*'
+    return " ".join(quoted)
+
+
+def _pg_tsquery(text):
+    """Same idea for Postgres: 'nuclear energ' -> 'nuclear & energ:*'."""
+    words = re.findall(r"\w+", text or "")
+    if not words:
+        return None
+    return " & ".join(words) + ":*"
+
+
+def search_debates(username, text, limit=20):
+    """
+    Ranked full-text search over the user's debate topics and transcripts.
+    Returns rows of (id, debate_topic, debate_mode, timestamp, snippet); the
+    snippet marks matched terms with SNIPPET_START / SNIPPET_END.
+    """
+    with db_connection() as con:
+        cur = con.cursor()
+        if isinstance(con, sqlite3.Connection):
+            query = _fts5_query(text)
+            if not query:
+                return []
+            execute(con, cur, SQL_SEARCH_DEBATES_SQLITE,
+                    (SNIPPET_START, SNIPPET_END, query, username, limit))
+        else:
+            query = _pg_tsquery(text)
+            if not query:
+                return []
+            execute(con, cur, SQL_SEARCH_DEBATES_PG,
+                    (_PG_HEADLINE_OPTIONS, query, username, limit))
+        return [_row_to_dict(row) for row in cur.fetchall()]
+
+
+def _load_chat_history(con, cur, debate_id):
+    execute(con, cur, SQL_SELECT_TURNS, (debate_id, -1, _ALL_TURNS))
+    chat_history = turns_to_chat_history(cur.fetchall())
+    if chat_history:
+        return chat_history
+    # Saved before debate_turns existed and not backfilled yet.
+    execute(con, cur, SQL_SELECT_LEGACY_TRANSCRIPT, (debate_id,))
+    row = cur.fetchone()
+    try:
+        return json.loads(row['chat_history']) if row and row['chat_history'] else []
+    except (TypeError, ValueError):
+        return []
+
+
+def index_missing_debates(batch_size=500):
+    """
+    Adds search documents for finished debates saved before the index
+    existed. Works through debate_history in id order, one batch per
+    transaction, so memory stays bounded. Returns the number indexed.
+    """
+    indexed = 0
+    last_id = 0
+    while True:
+        with db_connection() as con:
+            try:
+                cur = con.cursor()
+                select_stmt = SQL_SELECT_UNINDEXED_SQLITE if isinstance(con, sqlite3.Connection) else SQL_SELECT_UNINDEXED_PG
+                execute(con, cur, select_stmt, (last_id, batch_size))
+                rows = cur.fetchall()
+                if not rows:
+                    con.commit()
+                    return indexed
+                for row in rows:
+                    if row['chat_history']:
+                        try:
+                            chat_history = json.loads(row['chat_history'])
+                        except (TypeError, ValueError):
+                            chat_history = []
+                    else:
+                        chat_history = _load_chat_history(con, cur, row['id'])
+                    _index_debate(con, cur, row['id'], row['username'], row['debate_topic'],
+                                  build_search_transcript(chat_history))
+                    last_id = row['id']
+                con.commit()
+                indexed += len(rows)
+            except Exception:
+                con.rollback()
+                raise
+
+
+def migrate_legacy_transcripts(batch_size=200):
+    """
+    Moves chat_history JSON blobs into debate_turns, batch_size debates per
+    transaction (keyset on id, so memory stays bounded however large the
+    table is), and clears each blob once its turns are written.
+    Yields (migrated, skipped, last_id) after every batch. Blobs that are
+    not valid JSON are left in place and counted as skipped.
+    """
+    migrated = 0
+    skipped = 0
+    last_id = 0
+    while True:
+        with db_connection() as con:
+            try:
+                cur = con.cursor()
+                execute(con, cur, SQL_SELECT_LEGACY_BATCH, (last_id, batch_size))
+                rows = cur.fetchall()
+                if not rows:
+                    con.commit()
+                    return
+                for row in rows:
+                    last_id = row['id']
+                    try:
+                        chat_history = json.loads(row['chat_history'])
+                    except (TypeError, ValueError):
+                        skipped += 1
+                        continue
+                    for turn_index, entry in enumerate(chat_history or []):
+                        if isinstance(entry, dict):
+                            _write_turn(con, cur, row['id'], turn_index, entry)
+                    execute(con, cur, SQL_CLEAR_LEGACY_TRANSCRIPT, (row['id'],))
+                    migrated += 1
+                con.commit()
+            except Exception:
+                con.rollback()
+                raise
+        yield migrated, skipped, last_id
+
+
+def get_debate(debate_id, username):
+    """
+    Returns the debate_history row without its transcript (JSON columns
+    still serialized), or None. Use get_debate_turns() / get_transcript()
+    for the turns.
+    """
+    with db_connection() as con:
+        cur = con.cursor()
+        execute(con, cur, SQL_SELECT_DEBATE, (debate_id, username))
+        return _row_to_dict(cur.fetchone())
+
+
+def get_debate_turns(debate_id, after_index=-1, limit=None):
+    """
+    One page of debate_turns rows in turn order, starting after
+    'after_index' (pass the last turn_index seen to get the next page).
+    """
+    with db_connection() as con:
+        cur = con.cursor()
+        execute(con, cur, SQL_SELECT_TURNS,
+                (debate_id, after_index, _ALL_TURNS if limit is None else limit))
+        return [_row_to_dict(row) for row in cur.fetchall()]
+
+
+def get_transcript(debate_id):
+    """The debate's full chat_history, from debate_turns or a not-yet-migrated blob."""
+    with db_connection() as con:
+        cur = con.cursor()
+        return _load_chat_history(con, cur, debate_id)
+
+
+# --- Bulk import ---
+def _copy_rows(cur, table, columns, rows):
+    """COPY FROM STDIN one chunk of rows (None becomes NULL)."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(['\\N' if value is None else value for value in row])
+    buffer.seek(0)
+    cur.copy_expert(
+        f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')", buffer
+    )
+
+
+def import_users_chunk(con, cur, rows):
+    """
+    Loads one chunk of (name, username, password) tuples inside the
+    caller's transaction. Returns how many new users were inserted.
+    """
+    if isinstance(con, sqlite3.Connection):
+        execute_many(con, cur, SQL_IMPORT_USER_SQLITE, rows)
+        return cur.rowcount
+    execute(con, cur, SQL_CREATE_IMPORT_USERS_PG)
+    _copy_rows(cur, 'import_users', IMPORT_USER_COLUMNS, rows)
+    execute(con, cur, SQL_MERGE_IMPORT_USERS_PG)
+    inserted = cur.rowcount
+    execute(con, cur, SQL_CLEAR_IMPORT_USERS_PG)
+    return inserted
+
+
+def import_user_stats_chunk(con, cur, rows):
+    """
+    Loads one chunk of stats tuples (IMPORT_STATS_COLUMNS order) inside the
+    caller's transaction. Returns how many stats rows were written.
+    """
+    if isinstance(con, sqlite3.Connection):
+        execute_many(con, cur, SQL_IMPORT_USER_STATS_SQLITE, [tuple(row) + (row[0],) for row in rows])
+        return cur.rowcount
+    execute(con, cur, SQL_CREATE_IMPORT_USER_STATS_PG)
+    _copy_rows(cur, 'import_user_stats', IMPORT_STATS_COLUMNS, rows)
+    execute(con, cur, SQL_MERGE_IMPORT_USER_STATS_PG)
+    written = cur.rowcount
+    execute(con, cur, SQL_CLEAR_IMPORT_USER_STATS_PG)
+    return written
+
+
+def fill_missing_user_stats():
+    """Creates zeroed stats rows for users that have none. Returns the count."""
+    with db_connection() as con:
+        try:
+            cur = con.cursor()
+            execute(con, cur, SQL_FILL_MISSING_USER_STATS)
+            created = cur.rowcount
+            con.commit()
+            return created
+        except Exception:
+            con.rollback()
+            raise
+
+
+# --- Archival export ---
+def export_upper_bound(after_id, recent_cutoff):
+    """
+    The highest id an export starting after 'after_id' may include: just
+    below the first debate whose timestamp is at or after 'recent_cutoff'
+    (which may still be in progress). Returns after_id if there is nothing.
+    """
+    with db_connection() as con:
+        cur = con.cursor()
+        execute(con, cur, SQL_EXPORT_FIRST_RECENT_ID, (after_id, str(recent_cutoff)))
+        first_recent_id = cur.fetchone()['first_recent_id']
+        if first_recent_id is not None:
+            return first_recent_id - 1
+        execute(con, cur, SQL_EXPORT_LAST_ID, (after_id,))
+        last_id = cur.fetchone()['last_id']
+        return last_id if last_id is not None else after_id
+
+
+def _stream(con, stmt, params, fetch_size):
+    """Iterates a query's rows without loading them all (server-side cursor on PG)."""
+    started = time.perf_counter()
+    if isinstance(con, sqlite3.Connection):
+        cur = con.cursor()
+        cur.execute(stmt.sqlite_sql, params)
+    else:
+        cur = con.cursor(name=stmt.name)
+        cur.itersize = fetch_size
+        cur.execute(stmt.pg_sql, params)
+    _record(stmt.name, time.perf_counter() - started)
+    return iter(cur)
+
+
+def stream_debates(after_id, upto_id, fetch_size=500):
+    """
+    Yields every debate with after_id < id <= upto_id in id order, as a dict
+    of its debate_history columns plus 'turns' (a list of debate_turns row
+    dicts, built from the legacy chat_history blob for unmigrated rows).
+    """
+    with db_connection() as con:
+        debates = _stream(con, SQL_EXPORT_DEBATES, (after_id, upto_id), fetch_size)
+        turns = _stream(con, SQL_EXPORT_TURNS, (after_id, upto_id), fetch_size)
+        pending = next(turns, None)
+        for row in debates:
+            record = dict(row)
+            while pending is not None and pending['debate_id'] < record['id']:
+                pending = next(turns, None)  # turns of a debate deleted meanwhile
+            record_turns = []
+            while pending is not None and pending['debate_id'] == record['id']:
+                turn = dict(pending)
+                del turn['debate_id']
+                record_turns.append(turn)
+                pending = next(turns, None)
+
+            chat_history = record.pop('chat_history')
+            if not record_turns and chat_history:
+                try:
+                    legacy = json.loads(chat_history)
+                except (TypeError, ValueError):
+                    legacy = []
+                for turn_index, entry in enumerate(legacy or []):
+                    parts = entry.get('parts') or ['']
+                    record_turns.append({
+                        'turn_index': turn_index, 'role': entry.get('role'),
+                        'player_name': entry.get('player_name'), 'text': str(parts[0]),
+                        'speaking_time': entry.get('time'),
+                    })
+            record['turns'] = record_turns
+            yield record
+
+
+def delete_debates_upto(upto_id, batch_size=1000, after_id=0):
+    """
+    Deletes debates with after_id < id <= upto_id (and their turns and
+    search documents), batch_size debates per transaction. Yields the
+    running total after each batch.
+    """
+    deleted = 0
+    last_id = after_id
+    while True:
+        with db_connection() as con:
+            try:
+                cur = con.cursor()
+                execute(con, cur, SQL_NEXT_DELETE_BATCH_END, (last_id, upto_id, batch_size))
+                batch_end = cur.fetchone()['batch_end']
+                if batch_end is None:
+                    con.commit()
+                    return
+                execute(con, cur, SQL_DELETE_TURNS_RANGE, (last_id, batch_end))
+                if isinstance(con, sqlite3.Connection):
+                    execute(con, cur, SQL_DELETE_SEARCH_RANGE_SQLITE, (last_id, batch_end))
+                else:
+                    execute(con, cur, SQL_DELETE_SEARCH_RANGE_PG, (last_id, batch_end))
+                execute(con, cur, SQL_DELETE_DEBATES_RANGE, (last_id, batch_end))
+                deleted += cur.rowcount
+                con.commit()
+                last_id = batch_end
+            except Exception:
+                con.rollback()
+                raise
+        yield deleted
+
+
+# --- Judgment cache ---
+def get_cached_judgment(cache_key, prompt_version):
+    """The stored judgment JSON for 'cache_key', or None."""
+    with db_connection() as con:
+        cur = con.cursor()
+        execute(con, cur, SQL_SELECT_CACHED_JUDGMENT, (cache_key, prompt_version))
+        row = cur.fetchone()
+    return row['judgment'] if row else None
+
+
+def store_cached_judgment(cache_key, prompt_version, judgment_json):
+    """Stores a judgment under 'cache_key'. The first one stored wins."""
+    with db_connection() as con:
+        try:
+            cur = con.cursor()
+            execute(con, cur, SQL_INSERT_CACHED_JUDGMENT, (cache_key, prompt_version, judgment_json))
+            con.commit()
+        except Exception:
+            con.rollback()
+            raise
+
+
+def delete_stale_judgments(prompt_version):
+    """Deletes cached judgments made with any other prompt version. Returns the count."""
+    with db_connection() as con:
+        try:
+            cur = con.cursor()
+            execute(con, cur, SQL_DELETE_STALE_JUDGMENTS, (prompt_version,))
+            deleted = cur.rowcount
+            con.commit()
+            return deleted
+        except Exception:
+            con.rollback()
+            raise
+
+
+# --- Bulk re-judging ---
+def count_debates_to_rejudge(judge_version):
+    """How many finished debates have no result for 'judge_version' yet."""
+    with db_connection() as con:
+        cur = con.cursor()
+        execute(con, cur, SQL_COUNT_DEBATES_TO_REJUDGE, (judge_version,))
+        return cur.fetchone()['remaining']
+
+
+def list_debates_to_rejudge(judge_version, after_id, limit):
+    """
+    The next 'limit' finished debates after 'after_id' (in id order) with no
+    result for 'judge_version', each with its 'chat_history' loaded.
+    """
+    with db_connection() as con:
+        cur = con.cursor()
+        execute(con, cur, SQL_SELECT_DEBATES_TO_REJUDGE, (after_id, judge_version, limit))
+        rows = [_row_to_dict(row) for row in cur.fetchall()]
+        for row in rows:
+            row['chat_history'] = _load_chat_history(con, cur, row['id'])
+    return rows
+
+
+def store_rejudged_result(debate_id, judge_version, results_json, judged_at):
+    """Stores (or replaces) one debate's result for 'judge_version'."""
+    with db_connection() as con:
+        try:
+            cur = con.cursor()
+            execute(con, cur, SQL_UPSERT_REJUDGED_RESULT, (debate_id, judge_version, results_json, judged_at))
+            con.commit()
+        except Exception:
+            con.rollback()
+            raise
+
+
+def iter_practice_results(judge_version, batch_size=500):
+    """
+    Yields (id, username, final_results, rejudged) for every practice debate
+    in id order; 'rejudged' is its result for 'judge_version' or None.
+    JSON columns are still serialized.
+    """
+    after_id = 0
+    while True:
+        with db_connection() as con:
+            cur = con.cursor()
+            execute(con, cur, SQL_SELECT_PRACTICE_RESULTS, (judge_version, after_id, batch_size))
+            rows = [_row_to_dict(row) for row in cur.fetchall()]
+        if not rows:
+            return
+        yield from rows
+        after_id = rows[-1]['id']
+
+
+def set_user_stats(stats):
+    """
+    Overwrites the stats of every user in 'stats' (username -> dict with
+    debates_won/lost/drawn and one avg per STAT_SKILLS skill), in one
+    transaction. Returns how many rows were updated.
+    """
+    rows = [
+        (entry['debates_won'], entry['debates_lost'], entry['debates_drawn'],
+         *[entry['avg_' + skill] for skill in STAT_SKILLS], username)
+        for username, entry in stats.items()
+    ]
+    with db_connection() as con:
+        try:
+            cur = con.cursor()
+            updated = 0
+            for row in rows:
+                execute(con, cur, SQL_SET_USER_STATS, row)
+                updated += cur.rowcount
+            con.commit()
+            return updated
+        except Exception:
+            con.rollback()
+            raise
+
+
+# --- LLM call log ---
+def llm_call_rollup(group, since):
+    """
+    Totals per (user or mode, call type) for calls made at or after 'since'
+    (epoch seconds). group is 'user' or 'mode'.
+    """
+    with db_connection() as con:
+        cur = con.cursor()
+        execute(con, cur, SQL_LLM_CALL_ROLLUPS[group], (since,))
+        return [_row_to_dict(row) for row in cur.fetchall()]
+
+
+def iter_llm_call_latencies(since, batch_size=5000):
+    """Yields (id, call_type, model, ttft_ms, latency_ms, outcome) for every call since 'since', in id order."""
+    after_id = 0
+    while True:
+        with db_connection() as con:
+            cur = con.cursor()
+            execute(con, cur, SQL_SELECT_LLM_CALL_LATENCIES, (since, after_id, batch_size))
+            rows = [_row_to_dict(row) for row in cur.fetchall()]
+        if not rows:
+            return
+        yield from rows
+        after_id = rows[-1]['id']
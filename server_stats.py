@@ -0,0 +1,31 @@
+import os
+from flask import jsonify, request, abort
+
+from app import server
+
+# --- In-process counters endpoint ---
+# Modules register a zero-argument function returning a JSON-friendly dict.
+# GET /server-stats returns all of them. Counters are per gunicorn worker
+# process, so hit the endpoint a few times to see every worker.
+
+_STATS_SOURCES = {}
+
+
+def register_stats_source(name, fn):
+    _STATS_SOURCES[name] = fn
+
+
+@server.route('/server-stats')
+def server_stats():
+    # Optional shared secret so the numbers are not public on Render.
+    token = os.environ.get('SERVER_STATS_TOKEN')
+    if token and request.args.get('token') != token:
+        abort(403)
+
+    payload = {'pid': os.getpid()}
+    for name, fn in _STATS_SOURCES.items():
+        try:
+            payload[name] = fn()
+        except Exception as e:
+            payload[name] = {'error': str(e)}
+    return jsonify(payload)
@@ -0,0 +1,98 @@
+import json
+
+import pytest
+
+SKILLS = ('logicalConsistency', 'evidenceAndExamples', 'clarityAndConcision',
+          'rebuttalEffectiveness', 'overallPersuasiveness')
+
+
+def valid_judgment():
+    return {
+        'scores': {
+            'User': {skill: 7 for skill in SKILLS},
+            'AI': {skill: 6 for skill in SKILLS},
+        },
+        'reasoning': {
+            'strongestArgumentUser': "a", 'strongestArgumentAI': "b",
+            'weakestArgumentUser': "c", 'weakestArgumentAI': "d",
+            'rebuttalAnalysis': "e", 'overallWinner': 'User',
+            'constructiveFeedbackUser': "f", 'constructiveFeedbackAI': "g",
+        },
+    }
+
+
+def no_repair(fields, schema):
+    raise AssertionError(f"unexpected repair request for {fields}")
+
+
+def test_valid_reply_is_returned_as_it_is():
+    from judgment_schema import decode, parse_stats
+
+    judgment = decode(json.dumps(valid_judgment()), 'test-valid', no_repair)
+    assert judgment['scores']['User']['logicalConsistency'] == 7.0
+    assert judgment['reasoning']['overallWinner'] == 'User'
+    assert parse_stats()['test-valid']['valid'] == 1
+
+
+def test_text_around_the_object_is_ignored():
+    from judgment_schema import parse
+
+    judgment, problems = parse("Here is my verdict:\n```json\n" + json.dumps(valid_judgment()) + "\n```")
+    assert problems == []
+    assert judgment['reasoning']['overallWinner'] == 'User'
+
+
+def test_partial_reply_is_repaired():
+    from judgment_schema import decode, parse_stats
+
+    reply = valid_judgment()
+    reply['scores']['AI']['rebuttalEffectiveness'] = 14     # out of range
+    del reply['reasoning']['overallWinner']                 # missing
+    asked = []
+
+    def repair(fields, schema):
+        asked.append(fields)
+        assert set(schema.model_fields) == {'scores', 'reasoning'}
+        return json.dumps({'scores': {'AI': {'rebuttalEffectiveness': 5}},
+                           'reasoning': {'overallWinner': 'AI'}})
+
+    judgment = decode(json.dumps(reply), 'test-repaired', repair)
+    assert asked == ["scores.AI.rebuttalEffectiveness, reasoning.overallWinner"]
+    assert judgment['scores']['AI']['rebuttalEffectiveness'] == 5.0
+    assert judgment['scores']['AI']['logicalConsistency'] == 6.0   # kept from the first reply
+    assert judgment['reasoning']['overallWinner'] == 'AI'
+    assert parse_stats()['test-repaired']['repaired'] == 1
+
+
+def test_repair_that_is_still_invalid_fails():
+    from judgment_schema import JudgmentParseError, decode, parse_stats
+
+    reply = valid_judgment()
+    reply['reasoning']['overallWinner'] = 'Nobody'
+
+    with pytest.raises(JudgmentParseError, match="reasoning.overallWinner"):
+        decode(json.dumps(reply), 'test-repair-failed',
+               lambda fields, schema: json.dumps({'reasoning': {'overallWinner': 'Both'}}))
+    assert parse_stats()['test-repair-failed']['repair_failed'] == 1
+
+
+def test_failed_repair_request_fails():
+    from judgment_schema import JudgmentParseError, decode
+
+    reply = valid_judgment()
+    del reply['scores']['User']
+
+    def repair(fields, schema):
+        raise RuntimeError("quota exceeded")
+
+    with pytest.raises(JudgmentParseError, match="repair request failed"):
+        decode(json.dumps(reply), 'test-repair-error', repair)
+
+
+def test_reply_without_json_is_unparseable():
+    from judgment_schema import JudgmentParseError, decode, parse, parse_stats
+
+    assert parse("I cannot judge this debate.") == (None, None)
+    with pytest.raises(JudgmentParseError, match="No JSON object"):
+        decode("I cannot judge this debate.", 'test-unparseable', no_repair)
+    assert parse_stats()['test-unparseable']['failure_rate'] == 1.0
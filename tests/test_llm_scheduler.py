@@ -0,0 +1,101 @@
+import time
+
+import pytest
+
+
+def make_scheduler(rpm=60, tpm=1000000, deadline=5, max_attempts=3):
+    from llm_scheduler import LLMScheduler
+    return LLMScheduler(rpm, tpm, deadline, max_attempts, backoff_max=0.05,
+                        request_timeout=5, min_attempt_budget=0.1)
+
+
+def test_set_limits_updates_keys_in_use():
+    scheduler = make_scheduler(rpm=60)
+    scheduler.acquire('key-1', 0, 'user', time.monotonic() + 1)
+    scheduler.set_limits(rpm=6)
+
+    bucket = scheduler._buckets['key-1']
+    assert (scheduler.rpm, bucket.rpm, bucket.tpm) == (6, 6, 1000000)
+    assert bucket.requests <= 6
+    assert scheduler.stats()['rpm_per_key'] == 6
+
+    scheduler.acquire('key-2', 0, 'user', time.monotonic() + 1)
+    assert scheduler._buckets['key-2'].rpm == 6
+
+
+def test_token_bucket_holds_calls_until_it_refills():
+    scheduler = make_scheduler(tpm=6000)  # 100 tokens a second
+    scheduler.acquire('bucket-key', 6000, 'user', time.monotonic() + 1)
+
+    started = time.monotonic()
+    scheduler.acquire('bucket-key', 50, 'user', time.monotonic() + 5)
+    assert 0.4 <= time.monotonic() - started < 2
+    assert scheduler.stats()['queued'] == 1
+
+
+def test_waiting_calls_are_served_fairly():
+    import threading
+
+    scheduler = make_scheduler(rpm=600)  # one request every 0.1s
+    scheduler.pause('fair-key', 0.2)     # everyone queues behind the pause
+    bucket = scheduler._buckets['fair-key']
+    granted = []
+
+    def call(user):
+        scheduler.acquire('fair-key', 0, user, time.monotonic() + 5)
+        granted.append(user)
+
+    threads = []
+    for user in ('burst', 'burst', 'burst', 'other'):
+        thread = threading.Thread(target=call, args=(user,))
+        thread.start()
+        threads.append(thread)
+        while len(bucket.waiting) < len(threads):
+            time.sleep(0.001)
+    for thread in threads:
+        thread.join()
+    # 'other' arrived last but goes before the rest of the burst.
+    assert granted == ['burst', 'other', 'burst', 'burst']
+
+
+def test_rate_limit_pauses_the_key_and_retries(monkeypatch):
+    import local_llm
+
+    monkeypatch.setattr(local_llm, 'LOCAL_LLM_RETRY_DELAY', 0.3)
+    scheduler = make_scheduler()
+    injected = local_llm.LocalLLM(seed=0)
+    attempts = []
+
+    def fn(timeout):
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            injected._fail(429)
+        return 'ok'
+
+    assert scheduler.call('429-key', fn) == 'ok'
+    assert len(attempts) == 2
+    assert attempts[1] - attempts[0] >= 0.3  # held for the delay the server asked for
+    stats = scheduler.stats()
+    assert (stats['rate_limited'], stats['retries'], stats['failures']) == (1, 1, 0)
+
+
+def test_call_fails_once_the_deadline_passes():
+    from llm_scheduler import LLMDeadlineExceeded
+
+    scheduler = make_scheduler()
+    scheduler.pause('deadline-key', 30)
+    called = []
+
+    started = time.monotonic()
+    with pytest.raises(LLMDeadlineExceeded):
+        scheduler.call('deadline-key', called.append, deadline=0.3)
+    assert time.monotonic() - started < 1
+    assert called == []
+    assert scheduler.stats()['deadline_exceeded'] == 1
+
+
+def test_request_timeout_is_cut_to_the_deadline():
+    scheduler = make_scheduler()
+    timeouts = []
+    scheduler.call('timeout-key', timeouts.append, deadline=2)
+    assert 1.5 < timeouts[0] <= 2
@@ -0,0 +1,97 @@
+import pytest
+
+PROMPT = "You are the judge. " * 20
+
+
+class Clock:
+    """Stands in for time.time() in prompt_cache."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    import prompt_cache
+    clock = Clock()
+    monkeypatch.setattr(prompt_cache.time, 'time', clock)
+    return clock
+
+
+def make_cache(min_chars=0):
+    from prompt_cache import LocalCacheBackend, PromptCache
+    return PromptCache(LocalCacheBackend(min_chars), ttl=600, refresh_margin=60, retry_after=300)
+
+
+def test_create_then_hit(clock):
+    cache = make_cache()
+    name = cache.lookup(None, 'key-1', 'model', PROMPT)
+    assert name is not None
+    assert cache.lookup(None, 'key-1', 'model', PROMPT) == name
+    assert (cache.creates, cache.hits) == (1, 1)
+    config = cache.request_config(name, PROMPT, {'temperature': 0.5})
+    assert config.system_instruction == PROMPT
+
+    # Another key gets its own cache.
+    assert cache.lookup(None, 'key-2', 'model', PROMPT) not in (None, name)
+    assert cache.creates == 2
+
+
+def test_ttl_is_refreshed_before_it_runs_out(clock):
+    cache = make_cache()
+    name = cache.lookup(None, 'key-1', 'model', PROMPT)
+    clock.now += 600 - 30  # inside the refresh margin
+    assert cache.lookup(None, 'key-1', 'model', PROMPT) == name
+    assert cache.refreshes == 1
+    clock.now += 500  # past the original expiry, but within the refreshed TTL
+    assert cache.lookup(None, 'key-1', 'model', PROMPT) == name
+    assert cache.creates == 1
+
+
+def test_expired_cache_is_created_again(clock):
+    cache = make_cache()
+    name = cache.lookup(None, 'key-1', 'model', PROMPT)
+    clock.now += 601
+    assert cache.lookup(None, 'key-1', 'model', PROMPT) not in (None, name)
+    assert cache.creates == 2
+
+
+def test_uncacheable_prompt_is_remembered(clock):
+    cache = make_cache(min_chars=len(PROMPT) + 1)
+    assert cache.lookup(None, 'key-1', 'model', PROMPT) is None
+    assert cache.lookup(None, 'key-1', 'model', PROMPT) is None
+    assert (cache.failures, cache.fallbacks) == (1, 2)
+
+    # Retried once retry_after has passed.
+    cache.backend.min_chars = 0
+    clock.now += 301
+    assert cache.lookup(None, 'key-1', 'model', PROMPT) is not None
+    assert cache.creates == 1
+
+
+def test_invalidate_forgets_the_cache(clock):
+    from prompt_cache import CacheUnavailable
+
+    cache = make_cache()
+    name = cache.lookup(None, 'key-1', 'model', PROMPT)
+    cache.invalidate(name)
+    assert cache.invalidations == 1
+    assert cache.stats()['entries'] == 0
+    assert cache.lookup(None, 'key-1', 'model', PROMPT) not in (None, name)
+
+    # A cache the backend no longer has is reported as such.
+    cache.backend._caches.clear()
+    with pytest.raises(CacheUnavailable):
+        cache.request_config(name, PROMPT, {})
+
+
+def test_entries_and_locks_do_not_pile_up(clock):
+    cache = make_cache()
+    for i in range(50):
+        cache.lookup(None, f"key-{i}", 'model', PROMPT)
+        clock.now += 601
+    assert cache._locks == {}
+    assert len(cache._entries) == 1
@@ -0,0 +1,46 @@
+import os
+
+import pytest
+
+
+@pytest.fixture
+def job_store(tmp_path, monkeypatch):
+    """jobs.submit() against a throwaway jobs database, with no workers running."""
+    import jobs
+    executor = jobs.JobExecutor(jobs.JobStore(str(tmp_path / 'jobs.db')), workers=0)
+    monkeypatch.setattr(jobs, '_executor', executor)
+    monkeypatch.setattr(jobs, '_executor_pid', os.getpid())
+    return executor
+
+
+def start_judged_debate(monkeypatch):
+    """debate_state of a new Judge Mode debate whose history row could not be created."""
+    import callbacks
+    monkeypatch.setattr(callbacks, 'start_debate_in_db', lambda username, debate_state: None)
+    outputs = callbacks.start_judged_debate(1, "Topic", 2, "Ann", "For", "Ben", "Against",
+                                            {'google_key': 'key', 'active_user': 'tester'})
+    return outputs[5]['debate_state']
+
+
+def test_same_turn_submitted_twice_gives_one_job(job_store, monkeypatch):
+    import jobs
+    from callbacks import turn_dedup_key
+
+    debate_state = start_judged_debate(monkeypatch)
+    assert debate_state['debate_id'] is None
+    payload = {'debate_state': debate_state}
+
+    first = jobs.submit('judgment', payload, dedup_key=turn_dedup_key('judgment', debate_state))
+    second = jobs.submit('judgment', payload, dedup_key=turn_dedup_key('judgment', debate_state))
+    assert first == second
+    assert job_store.stats()['coalesced'] == {'judgment': 1}
+
+    debate_state['turn_seq'] += 1
+    assert jobs.submit('judgment', payload, dedup_key=turn_dedup_key('judgment', debate_state)) != first
+
+
+def test_sessions_do_not_share_keys(monkeypatch):
+    from callbacks import turn_dedup_key
+
+    first, second = start_judged_debate(monkeypatch), start_judged_debate(monkeypatch)
+    assert turn_dedup_key('judgment', first) != turn_dedup_key('judgment', second)
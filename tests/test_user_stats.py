@@ -0,0 +1,82 @@
+import threading
+
+import pytest
+
+N_THREADS = 8
+DEBATES_PER_THREAD = 25
+OUTCOMES = ('won', 'lost', 'drawn')
+
+
+def scores_for(i):
+    """Known scores for the i-th debate of a thread (0..9, one offset per skill)."""
+    from repository import STAT_SKILLS
+    return {skill: float((i + offset) % 10) for offset, skill in enumerate(STAT_SKILLS)}
+
+
+@pytest.fixture
+def stats_db(tmp_path, monkeypatch):
+    monkeypatch.delenv('DATABASE_URL', raising=False)
+    monkeypatch.setenv('SQLITE_DB_PATH', str(tmp_path / 'app_data.db'))
+    from db_pool import close_all
+    from db_init import initialize_database
+    from repository import create_user
+    close_all()  # this thread's SQLite connection may point at another test's file
+    initialize_database()
+    create_user('Stats Tester', 'tester', 'x')
+    yield 'tester'
+    close_all()
+
+
+def test_concurrent_results_keep_exact_averages(stats_db):
+    from repository import STAT_SKILLS, apply_debate_result, get_user_stats
+
+    start = threading.Barrier(N_THREADS)
+    errors = []
+
+    def play():
+        try:
+            start.wait()
+            for i in range(DEBATES_PER_THREAD):
+                apply_debate_result(stats_db, OUTCOMES[i % 3], scores_for(i))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=play) for _ in range(N_THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+
+    stats = get_user_stats(stats_db)
+    expected = {outcome: N_THREADS * sum(1 for i in range(DEBATES_PER_THREAD) if OUTCOMES[i % 3] == outcome)
+                for outcome in OUTCOMES}
+    assert stats['debates_won'] == expected['won']
+    assert stats['debates_lost'] == expected['lost']
+    assert stats['debates_drawn'] == expected['drawn']
+    assert stats['debates_won'] + stats['debates_lost'] + stats['debates_drawn'] == N_THREADS * DEBATES_PER_THREAD
+
+    for skill in STAT_SKILLS:
+        mean = sum(scores_for(i)[skill] for i in range(DEBATES_PER_THREAD)) / DEBATES_PER_THREAD
+        assert stats[f"avg_{skill.lower()}"] == pytest.approx(mean, rel=1e-9)
+
+
+def test_missing_score_keeps_the_average(stats_db):
+    from repository import STAT_SKILLS, apply_debate_result
+
+    apply_debate_result(stats_db, 'won', {skill: 8.0 for skill in STAT_SKILLS})
+    row = apply_debate_result(stats_db, 'lost', {skill: None for skill in STAT_SKILLS})
+    assert (row['debates_won'], row['debates_lost']) == (1, 1)
+    for skill in STAT_SKILLS:
+        assert row[f"avg_{skill.lower()}"] == pytest.approx(8.0)
+
+
+def test_replayed_debate_is_counted_once(stats_db):
+    from repository import STAT_SKILLS, apply_debate_result, insert_debate
+
+    debate_id = insert_debate(stats_db, 'Practice', 'Topic', '{}', None, '2024-01-01 00:00:00')
+    apply_debate_result(stats_db, 'won', {skill: 6.0 for skill in STAT_SKILLS}, debate_id)
+    row = apply_debate_result(stats_db, 'won', {skill: 2.0 for skill in STAT_SKILLS}, debate_id)
+    assert (row['debates_won'], row['debates_lost'], row['debates_drawn']) == (1, 0, 0)
+    for skill in STAT_SKILLS:
+        assert row[f"avg_{skill.lower()}"] == pytest.approx(6.0)